@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    benchmark.py
+    ~~~~~~~~~~~~
+
+    Benchmarks for the hot paths of control.py.
+    Synthetic courses of arbitrary size are generated and the
+    time and peak memory of the main operations are measured.
+    The peak resident set size is reset before every operation
+    (Linux only), so each value belongs to its operation alone.
+
+    benchmark.py generate [--students $count] [--groups $count] [--to-dir $dir]
+    benchmark.py run [--sizes $n,$n,...] [--groups $count] [--to-json $file]
+
+    Every size is measured in a separate process, so peak RSS values
+    of different sizes do not influence each other.
+
+    (C) 2014, Lukas Prokop
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import datetime
+import tempfile
+import contextlib
+import lxml.etree
+import concurrent.futures
+
+import click  # http://click.pocoo.org/
+
+import control
+
+DEFAULT_SIZES = '1000,10000,100000,500000'
+MAX_GROUPS = 200
+
+# no name is a prefix of another one, thus generated wikinames are unique
+FIRSTNAMES = ['Alan', 'Kurt', 'Noam', 'Ada', 'Grace', 'Edsger', 'Donald',
+    'Barbara', 'Emmy', 'Jörg', 'Frances', 'Tony', 'Leslie', 'Radia']
+LASTNAMES = ['Turing', 'Gödel', 'Chomsky', 'Lovelace', 'Hopper', 'Dijkstra',
+    'Knuth', 'Liskov', 'Noether', 'Müller', 'Allen', 'Hoare', 'Lamport',
+    'Perlman']
+DEGREES = ['033.521', '033.221', '066.921', '033.243']
+ASSIGNMENTS = [
+    ('AssignmentOne', '2014-10-29', 'SubmissionOne', ''),
+    ('AssignmentTwo', '2014-11-19', 'SubmissionTwo', 'PartnerTwo'),
+    ('AssignmentThree', '2014-12-10', 'SubmissionThree', 'PartnerThree')
+]
+
+
+# ------------------------------- generators ------------------------------
+
+def default_groups(count):
+    """Number of groups for `count` students (roughly 30 per group)"""
+    return max(1, min(MAX_GROUPS, count // 30))
+
+
+def suffix(i):
+    """Lowercase base-26 representation of `i` making names unique"""
+    letters = ''
+    while True:
+        i, rem = divmod(i, 26)
+        letters = chr(97 + rem) + letters
+        if i == 0:
+            return letters
+
+
+def synthetic_students(count, groups, *, offset=0, seed=42):
+    """Generate `count` students distributed over `groups` groups.
+    Matriculation numbers start at 1000000 + `offset`.
+
+    :param count:       number of students
+    :type count:        int
+    :param groups:      number of tutorial groups (group 0 excluded)
+    :type groups:       int
+    :param offset:      index of the first student
+    :type offset:       int
+    :param seed:        seed for the random number generator
+    :type seed:         int
+    :return:            generator of Student instances
+    :type return:       generator
+    """
+    rand = random.Random(seed + offset)
+    start = datetime.datetime(2014, 9, 1, 8, 0, 0)
+    for i in range(offset, offset + count):
+        s = control.Student()
+        s.matrnr = 1000000 + i
+        s.group = {0, 1 + i % groups}
+        s.firstname = FIRSTNAMES[i % len(FIRSTNAMES)]
+        s.lastname = LASTNAMES[(i // len(FIRSTNAMES)) % len(LASTNAMES)] + suffix(i)
+        s.degree = rand.choice(DEGREES)
+        s.regdate = start + datetime.timedelta(minutes=rand.randrange(60 * 24 * 40))
+        s.email = 'student{}@student.tugraz.at'.format(i)
+        yield s
+
+
+def write_student_csv(filepath, students, *, encoding='utf-8-sig'):
+    """Write `students` in the format of a TUGrazOnline CSV export"""
+    inverse = {v: k for k, v in control.MAPPING_CSV_XML.items()}
+    columns = ['group', 'lastname', 'firstname', 'matriculation-number',
+        'degree-programme', 'registration-date', 'email']
+    with open(filepath, 'w', encoding=encoding, newline='') as fp:
+        writer = csv.writer(fp,
+            dialect=control.csv_export_dialect_semicolon)
+        writer.writerow([inverse[c] for c in columns])
+        for s in students:
+            grp = max(s.group)
+            writer.writerow(['Gruppe {}'.format(grp) if grp else 'Standardgruppe',
+                s.lastname, s.firstname, s.matrnr, s.degree,
+                s.regdate.strftime('%d.%m.%Y,%H:%M'), s.email])
+
+
+def write_students_xml(filepath, students):
+    """Write `students` as students.xml"""
+    xml = lxml.etree.Element('students')
+    for s in students:
+        xml.append(s.to_xml())
+    lxml.etree.ElementTree(xml).write(filepath, encoding='utf-8',
+        pretty_print=True, xml_declaration=True)
+
+
+def write_metadata_xml(filepath, groups):
+    """Write a metadata.xml with `groups` groups and 1 tutor per 3 groups"""
+    config = control.Config()
+    config.add_course('Grundlagen der Informatik', 'Alan Turing', 'practicals', '716.231')
+    config.add_course('Grundlagen der Informatik (CS)', 'Alan Turing', 'practicals', '716.233')
+    config.add_course('Grundlagen der Informatik', 'Don Knuth', 'lecture', '716.232')
+    config.add_course('Grundlagen der Informatik (CS)', 'Don Knuth', 'lecture', '716.234')
+    tutors = [config.add_tutor(LASTNAMES[t % len(LASTNAMES)],
+                  FIRSTNAMES[t % len(FIRSTNAMES)], 'tutor{}@example.org'.format(t))
+              for t in range(groups // 3 + 1)]
+    for grp in range(1, groups + 1):
+        config.add_group(tutors[grp % len(tutors)], grp)
+    for name, deadline, sub, partner in ASSIGNMENTS:
+        config.add_assignment(name, control.parse_date(deadline), sub, partner)
+    for repr_, (mini, maxi) in enumerate([(88, 100), (76, 87), (63, 75),
+                                          (51, 62), (0, 50)], 1):
+        config.add_grade(repr_, mini, maxi)
+    config.set_wiki('http://gdi.ist.tugraz.at/gdi/', '/var/www/gdi/')
+    lxml.etree.ElementTree(config.to_xml()).write(filepath,
+        encoding='utf-8', pretty_print=True, xml_declaration=True)
+
+
+def write_grading_points(filepath, *, exercises=6, criteria=4):
+    """Write a GradingPoints.txt Foswiki table for all assignments.
+    With the defaults the SUM formulas must be split.
+    """
+    with open(filepath, 'w', encoding='utf-8-sig') as fp:
+        for name, _deadline, _sub, _partner in ASSIGNMENTS:
+            fp.write('| *{}* || {} |\n'.format(name, exercises * criteria * 2))
+            for e in range(1, exercises + 1):
+                fp.write('| Exercise {} | | {} |\n'.format(e, criteria * 2))
+                for c in range(1, criteria + 1):
+                    fp.write('| | Criterion {} | 2 |\n'.format(c))
+
+
+def generate_course(directory, count, groups):
+    """Generate all input files of a synthetic course in `directory`.
+
+    :return:    {kind: filepath}
+    :type return:   dict
+    """
+    paths = {
+        'csv': os.path.join(directory, 'TN_LV716231_synthetic.csv'),
+        'students': os.path.join(directory, 'students.xml'),
+        'other': os.path.join(directory, 'students-other.xml'),
+        'metadata': os.path.join(directory, 'metadata.xml'),
+        'grading': os.path.join(directory, 'GradingPoints.txt'),
+    }
+    write_student_csv(paths['csv'], synthetic_students(count, groups))
+    write_students_xml(paths['students'], synthetic_students(count, groups))
+    # half of the other database overlaps with the first one
+    write_students_xml(paths['other'],
+        synthetic_students(count, groups, offset=count // 2))
+    write_metadata_xml(paths['metadata'], groups)
+    write_grading_points(paths['grading'])
+    return paths
+
+
+# ------------------------------- measuring -------------------------------
+
+@contextlib.contextmanager
+def measure(results, phase):
+    """Record elapsed time, peak RSS and its growth above the RSS at the
+    start of the enclosed block (None if unknown)
+    """
+    measured = control.reset_peak_rss()
+    rss = control.rss_kb()
+    start = time.perf_counter()
+    yield
+    seconds = round(time.perf_counter() - start, 6)
+    peak = control.rss_kb('VmHWM') if measured else None
+    results[phase] = {
+        'seconds': seconds,
+        'peak_rss_kb': peak,
+        'peak_growth_kb': None if peak is None or rss is None else peak - rss
+    }
+
+
+def run_size(count, groups):
+    """Benchmark all hot paths for one course size. Runs in a worker process.
+
+    :return:    {phase: {seconds, peak_rss_kb, peak_growth_kb}}
+    :type return:   dict
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='gdi-bench-') as directory, \
+         open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        with measure(results, 'generate'):
+            paths = generate_course(directory, count, groups)
+
+        with measure(results, 'parse_student_csv'):
+            control.parse_student_csv(paths['csv'])
+
+        with measure(results, 'read_xml'):
+            xml = control.read_xml(paths['students'])
+        with measure(results, 'from_xml'):
+            db = control.StudentDatabase().from_xml(xml)
+        other = control.StudentDatabase().from_xml(control.read_xml(paths['other']))
+
+        with measure(results, 'to_xml'):
+            lxml.etree.tostring(db.to_xml())
+
+        with measure(results, 'filter'):
+            for grp in range(1, min(groups, 10) + 1):
+                db.filter(group=grp)
+
+        with measure(results, 'union'):
+            db.union(other)
+
+        with measure(results, 'difference'):
+            db.difference(other)
+
+        config = control.Config()
+        config.from_xml(control.read_xml(paths['metadata']))
+        outpath = os.path.join(directory, control.default_spreadsheet_filepath())
+        with measure(results, 'spreadsheets_create'):
+            grading = control.GradingScheme.from_file(paths['grading'])
+            # group 0 contains all lecture participants
+            for grp in db.all_groups().difference({0}):
+                control.create_group_spreadsheets(config, db, grading, grp, outpath, 'utf-8')
+                control.create_title_group_spreadsheet(config, db, grading, grp, outpath, 'utf-8')
+
+    return results
+
+
+# ------------------------- CLI parsing and main --------------------------
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--students', 'count', default=1000, help='number of students to generate')
+@click.option('--groups', 'groups', type=int, help='number of groups (default: 1 per 30 students, at most 200)')
+@click.option('--to-dir', 'directory', default='.', help='directory to write the course files to')
+def generate(count, groups, directory):
+    """Generate synthetic CSV, students.xml, metadata.xml and GradingPoints.txt"""
+    groups = groups or default_groups(count)
+    os.makedirs(directory, exist_ok=True)
+    for kind, path in sorted(generate_course(directory, count, groups).items()):
+        print('Wrote {} file {}'.format(kind, path))
+
+
+@cli.command()
+@click.option('--sizes', 'sizes', default=DEFAULT_SIZES, help='comma-separated numbers of students')
+@click.option('--groups', 'groups', type=int, help='number of groups (default: 1 per 30 students, at most 200)')
+@click.option('--to-json', 'dest', default='benchmark.json', help='file to write timings to')
+def run(sizes, groups, dest):
+    """Measure the hot paths of control.py for all given sizes"""
+    report = {
+        'python': sys.version.split()[0],
+        'date': datetime.datetime.now().isoformat(),
+        'sizes': []
+    }
+    for count in map(int, sizes.split(',')):
+        grps = groups or default_groups(count)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+            phases = pool.submit(run_size, count, grps).result()
+        report['sizes'].append({'students': count, 'groups': grps, 'phases': phases})
+
+        table = [['phase', 'seconds', 'peak RSS [KiB]', 'growth [KiB]']]
+        for phase, data in phases.items():
+            table.append([phase, data['seconds'],
+                '?' if data['peak_rss_kb'] is None else data['peak_rss_kb'],
+                '?' if data['peak_growth_kb'] is None else data['peak_growth_kb']])
+        print('{} students in {} groups'.format(count, grps))
+        control.print_cli_table(table, 2)
+        print()
+
+    with open(dest, 'w', encoding='utf-8') as fp:
+        json.dump(report, fp, indent=2)
+    print('Timings written to {}'.format(dest))
+
+
+if __name__ == '__main__':
+    sys.exit(cli(sys.argv[1:]))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    client.py
+    ~~~~~~~~~
+
+    Thin client of `control.py serve`.
+    The command line is sent to the daemon over its Unix socket and
+    the answer is printed. Neither lxml nor click is imported and no
+    database is parsed, hence repeated queries return in milliseconds.
+
+    client.py [--socket $control.sock] students read COMMANDS
+    client.py [--socket $control.sock] spreadsheets create OPTIONS
+    client.py [--socket $control.sock] stats COMMAND
+
+    The socket defaults to $GDI_SOCKET or control.sock.
+
+    (C) 2014, Lukas Prokop
+"""
+
+import os
+import sys
+import json
+import socket
+
+
+def default_socket_filepath():
+    """Return default filepath of the Unix socket (like control.py)"""
+    return os.environ.get('GDI_SOCKET', 'control.sock')
+
+
+def request(socket_path, argv):
+    """Send `argv` to the daemon and return its answer.
+
+    :param socket_path:     Unix socket of the daemon
+    :type socket_path:      str
+    :param argv:            command line arguments for control.py
+    :type argv:             list
+    :return:                {'status': exit code, 'stdout': text, 'stderr': text}
+    :type return:           dict
+    """
+    message = json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path)
+        conn.sendall(message.encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def main(argv):
+    socket_path = default_socket_filepath()
+    if argv[:1] == ['--socket']:
+        socket_path, argv = argv[1], argv[2:]
+
+    try:
+        answer = request(socket_path, argv)
+    except OSError as exc:
+        print('Cannot reach control.py serve at {}: {}'.format(socket_path, exc),
+            file=sys.stderr)
+        return 1
+    sys.stdout.write(answer['stdout'])
+    sys.stderr.write(answer['stderr'])
+    return answer['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -29,9 +29,11 @@
     students read [--students $students.xml] --to-To-header COMMANDS
     students read [--students $students.xml] --to-unprocessed-registrations COMMANDS
     students read [--students $students.xml] --to-group-meta-preferences COMMANDS
+    students read [--students $students.xml] --to-ndjson|--to-csv COMMANDS
     students read [--students $students.xml] COMMANDS
         where COMMANDS is
-            (--group-by-group|--group-by-regdate)
+            --output $file [--encoding $utf-8]
+            (--group-by-group|--group-by-regdate [--regdate-bucket batch|day|week])
             (--all-email|--all-wikiname|--all-matriculation-number)
             (--filter $key=$value)*
             --filter-newer-than $date
@@ -40,19 +42,46 @@
     students update [--students $students.xml] --from-csv $csvfile [--from-encoding $utf-8-sig] [--to-xml $students2.xml] [--to-encoding $utf-8]
     students update [--students $students.xml] --from-xml $otherstudents.xml [--to-xml $students2.xml] [--to-encoding $utf-8]
     students update [--students $students.xml] [--import-grade $spreadsheetcsv]+
+    students sync [--students $students.xml] --from-dir $exportdir [--pattern $TN_*.csv] [--state $students-sync.json] [--workers $n]
     students delete [--students $students.xml] --matriculation-number
-    students export [--students $students.xml] --to-csv
+    students mail [--students $students.xml] --template $template.txt --from $sender [--per-student|--per-group] [--group $grp_id] [--smtp-host $localhost] [--smtp-port $25] [--connections $4] [--rate $5] [--retries $3] [--dry-run]
+    students assign [--students $students.xml] [--metadata $metadata.xml] [--preferences $preferences.csv] [--reassign] [--dry-run]
+    students shard --store $directory --course $course_id [--term $YY] [--students $students.xml] [--state $students-sync.json]
+    students carry-over [--students $students.xml] [--from $students-YY.xml|$term-YY.zip]+ [--to-xml $students2.xml] [--to-encoding $utf-8]
+    students partners [--students $students.xml] [--metadata $metadata.xml] [--assignment $name]* [--wiki-path $dir] [--cache $partners-cache.json] [--workers $8]
+    students duplicates [--students $students.xml] [--max-distance $2]
+    students export [--students $students.xml] [--metadata $metadata.xml] [--to-csv $grades-{course}.csv] [--to-encoding $utf-8-sig] [--dialect semicolon|comma] [--state $students-sync.json] [--all-students] [--format grades|columns|npz] [--to-file $students.gdicol]
     students diff [$file.xml|$file.csv]
     students unify [$file.xml]+
-    spreadsheets create [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--grading-encoding $utf-8-sig] [--group $grp_id] [--to-csv $csv_file] [--to-encoding $utf-8-sig]
+    spreadsheets create [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--grading-encoding $utf-8-sig] [--group $grp_id] [--to-csv $csv_file] [--to-encoding $utf-8-sig] [--manifest $manifest.json] [--force]
+    spreadsheets create [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--grading-encoding $utf-8-sig] [--group $grp_id] --format workbook [--workbook-per group|course] [--to-xlsx $xlsx_file]
     spreadsheets read [--students $students.xml] [--group $grp_id]
-    spreadsheets update [--students $students.xml] [--group $grp_id]
+    spreadsheets update [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--group $grp_id] [--csv $csv_file] [--encoding $utf-8-sig] [--manifest $manifest.json]
     foswiki permissions --check $folder
     foswiki permissions --modify $spec
     foswiki users --all-exist $webindexfile
     foswiki users --check-consistency-with-db $folder
     stats create
-    recreate
+    serve [--socket $control.sock] [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--poll $1.0]
+    watch [--students $students.xml] [--metadata $metadata.xml] [--grading $GradingPoints.txt] [--csv $csv_file] [--registrations $file] [--grades $grades-{course}.csv] [--debounce $0.5] [--once]
+    recreate archive [--term $YY] [--students $students-YY.xml] [--metadata $metadata-YY.xml] [--include $pattern]* [--to-zip $term-YY.zip]
+    recreate lookup --matriculation-number $matrnr [--archives $term-*.zip]
+
+    Every --students/--to-xml students database ending in .sqlite, .sqlite3
+    or .db is stored in SQLite. Updates of a SQLite store are incremental.
+    A directory with a shards.json manifest is read as sharded store with
+    one database per course and term (see 'students shard'). Queries run
+    on all shards in parallel. A student of several shards is listed once
+    with the groups of all shards and the other data of the latest term.
+
+    Global options (before the command):
+      --profile                 print time, calls and peak RSS per phase
+      --profile-json $file      write the same data as JSON
+      --profile-pstats $file    dump cProfile statistics for pstats
+      --log-level $warning      one of debug, info, warning, error
+      --metrics $file           append counters (students parsed, merged,
+                                filtered, files written, mails sent) to $file
+      --metrics-format $jsonl   jsonl or statsd
 
     ./spreadsheets.py pertwikiname "TWikiname is {}" file.csv
 
@@ -61,6 +90,7 @@
 
 
     Requirements:
+      - python >= 3.9
       - lxml.etree == 3.4.0
 
     (C) 2014, Lukas Prokop
@@ -71,19 +101,47 @@ import re
 import sys
 import csv
 import copy
+import mmap
+import array
+import ctypes
+import glob
+import heapq
+import json
+import bisect
 import math
+import time
 import os.path
+import hashlib
+import asyncio
+import smtplib
 import logging
+import select
+import signal
+import sqlite3
+import struct
 import argparse
 import datetime
+import cProfile
 import textwrap
+import zipfile
 import functools
+import ctypes.util
+import itertools
+import contextlib
 import lxml.etree
+import email.utils
 import collections
+import email.message
+import concurrent.futures
 import unicodedata
 
 import click  # http://click.pocoo.org/
 
+try:
+    import numpy  # only for the npz export
+except ImportError:
+    numpy = None
+
 __author__ = 'Lukas Prokop'
 __version__ = '0.0.1-alpha'
 __license__ = 'Public Domain'
@@ -93,8 +151,10 @@ __program__ = 'control.py'
 metadata = None
 students = None
 
-# tested with python 3.4
-assert sys.version_info >= (3, 2), "python2 unsupported"
+log = logging.getLogger(__program__)
+
+# asyncio.to_thread, logging.basicConfig(force=True), datetime.fromisoformat
+assert sys.version_info >= (3, 9), "python 3.9 or newer required"
 
 # -------------------------------- config ---------------------------------
 
@@ -120,6 +180,9 @@ MAPPING_CSV_XML = {
     'E-Mail': 'email'
 }
 
+# Header field of the grade in CSV files uploaded to TUGrazOnline
+GRADE_CSV_FIELD = 'Note'
+
 # Map XML elements to Main/UnprocessedRegistrations header fields
 MAPPING_XML_REGISTRATION = {
     'firstname': 'FirstName',
@@ -281,17 +344,22 @@ def request(question, datatype=str, *, nonempty=True):
     return value
 
 
+def debug(message, *args, **argf):
+    """Log `message` for debugging purposes"""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(message.format(*args, **argf))
+
+
 def info(message, *args, **argf):
     """Inform user with `message`"""
-    msg = message.format(*args, **argf)
-    print(msg)
-    print()
+    if log.isEnabledFor(logging.INFO):
+        log.info(message.format(*args, **argf))
 
 
 def warn(message, *args, **argf):
     """Warn user with `message`"""
-    msg = message.format(*args, **argf)
-    print('Warning!  ' + msg, file=sys.stderr)
+    if log.isEnabledFor(logging.WARNING):
+        log.warning(message.format(*args, **argf))
 
 
 def print_cli_table(table, indentation=0, *, stream=sys.stdout):
@@ -383,6 +451,138 @@ def gentolist(f):
     return inner
 
 
+def rss_kb(field='VmRSS'):
+    """Resident set size (VmRSS) or its peak (VmHWM) of this process in KiB.
+    None where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/status', encoding='ascii') as fp:
+            for line in fp:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size (VmHWM) of this process (Linux).
+    Return False if this is not supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as fp:
+            fp.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+    """Lightweight timers for the main phases of a run.
+    For every phase the inclusive elapsed time, the number of calls and
+    the peak resident set size during the phase are recorded, the latter
+    as absolute value and as growth above the size at its start (maximum
+    over all calls). Peaks are measured by resetting the peak of the
+    process (Linux only, otherwise unknown); nested phases pass their
+    peaks on to the enclosing phase. Nothing is recorded unless
+    `enabled` is set.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = collections.OrderedDict()
+        self.peaks = []   # peak RSS so far of the active phases
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        if self.peaks:
+            self.peaks[-1] = max(self.peaks[-1], rss_kb('VmHWM') or 0)
+        measured = reset_peak_rss()
+        self.peaks.append(0)
+        rss = rss_kb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = max(self.peaks.pop(), rss_kb('VmHWM') or 0)
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            data = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0,
+                'peak_rss_kb': None, 'peak_growth_kb': None})
+            data['seconds'] += elapsed
+            data['calls'] += 1
+            if measured and rss is not None:
+                data['peak_rss_kb'] = max(data['peak_rss_kb'] or 0, peak)
+                data['peak_growth_kb'] = max(data['peak_growth_kb'] or 0, peak - rss)
+
+    def report(self, *, stream=sys.stderr):
+        """Print the collected data as CLI table to `stream`"""
+        table = [['phase', 'seconds', 'calls', 'peak RSS [KiB]', 'growth [KiB]']]
+        for name, data in self.phases.items():
+            table.append([name, '{:.6f}'.format(data['seconds']), data['calls'],
+                '?' if data['peak_rss_kb'] is None else data['peak_rss_kb'],
+                '?' if data['peak_growth_kb'] is None else data['peak_growth_kb']])
+        print_cli_table(table, stream=stream)
+
+    def to_json(self):
+        return json.dumps(self.phases, indent=2)
+
+
+profiler = Profiler()
+
+
+class Metrics:
+    """Counters of a run (students parsed, merged, filtered, files written).
+    If a sink filepath is configured, the counters are appended to it
+    as JSON lines or StatsD-compatible text when `flush` is called.
+    """
+    formats = ('jsonl', 'statsd')
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.filepath = None
+        self.format = 'jsonl'
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+    def flush(self):
+        """Append all counters to the sink and reset them"""
+        if not self.filepath or not self.counters:
+            return
+        timestamp = datetime.datetime.now().isoformat()
+        with open(self.filepath, 'a', encoding='utf-8') as fp:
+            for name, value in sorted(self.counters.items()):
+                if self.format == 'statsd':
+                    fp.write('gdi.{}:{}|c\n'.format(name, value))
+                else:
+                    fp.write(json.dumps({'metric': name, 'value': value,
+                        'timestamp': timestamp}) + '\n')
+        self.counters.clear()
+
+
+metrics = Metrics()
+
+
+def profiled(name):
+    """A decorator recording every call of the decorated function
+    as phase `name` in the global profiler.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            if not profiler.enabled:
+                return f(*args, **kwargs)
+            with profiler.phase(name):
+                return f(*args, **kwargs)
+        return inner
+    return decorator
+
+
 def read_foswiki_table(filepath, *, encoding='utf-8-sig'):
     """Read a Foswiki table from a Foswiki article.
     Remark. Markup is *not* removed!
@@ -416,7 +616,7 @@ def read_foswiki_table(filepath, *, encoding='utf-8-sig'):
     return table
 
 
-def print_foswiki_table(table, *, stream=sys.stdout):
+def print_foswiki_table(table, *, stream=None):
     """Given a `table` like ``[['name', 'date'], ['Alan', 1954]]``,
     the table is printed at the stdout like::
 
@@ -428,16 +628,29 @@ def print_foswiki_table(table, *, stream=sys.stdout):
 
     :param table:       A list containing the table content
     :type table:        list | tuple
-    :param stream:      the stream to print
+    :param stream:      the stream to print (default: stdout)
     :type stream:       filehandler
     """
+    for rowid, row in enumerate(table):
+        print(foswiki_row(row, rowid == 0), file=stream)
+
+
+def foswiki_row(row, is_header=False):
+    """Format one row of a Foswiki table (see `print_foswiki_table`)
+
+    :param row:         values of the row
+    :type row:          list | tuple
+    :param is_header:   format values as centered headers
+    :type is_header:    bool
+    :return:            the row without trailing newline
+    :type return:       str
+    """
     center = lambda x: '  ' + str(x) + '  '
     leftify = lambda x: ' ' + str(x) + ' '
-    min_width = 30
     LINE = '|{}|'
     SEP = '|'
 
-    def value(text, is_header):
+    def value(text):
         text = str(text)
         assert '\n' not in text
         if is_header:
@@ -445,11 +658,7 @@ def print_foswiki_table(table, *, stream=sys.stdout):
         else:
             return leftify(text)
 
-    for rowid, row in enumerate(table):
-        if rowid == 0:
-            print(LINE.format(SEP.join(value(t, True) for t in row)))
-        else:
-            print(LINE.format(SEP.join(value(t, False) for t in row)))
+    return LINE.format(SEP.join(value(t) for t in row))
 
 
 def parse_group_id(val):
@@ -467,6 +676,233 @@ def parse_group_id(val):
     return int(re.sub(r'\D', '', val), base=10)
 
 
+def transliterate(text):
+    """ASCII representation of `text` by NFKD decomposition
+    (eg. 'Gödel' becomes 'Godel'). Other non-ASCII characters are dropped.
+    """
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def cologne_phonetic(word):
+    """Phonetic code of `word` according to the Cologne phonetics
+    (Kölner Phonetik), which suits German names. 'Gödel', 'Goedel'
+    and 'Goedl' are all encoded as '425'.
+
+    :param word:    a single name
+    :type word:     str
+    :return:        a string of digits
+    :type return:   str
+    """
+    letters = [c for c in transliterate(word.replace('ß', 'ss')).upper() if c.isalpha()]
+    digits = ''
+    for i, c in enumerate(letters):
+        prev = letters[i - 1] if i > 0 else ''
+        succ = letters[i + 1] if i + 1 < len(letters) else ''
+        if c in 'AEIJOUY':
+            digits += '0'
+        elif c == 'B':
+            digits += '1'
+        elif c == 'P':
+            digits += '3' if succ == 'H' else '1'
+        elif c in 'DT':
+            digits += '8' if succ and succ in 'CSZ' else '2'
+        elif c in 'FVW':
+            digits += '3'
+        elif c in 'GKQ':
+            digits += '4'
+        elif c == 'C' and i == 0:
+            digits += '4' if succ and succ in 'AHKLOQRUX' else '8'
+        elif c == 'C':
+            digits += '4' if succ and succ in 'AHKOQUX' and prev not in 'SZ' else '8'
+        elif c == 'X':
+            digits += '8' if prev and prev in 'CKQ' else '48'
+        elif c == 'L':
+            digits += '5'
+        elif c in 'MN':
+            digits += '6'
+        elif c == 'R':
+            digits += '7'
+        elif c in 'SZ':
+            digits += '8'
+        # H is ignored
+
+    collapsed = [d for i, d in enumerate(digits) if i == 0 or d != digits[i - 1]]
+    return ''.join(d for i, d in enumerate(collapsed) if d != '0' or i == 0)
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein distance of strings `a` and `b`. Only the diagonal
+    band of width 2 * `limit` + 1 is computed and the computation stops
+    as soon as the distance exceeds `limit`; `limit + 1` is returned
+    in this case.
+
+    :param a:       some string
+    :type a:        str
+    :param b:       another string
+    :type b:        str
+    :param limit:   maximum distance of interest
+    :type limit:    int
+    :return:        the distance
+    :type return:   int
+    """
+    if a == b:
+        return 0
+    if len(a) > len(b):
+        a, b = b, a
+    if limit is None:
+        limit = len(b)
+    if len(b) - len(a) > limit:
+        return limit + 1
+
+    beyond = limit + 1
+    previous = [i if i <= limit else beyond for i in range(len(a) + 1)]
+    for j, cb in enumerate(b, 1):
+        lo, hi = max(1, j - limit), min(len(a), j + limit)
+        current = [beyond] * (len(a) + 1)
+        current[0] = j if j <= limit else beyond
+        best = current[0]
+        for i in range(lo, hi + 1):
+            cost = previous[i - 1] + (a[i - 1] != cb)
+            if previous[i] + 1 < cost:
+                cost = previous[i] + 1
+            if current[i - 1] + 1 < cost:
+                cost = current[i - 1] + 1
+            current[i] = cost
+            if cost < best:
+                best = cost
+        if best > limit:
+            return beyond
+        previous = current
+    return min(previous[-1], beyond)
+
+
+class MinCostFlow:
+    """Flow network with integral capacities and costs.
+    `solve` uses the primal-dual method: Dijkstra's algorithm on reduced
+    costs yields node potentials, then a blocking flow is pushed along all
+    shortest paths at once (like Dinic's algorithm). The number of
+    phases is bounded by the number of distinct path costs.
+    """
+
+    def __init__(self, nodes):
+        self.graph = [[] for _ in range(nodes)]
+        self.to = []
+        self.cap = []
+        self.cost = []
+
+    def add_edge(self, u, v, cap, cost=0):
+        """Add an edge from `u` to `v` and return its index"""
+        index = len(self.to)
+        self.graph[u].append(index)
+        self.to.append(v)
+        self.cap.append(cap)
+        self.cost.append(cost)
+        self.graph[v].append(index + 1)
+        self.to.append(u)
+        self.cap.append(0)
+        self.cost.append(-cost)
+        return index
+
+    def flow(self, edge):
+        """Flow along the edge with index `edge`"""
+        return self.cap[edge ^ 1]
+
+    def _potentials(self, source, sink, potential):
+        """Update `potential` by the shortest distances from `source`.
+        Return False if `sink` is unreachable.
+        """
+        to, cap, cost = self.to, self.cap, self.cost
+        infinity = float('inf')
+        dist = [infinity] * len(self.graph)
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in self.graph[u]:
+                if cap[e] > 0:
+                    v = to[e]
+                    nd = d + cost[e] + potential[u] - potential[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+        if dist[sink] == infinity:
+            return False
+        for v, d in enumerate(dist):
+            potential[v] += min(d, dist[sink])
+        return True
+
+    def _blocking_flow(self, source, sink, potential, limit):
+        """Push flow along edges of zero reduced cost. Return its value."""
+        graph, to, cap, cost = self.graph, self.to, self.cap, self.cost
+
+        level = [-1] * len(graph)
+        level[source] = 0
+        queue = collections.deque([source])
+        while queue:
+            u = queue.popleft()
+            pu = potential[u]
+            for e in graph[u]:
+                v = to[e]
+                if level[v] < 0 and cap[e] > 0 and cost[e] + pu == potential[v]:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        if level[sink] < 0:
+            return 0
+
+        # iterative depth-first search, edges before `pointer[u]` are exhausted
+        pointer = [0] * len(graph)
+        total, path, u = 0, [], source
+        while total < limit:
+            if u == sink:
+                amount = min(limit - total, min(cap[e] for e in path))
+                for e in path:
+                    cap[e] -= amount
+                    cap[e ^ 1] += amount
+                total += amount
+                path, u = [], source
+                continue
+            edges, i = graph[u], pointer[u]
+            next_level, pu = level[u] + 1, potential[u]
+            while i < len(edges):
+                e = edges[i]
+                v = to[e]
+                if cap[e] > 0 and level[v] == next_level and cost[e] + pu == potential[v]:
+                    break
+                i += 1
+            pointer[u] = i
+            if i < len(edges):
+                path.append(edges[i])
+                u = to[edges[i]]
+            elif u == source:
+                break
+            else:
+                # dead end, retreat and skip the edge leading here
+                level[u] = -1
+                u = to[path.pop() ^ 1]
+                pointer[u] += 1
+        return total
+
+    def solve(self, source, sink, maxflow):
+        """Send at most `maxflow` units from `source` to `sink` at minimum cost.
+        Edge costs must be non-negative.
+
+        :return:        (flow value, total cost)
+        :type return:   tuple
+        """
+        potential = [0] * len(self.graph)
+        total, total_cost = 0, 0
+        while total < maxflow and self._potentials(source, sink, potential):
+            while total < maxflow:
+                pushed = self._blocking_flow(source, sink, potential, maxflow - total)
+                if not pushed:
+                    break
+                total += pushed
+                total_cost += pushed * (potential[sink] - potential[source])
+        return total, total_cost
+
+
 def parse_iso8601(datestr):
     """Parse an ISO date like '2014-10-18T23:47:06.722897' as returned
     by (eg.) `datetime.datetime.now().isoformat()`.
@@ -512,6 +948,58 @@ def default_spreadsheet_filepath():
     return 'group{group}-{assignment}.csv'
 
 
+def default_workbook_filepath(per='group'):
+    """Return default filepath for workbooks
+
+    :param per:     'group' for one workbook per group, 'course' for one workbook
+    :type per:      str
+    :return:        default filepath
+    :type return:   str
+    """
+    if per == 'group':
+        return 'group{group}.xlsx'
+    return 'groups-{}.xlsx'.format(datetime.datetime.now().strftime('%y'))
+
+
+def default_manifest_filepath():
+    """Return default filepath for the build manifest of spreadsheets
+
+    :return:        default filepath
+    :type return:   str
+    """
+    return 'spreadsheets-manifest.json'
+
+
+def default_sync_state_filepath():
+    """Return default filepath for the record of ingested CSV exports
+
+    :return:        default filepath
+    :type return:   str
+    """
+    return 'students-sync.json'
+
+
+def default_grades_filepath():
+    """Return default filepath pattern for grade exports.
+    '{course}' is replaced by the course identifier.
+
+    :return:        default filepath pattern
+    :type return:   str
+    """
+    return 'grades-{course}.csv'
+
+
+def default_columns_filepath(fmt='columns'):
+    """Return default filepath for the columnar export
+
+    :param fmt:     'columns' or 'npz'
+    :type fmt:      str
+    :return:        default filepath
+    :type return:   str
+    """
+    return 'students.{}'.format('npz' if fmt == 'npz' else 'gdicol')
+
+
 def default_gradingpoints_filepath():
     """Return default filepath for grading points
 
@@ -520,22 +1008,80 @@ def default_gradingpoints_filepath():
     """
     return 'GradingPoints.txt'
 
-def default_metadata_filepath():
+def default_term():
+    """Return the current term as two-digit year like '14'
+
+    :return:        term identifier
+    :type return:   str
+    """
+    return datetime.datetime.now().strftime('%y')
+
+
+def term_order(term):
+    """Sort key of a term identifier like '14' in chronological order.
+    Two-digit years are read like '%y' ('69' to '99' are 1969 to 1999,
+    '00' to '68' are 2000 to 2068). Other identifiers sort last.
+
+    :param term:    term identifier
+    :type term:     str
+    :return:        sort key
+    :type return:   tuple
+    """
+    try:
+        return 0, datetime.datetime.strptime(term, '%y').year, term
+    except (TypeError, ValueError):
+        return 1, 0, str(term)
+
+
+def default_metadata_filepath(term=None):
     """Return default filepath for metadata.xml
 
+    :param term:    term identifier (default: current term)
+    :type term:     str
     :return:        default filepath
     :type return:   str
     """
-    return 'metadata-{}.xml'.format(datetime.datetime.now().strftime('%y'))
+    return 'metadata-{}.xml'.format(term or default_term())
 
 
-def default_students_filepath():
+def default_students_filepath(term=None):
     """Return default filepath for students.xml
 
+    :param term:    term identifier (default: current term)
+    :type term:     str
     :return:        default filepath
     :type return:   str
     """
-    return 'students-{}.xml'.format(datetime.datetime.now().strftime('%y'))
+    return 'students-{}.xml'.format(term or default_term())
+
+
+def default_socket_filepath():
+    """Return default filepath of the Unix socket of `serve`
+
+    :return:        default filepath
+    :type return:   str
+    """
+    return os.environ.get('GDI_SOCKET', 'control.sock')
+
+
+def default_archive_filepath(term=None):
+    """Return default filepath for the archive of a term
+
+    :param term:    term identifier (default: current term)
+    :type term:     str
+    :return:        default filepath
+    :type return:   str
+    """
+    return 'term-{}.zip'.format(term or default_term())
+
+
+def default_partner_cache_filepath():
+    """Return default filepath for the cache of parsed partner topics
+
+    :return:        default filepath
+    :type return:   str
+    """
+    return 'partners-cache.json'
 
 
 # ------------------------------ data model -------------------------------
@@ -545,6 +1091,9 @@ class HashableDict(dict):
         return hash(tuple(sorted(self.items())))
 
 
+TermRecord = collections.namedtuple('TermRecord', ['term', 'grade', 'group'])
+
+
 class Student:
     """A class representing a student"""
     matrnr = 0
@@ -555,6 +1104,7 @@ class Student:
     regdate = datetime.datetime.now()
     email = ''
     grade = 0
+    history = ()  # TermRecords of previous terms
     _wikiname = ''
 
     _map = {'matriculation-number': 'matrnr', 'group': 'group',
@@ -594,18 +1144,39 @@ class Student:
         except IndexError:
             raise ValueError("Student data " + name + " unknown")
 
+    @classmethod
+    def from_xml(cls, element):
+        """Create a student from a <student> element"""
+        student = cls()
+        for data in element.iterchildren():
+            if data.tag == 'previous-term':
+                student.history += (TermRecord(data.get('term'),
+                    int(data.get('grade', 0)), int(data.get('group', 0))),)
+            else:
+                student.set_from_xml(data.tag, data.text, add=True)
+        return student
+
+    def add_history(self, record):
+        """Annotate the record of a previous term (replacing one of the same term)"""
+        records = {r.term: r for r in self.history}
+        records[record.term] = record
+        self.history = tuple(sorted(records.values(), key=lambda r: term_order(r.term)))
+
     @property
     def wikiname(self):
-        """The 'create wikiname out of first and last name' algorithm."""
+        """The assigned wikiname or the one derived from the names"""
         if self._wikiname:
             return self._wikiname
+        return self.derived_wikiname
 
+    @property
+    def derived_wikiname(self):
+        """The 'create wikiname out of first and last name' algorithm."""
         # TODO: in the future replace "ß" with "ss"
         name = self.firstname + " " + self.lastname
         name = name.replace('-', ' ')
         name = name.replace('\'', ' ')
-        name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore')
-        names = [n.title() for n in name.decode('ascii').split()]
+        names = [n.title() for n in transliterate(name).split()]
         return ''.join(names)
 
     @wikiname.setter
@@ -637,6 +1208,12 @@ class Student:
         student.append(elem('email', self.email))
         if self.grade:
             student.append(elem('grade', str(self.grade)))
+        for record in self.history:
+            previous = elem('previous-term')
+            previous.set('term', record.term)
+            previous.set('grade', str(record.grade))
+            previous.set('group', str(record.group))
+            student.append(previous)
 
         return student
 
@@ -650,6 +1227,7 @@ class Student:
         s.regdate = self.regdate
         s.email = self.email
         s.grade = self.grade
+        s.history = self.history
         s._wikiname = self._wikiname
         return s
 
@@ -676,10 +1254,66 @@ class Student:
             'email': self.email, 'grade': self.grade})
 
 
+class RegistrationIndex:
+    """Students sorted by registration date. Range queries and buckets
+    use binary search (bisect) on the sorted array of dates.
+    """
+    buckets = ('batch', 'day', 'week')
+
+    def __init__(self, students):
+        self.students = sorted(students, key=lambda s: s.regdate)
+        self.dates = [s.regdate for s in self.students]
+
+    def between(self, after=None, before=None):
+        """Students registered strictly after `after` and strictly
+        before `before` (None for no limit) in O(log n + k).
+        """
+        lo = bisect.bisect_right(self.dates, after) if after else 0
+        hi = bisect.bisect_left(self.dates, before) if before else len(self.dates)
+        return self.students[lo:hi]
+
+    def at(self, regdate):
+        """Students registered exactly at `regdate`"""
+        lo = bisect.bisect_left(self.dates, regdate)
+        hi = bisect.bisect_right(self.dates, regdate)
+        return self.students[lo:hi]
+
+    @staticmethod
+    def bucket_key(by):
+        """Key function for buckets `by` batch (the exact registration
+        date of one TUGrazOnline update), day or week (starting on Monday)
+        """
+        if by == 'batch':
+            return lambda d: d
+        elif by == 'day':
+            return lambda d: d.date()
+        elif by == 'week':
+            return lambda d: d.date() - datetime.timedelta(days=d.weekday())
+        raise ValueError("Unknown registration date bucket: {}".format(by))
+
+    def bucketed(self, by='batch'):
+        """{bucket: [students]} ordered by date"""
+        key = self.bucket_key(by)
+        buckets = collections.OrderedDict()
+        for k, group in itertools.groupby(self.students, key=lambda s: key(s.regdate)):
+            buckets[k] = list(group)
+        return buckets
+
+    def count(self, by='batch'):
+        """Number of non-empty buckets"""
+        key = self.bucket_key(by)
+        return sum(1 for _ in itertools.groupby(map(key, self.dates)))
+
+    def latest(self):
+        if not self.dates:
+            raise ValueError("Dataset is empty")
+        return self.dates[-1]
+
+
 class StudentDatabase:
     """Database of students"""
 
-    def __init__(self, students=None):
+    def __init__(self, students=None, *, check=True):
         if not students:
             students = set()
 
@@ -689,9 +1323,24 @@ class StudentDatabase:
         if size != len(self.students):
             raise ValueError("Some student got lost by by creating a hash set. Internal error")
 
-        self.consistency_check(self.students)
+        # merged shards hold one practical group per term, see merge_shard_students
+        if check:
+            self.consistency_check(self.students)
+        self._timeline = None
+        # hash indexes for `add`
+        self._by_matrnr = {s.matrnr: s for s in self.students}
+        self._by_wikiname = {s.wikiname: s for s in self.students}
+        self.renames = []  # (matrnr, derived wikiname, assigned wikiname)
+
+    @property
+    def timeline(self):
+        """RegistrationIndex of the students, built on first use"""
+        if self._timeline is None:
+            self._timeline = RegistrationIndex(self.students)
+        return self._timeline
 
     @staticmethod
+    @profiled('consistency_check')
     def consistency_check(db):
         E_DOUBLE = "{} contained twice in dataset: {}"
 
@@ -711,26 +1360,19 @@ class StudentDatabase:
 
         # everybody: 0 <= #none-zero-groups(student) <= 1
         for s in db:
-            if len(s.group.difference({0,})) > 1:
-                msg = "Student {} registered in more than 1 non-zero groups: {}"
-                raise ValueError(msg.format(s.wikiname, s.group))
+            StudentDatabase.check_groups(s)
+
+    @staticmethod
+    def check_groups(student):
+        if len(student.group.difference({0,})) > 1:
+            msg = "Student {} registered in more than 1 non-zero groups: {}"
+            raise ValueError(msg.format(student.wikiname, student.group))
 
     def get_latest_registration_date(self):
-        if not self.students:
-            raise ValueError("Dataset is empty")
-        latest = datetime.datetime(2000, 1, 1)
-        for s in self.students:
-            if s.regdate > latest:
-                latest = s.regdate
-        if latest == datetime.datetime(2000, 1, 1):
-            raise ValueError("Algorithm does not work for such old dates")
-        return latest
+        return self.timeline.latest()
 
     def all_registration_dates(self):
-        dates = set()
-        for s in self.students:
-            dates.add(s)
-        return dates
+        return set(self.timeline.dates)
 
     def all_groups(self):
         groups = set()
@@ -746,6 +1388,7 @@ class StudentDatabase:
                 subset.add(s)
         return StudentDatabase(subset)
 
+    @profiled('filter')
     def filter(self, *, matrnr=None, group=None, firstname=None, lastname=None,
         wikiname=None, degree=None, regdate=None, email=None, grade=None,
         regdate_smaller=None, regdate_greater=None, not_matrnr=None):
@@ -754,7 +1397,7 @@ class StudentDatabase:
             selectors.append(lambda s: s.matrnr == matrnr)
         if not_matrnr:
             selectors.append(lambda s: s.matrnr != not_matrnr)
-        if group:
+        if group is not None:
             selectors.append(lambda s: group in s.group)
         if firstname:
             selectors.append(lambda s: s.firstname.lower() == firstname.lower())
@@ -764,30 +1407,29 @@ class StudentDatabase:
             selectors.append(lambda s: s.wikiname == wikiname)
         if degree:
             selectors.append(lambda s: s.degree == degree)
-        if regdate:
-            if regdate_smaller:
-                selectors.append(lambda s: s.regdate < regdate)
-            elif regdate_greater:
-                selectors.append(lambda s: s.regdate > regdate)
-            else:
-                selectors.append(lambda s: s.regdate == regdate)
         if email:
             selectors.append(lambda s: s.email == email)
         if grade:
             selectors.append(lambda s: s.grade == grade)
 
+        # registration dates are looked up in the index
+        candidates = self.students
+        if regdate_smaller or regdate_greater:
+            candidates = self.timeline.between(regdate_greater, regdate_smaller)
+        elif regdate:
+            candidates = self.timeline.at(regdate)
+
         criterion = matrnr or group or firstname or lastname or wikiname \
             or degree or regdate or email or grade
+        result = self.filtered(candidates, selectors)
         if criterion:
-            info("Filtered students DB by value " + str(criterion))
+            info("Filtered students DB by value {}", criterion)
+        metrics.incr('students.filtered', len(self) - len(result))
+        return result
 
-        return self.filtered(self.students, selectors)
-
-    def group_by_regdate(self):
-        classes = collections.defaultdict(list)
-        for s in self.students:
-            classes[s.regdate].append(s)
-        return dict(classes)
+    def group_by_regdate(self, by='batch'):
+        """{bucket: [students]} for buckets `by` batch, day or week"""
+        return self.timeline.bucketed(by)
 
     def group_by_group(self):
         classes = collections.defaultdict(list)
@@ -796,65 +1438,93 @@ class StudentDatabase:
                 classes[grp].append(s)
         return dict(classes)
 
+    @profiled('sort')
     def sorted_by_group(self):
         by_group = list(self.students)
         by_group.sort(key=lambda x: x.group)
         return StudentDatabase(by_group)
 
+    @profiled('sort')
     def sorted_by_wikiname(self):
         by_wikiname = list(self.students)
         by_wikiname.sort(key=lambda x: x.wikiname)
         return StudentDatabase(by_wikiname)
 
+    @profiled('sort')
     def sorted_by_matriculation_number(self):
         by_matrnr = list(self.students)
         by_matrnr.sort(key=lambda x: x.matrnr)
         return StudentDatabase(by_matrnr)
 
+    @profiled('sort')
     def sorted_by_registration_date(self):
-        by_regdate = list(self.students)
-        by_regdate.sort(key=lambda x: x.regdate)
-        return StudentDatabase(by_regdate)
+        return StudentDatabase(list(self.timeline.students))
 
     def add(self, student):
-        """Add an individual student"""
-        if student in self:
-            original = None
-            for s in self.students:
-                if s.matrnr == student.matrnr:
-                    original = s
-            assert original is not None
-            original.group = original.group.union(self.group)
-        else:
-            self.students.add(student.copy())
+        """Add an individual student. The groups of a known student are
+        merged. A wikiname taken by another student is disambiguated.
+        """
+        original = self._by_matrnr.get(student.matrnr)
+        if original is not None:
+            original.group = original.group.union(student.group)
+            self.check_groups(original)
+            return
 
-        self.consistency_check(self.students)
+        c = student.copy()
+        self.check_groups(c)
+        self.resolve_wikiname(c)
+        if isinstance(self.students, list):
+            self.students.append(c)
+        else:
+            self.students.add(c)
+        self._by_matrnr[c.matrnr] = c
+        self._by_wikiname[c.wikiname] = c
+        self._timeline = None
+
+    def resolve_wikiname(self, student):
+        """If the wikiname of `student` is taken already, append the
+        lowest free counter starting at 2 to the name derived from first
+        and last name (AlanTuring, AlanTuring2, ...), also if the taken
+        name carries a counter already. The name is stored in
+        `student._wikiname` and thus stays stable once written to
+        students.xml. Renames are recorded in `renames`.
+        """
+        name = student.wikiname
+        if name not in self._by_wikiname:
+            return
+        base, counter = student.derived_wikiname, 2
+        while '{}{}'.format(base, counter) in self._by_wikiname:
+            counter += 1
+        student.wikiname = '{}{}'.format(base, counter)
+        self.renames.append((student.matrnr, name, student.wikiname))
+        metrics.incr('students.renamed')
+        debug("Wikiname {} is taken already. Student {} becomes {}",
+            name, student.matrnr, student.wikiname)
 
     def union(self, other):
-        """Merge both databases"""
+        """Merge both databases. Students of `other` are added in order of
+        their matriculation numbers, thus wikinames are assigned
+        deterministically. Wikinames `other` assigned itself are
+        resolved again against this database.
+        """
         info("Merging two data sets of {} and {} students" \
             .format(len(self), len(other)))
-        unionset = set()
-        assoc = {}  # matrnr : Student
-        for s in self.students:
-            c = s.copy()
-            assoc[c.matrnr] = c
-            unionset.add(c)
-
-        for s in other.students:
-            c = s.copy()
-            # if duplicate, merge groups and skip
-            if s.matrnr in assoc.keys():
-                assoc[s.matrnr].group = assoc[s.matrnr].group.union(s.group)
-                info("Found some student contained in both sets. " +
-                     "Merging groups to " + str(list(assoc[s.matrnr].group)))
-            # else add to unionset
-            else:
-                unionset.add(c)
+        result = StudentDatabase(set(self.students))
+        result.renames = list(self.renames)
+        renamed = {matrnr for matrnr, _, _ in getattr(other, 'renames', [])}
+        for s in sorted(other, key=lambda s: s.matrnr):
+            if s.matrnr in renamed and s.matrnr not in result._by_matrnr:
+                s = s.copy()
+                s.wikiname = ''
+            # if duplicate, merge groups
+            if s.matrnr in result._by_matrnr:
+                metrics.incr('students.merged')
+                debug("Found student {} in both sets. Merging groups to {}",
+                      s.matrnr, sorted(result._by_matrnr[s.matrnr].group | s.group))
+            result.add(s)
         info("Merge finished. Union set contains {} students" \
-            .format(len(unionset)))
-        print(unionset)
-        return StudentDatabase(unionset)
+            .format(len(result)))
+        return result
 
     def difference(self, other):
         """Compute the difference between the current and the other dataset"""
@@ -867,6 +1537,27 @@ class StudentDatabase:
             .format(len(self), len(other), len(diff)))
         return StudentDatabase(diff)
 
+    def apply_delta(self, delta):
+        """Database with the changes of a RegistrationDelta applied.
+        New students are merged like in `union`. Every new student not
+        named by its derived wikiname (renamed here or already while
+        parsing its export) is recorded in `renames`.
+        """
+        changed = []
+        for s in self.students:
+            if s.matrnr in delta.removed:
+                continue
+            c = s.copy()
+            if c.matrnr in delta.regrouped:
+                c.group = set(delta.regrouped[c.matrnr])
+            changed.append(c)
+        result = StudentDatabase(changed).union(StudentDatabase(delta.added))
+        added = {s.matrnr for s in delta.added}
+        result.renames = list(self.renames) + sorted((s.matrnr, s.derived_wikiname, s.wikiname)
+            for s in result if s.matrnr in added and s.wikiname != s.derived_wikiname)
+        return result
+
+    @profiled('from_xml')
     def from_xml(self, xml):
         """Read students database from XML and create StudentDatabase.
 
@@ -878,13 +1569,12 @@ class StudentDatabase:
         students = StudentDatabase()
 
         for student_element in xml:
-            student = Student()
-            for data in student_element.iterchildren():
-                student.set_from_xml(data.tag, data.text, add=True)
-            students.add(student)
+            students.add(Student.from_xml(student_element))
 
+        metrics.incr('students.parsed', len(students))
         return students
 
+    @profiled('to_xml')
     def to_xml(self):
         xml = lxml.etree.Element('students')
         for student in self.sorted_by_matriculation_number():
@@ -892,10 +1582,7 @@ class StudentDatabase:
         return xml
 
     def __contains__(self, member):
-        for s in self.students:
-            if s.matrnr == member.matrnr:
-                return True
-        return False
+        return member.matrnr in self._by_matrnr
 
     def __iter__(self):
         return iter(self.students)
@@ -909,7 +1596,7 @@ class StudentDatabase:
     def __str__(self):
         out = io.StringIO()
         db = self.sorted_by_matriculation_number()
-        updates = len(db.all_registration_dates())
+        updates = self.timeline.count('batch')
         data = [['matrnr', 'wikiname', 'group', 'email']]
         for s in db.students:
             data.append([s.matrnr, s.wikiname, s.group, s.email])
@@ -924,8 +1611,10 @@ class Config:
 
     def __init__(self):
         self.courses = set()
-        self.tutors = {}
-        self.groups = {}
+        self.tutors = {}   # tutor id : tutor data
+        self.groups = {}   # group id : tutor id
+        self.capacities = {}  # group id : maximum number of students
+        self._last_tutor_id = 0
         self.assignments = []
         self.grades = {}
         self.wikiurl = ''
@@ -936,25 +1625,59 @@ class Config:
             'title': title, 'lecturer': lecturer, 'type': type, 'id': id
         }))
 
-    def add_tutor(self, lastname, firstname, email, groups=None):
+    def add_tutor(self, lastname, firstname, email, groups=None, *, tid=None, limit=None):
+        """Register a tutor and the groups supervised by this tutor.
+
+        :param tid:         tutor identifier like 't1'. Generated if omitted.
+        :type tid:          str
+        :param limit:       maximum number of students in all groups of the tutor
+        :type limit:        int
+        :return:            the tutor identifier
+        :type return:       str
+        """
         if groups is None:
             groups = set()
 
-        i = 1
-        proposal = 't' + str(i)
-        while proposal in self.tutors:
-            i += 1
-            proposal = 't' + str(i)
+        if tid is None:
+            self._last_tutor_id += 1
+            tid = 't' + str(self._last_tutor_id)
+        elif re.match(r't\d+$', tid):
+            self._last_tutor_id = max(self._last_tutor_id, int(tid[1:]))
+        if tid in self.tutors:
+            raise ValueError("Tutor {} defined twice".format(tid))
 
-        self.tutors[proposal] = {
+        self.tutors[tid] = {
             'lastname': lastname,
             'firstname': firstname,
             'email': email,
-            'groups': set(groups)
+            'groups': set(),
+            'limit': limit
         }
-
-    def add_group(self, tutor, group_id):
+        for group_id in groups:
+            self.add_group(tid, group_id)
+        return tid
+
+    def add_group(self, tutor, group_id, capacity=None):
+        if tutor not in self.tutors:
+            raise ValueError("Group {} references unknown tutor {}" \
+                .format(group_id, tutor))
+        if self.groups.get(group_id, tutor) != tutor:
+            raise ValueError("Group {} assigned to tutors {} and {}" \
+                .format(group_id, self.groups[group_id], tutor))
+        self.groups[group_id] = tutor
         self.tutors[tutor]['groups'].add(group_id)
+        if capacity is not None:
+            self.capacities[group_id] = capacity
+
+    def tutor_of_group(self, group_id):
+        """Return the tutor identifier of the tutor supervising `group_id`
+        or None if the group is unknown.
+        """
+        return self.groups.get(group_id)
+
+    def groups_of_tutor(self, tutor):
+        """Return the set of groups supervised by `tutor`"""
+        return self.tutors[tutor]['groups']
 
     def add_assignment(self, name, deadline, submission, partnersubmission):
         assert name not in self.assignments
@@ -980,38 +1703,61 @@ class Config:
 
     def from_xml(self, xml):
         """Retrieve data from XML object and store it in the current object.
+        The metadata is walked once; references between groups and tutors
+        are resolved and validated afterwards.
 
         :param xml:     The XML structure to analyze
         :type xml:      lxml.etree.Element
         """
-        for element in xml.xpath('/metadata/course'):
-            self.add_course(element.attrib['title'], element.attrib['lecturer'],
-                element.attrib['type'], element.attrib['id'])
-
-        for element in xml.xpath('/metadata/tutor'):
-            groups = xml.xpath('/metadata/group[@tutor="' + element.attrib['id'] + '"]')
-            group_ids = map(int, [e.attrib['id'] for e in groups])
-            self.add_tutor(
-                element.find('lastname'),
-                element.find('firstname'),
-                element.find('email'),
-                group_ids
-            )
-
-        for element in xml.xpath('/metadata/assignment'):
-            p = element.find('partnersubmission')
-            partner = p.text if p is not None else ''
-            self.add_assignment(element.attrib['id'],
-                parse_date(element.find('deadline').text),
-                element.find('submission').text,
-                partner)
+        def text(element, tag):
+            child = element.find(tag)
+            return child.text if child is not None else ''
+
+        group_refs = []
+        grades = {}
+        wiki = {}
+
+        # one pass over all toplevel elements
+        for element in xml.iterchildren():
+            tag = element.tag
+            if tag == 'course':
+                self.add_course(element.attrib['title'], element.attrib['lecturer'],
+                    element.attrib['type'], element.attrib['id'])
+            elif tag == 'tutor':
+                limit = element.attrib.get('max-students')
+                self.add_tutor(text(element, 'lastname'),
+                    text(element, 'firstname'), text(element, 'email'),
+                    tid=element.attrib['id'],
+                    limit=int(limit) if limit is not None else None)
+            elif tag == 'group':
+                capacity = element.attrib.get('capacity')
+                group_refs.append((element.attrib['tutor'], int(element.attrib['id']),
+                    int(capacity) if capacity is not None else None))
+            elif tag == 'assignment':
+                self.add_assignment(element.attrib['id'],
+                    parse_date(text(element, 'deadline')),
+                    text(element, 'submission'),
+                    text(element, 'partnersubmission'))
+            elif tag == 'grades':
+                for g in element.iterchildren():
+                    if g.tag in self.all_grades:
+                        if g.tag in grades:
+                            raise ValueError("Grade {} defined twice".format(g.tag))
+                        grades[g.tag] = g
+            elif tag in ('wikiurl', 'wikipath'):
+                wiki[tag] = element.text
+
+        # groups may be declared before their tutor
+        for tutor, group_id, capacity in group_refs:
+            self.add_group(tutor, group_id, capacity)
 
         for grade in self.all_grades:
-            g = xml.xpath('/metadata/grades/' + grade)
-            assert len(g) == 1
-            self.add_grade(int(g[0].attrib['repr']), g[0].attrib['min'], g[0].attrib['max'])
+            if grade not in grades:
+                raise ValueError("Grade {} missing in metadata".format(grade))
+            g = grades[grade]
+            self.add_grade(int(g.attrib['repr']), g.attrib['min'], g.attrib['max'])
 
-        self.set_wiki(xml.xpath('/metadata/wikiurl')[0].text, xml.xpath('/metadata/wikipath')[0].text)
+        self.set_wiki(wiki.get('wikiurl'), wiki.get('wikipath'))
 
     def to_xml(self):
         """Represent data of this object as XML object.
@@ -1031,6 +1777,8 @@ class Config:
         for tid, tutor in self.tutors.items():
             e = lxml.etree.Element('tutor')
             e.set('id', tid)
+            if tutor.get('limit') is not None:
+                e.set('max-students', str(tutor['limit']))
             lastname = lxml.etree.Element('lastname')
             lastname.text = tutor['lastname']
             e.append(lastname)
@@ -1046,10 +1794,12 @@ class Config:
             for grp in tutor['groups']:
                 group = lxml.etree.Element('group')
                 group.set('tutor', tid)
-                group.set('id', grp)
+                group.set('id', str(grp))
+                if grp in self.capacities:
+                    group.set('capacity', str(self.capacities[grp]))
                 xml.append(group)
 
-        for ass in self.assignments.items():
+        for ass in self.assignments:
             assignment = lxml.etree.Element('assignment')
             assignment.set('id', ass['name'])
             dead = lxml.etree.Element('deadline')
@@ -1065,11 +1815,11 @@ class Config:
             xml.append(assignment)
         
         grades = lxml.etree.Element('grades')
-        for sign, grade in enumerate(self.all_grades):
+        for sign, grade in enumerate(self.all_grades, 1):
             e = lxml.etree.Element(grade)
             e.set('repr', str(sign))
-            e.set('min', self.grades[sign]['min'])
-            e.set('max', self.grades[sign]['max'])
+            e.set('min', str(self.grades[sign]['min']))
+            e.set('max', str(self.grades[sign]['max']))
             grades.append(e)
         xml.append(grades)
 
@@ -1085,7 +1835,8 @@ class Config:
 
 # ---------------------------- XML operations -----------------------------
 
-def write_xml(xml_element, xml_filepath, *, encoding='utf-8'):
+@profiled('write_xml')
+def write_xml(xml_element, xml_filepath, *, encoding='utf-8', force=False):
     """Write `xml_element` to file system.
 
     :param xml_element:         XML element to store
@@ -1094,6 +1845,8 @@ def write_xml(xml_element, xml_filepath, *, encoding='utf-8'):
     :type xml_filepath:         str
     :param encoding:            the encoding to use (for xml AND filesystem)
     :type encoding:             str
+    :param force:               overwrite an existing file without asking
+    :type force:                bool
     """
     tree = lxml.etree.ElementTree(xml_element)
 
@@ -1101,7 +1854,7 @@ def write_xml(xml_element, xml_filepath, *, encoding='utf-8'):
         tree.write(sys.stdout)
         return 0
 
-    if os.path.exists(xml_filepath):
+    if os.path.exists(xml_filepath) and not force:
         if not confirm(xml_filepath + " exists already. Overwrite?"):
             print(ABORT, file=sys.stderr)
             return 0
@@ -1109,9 +1862,11 @@ def write_xml(xml_element, xml_filepath, *, encoding='utf-8'):
     with open(xml_filepath, 'wb') as fp:
         tree.write(fp, method='xml', encoding=encoding,
             pretty_print=True, xml_declaration=True)
-        info('XML written to file ' + xml_filepath)
+        info('XML written to file {}', xml_filepath)
+        metrics.incr('files.written')
 
 
+@profiled('read_xml')
 def read_xml(xml_filepath):
     """Read XML file to `lxml.etree.Element`.
 
@@ -1121,12 +1876,29 @@ def read_xml(xml_filepath):
     :type return:           lxml.etree.Element
     """
     with open(xml_filepath, 'rb') as fp:
-        info('Reading XML from ' + xml_filepath)
+        info('Reading XML from {}', xml_filepath)
         return lxml.etree.XML(fp.read())
 
 
+def iter_students_xml(xml_filepath):
+    """Stream the students of a students.xml without building the whole tree.
+
+    :param xml_filepath:    filepath of the students.xml
+    :type xml_filepath:     str
+    :return:                generator of Student instances
+    :type return:           generator
+    """
+    info('Streaming students from {}', xml_filepath)
+    for _, element in lxml.etree.iterparse(xml_filepath, tag='student'):
+        yield Student.from_xml(element)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
 # ---------------------------- CSV operations -----------------------------
 
+@profiled('parse_student_csv')
 def parse_student_csv(csv_filepath, *, encoding='utf-8-sig'):
     """Read the CSV content given by `csv_filepath`.
 
@@ -1183,172 +1955,2659 @@ def parse_student_csv(csv_filepath, *, encoding='utf-8-sig'):
 
     if len(students) == 0:
         warn("No students given in CSV {}", csv_filepath)
+    metrics.incr('students.parsed', len(students))
 
     return students
 
 
-def export_student_csv(csv_filepath, students, *, encoding='utf-8-sig'):
-    """Export the given `students` database to a TU Graz compatible CSV"""
-    raise NotImplementedError("Sorry")  # TODO
+def student_csv_row(student):
+    """Row of `student` in a TUGrazOnline export (fields of MAPPING_CSV_XML)"""
+    grp = max(student.group) if student.group else 0
+    values = {
+        'group': 'Gruppe {}'.format(grp) if grp else 'Standardgruppe',
+        'lastname': student.lastname,
+        'firstname': student.firstname,
+        'matriculation-number': str(student.matrnr),
+        'degree-programme': student.degree or '',
+        'registration-date': student.regdate.strftime('%d.%m.%Y,%H:%M'),
+        'email': student.email
+    }
+    return [values[element] for element in MAPPING_CSV_XML.values()]
+
+
+@profiled('export_student_csv')
+def export_student_csv(csv_filepath, students, *, encoding='utf-8-sig',
+    courses=None, rosters=None, all_students=False, dialect=csv_export_dialect_semicolon):
+    """Export the given `students` database to TU Graz compatible CSV
+    files with a grade column. Students are streamed in order of their
+    matriculation number and all files are written in one pass.
+
+    :param csv_filepath:        File path for CSV file. With `courses`, a
+                                pattern where '{course}' is replaced
+    :type csv_filepath:         str
+    :param students:            students to export
+    :type students:             StudentDatabase
+    :param encoding:            The encoding to use
+    :type encoding:             str
+    :param courses:             course identifiers, one file per course
+    :type courses:              list
+    :param rosters:             {course: set of matrnr} registered students.
+                                Courses without roster are skipped.
+    :type rosters:              dict
+    :param all_students:        export all students to courses without roster
+    :type all_students:         bool
+    :param dialect:             CSV dialect to write
+    :type dialect:              csv.Dialect
+    :return:                    {filepath: number of students written}
+    :type return:               dict
+    """
+    if courses is None:
+        targets = {None: csv_filepath}
+    else:
+        targets = {course: csv_filepath.format(course=course) for course in courses}
+        if len(set(targets.values())) < len(targets):
+            raise ValueError("Filepath {} must contain '{{course}}'".format(csv_filepath))
+    rosters = rosters or {}
+    for course in list(targets):
+        if course is not None and course not in rosters and not all_students:
+            warn('No roster of course {} known, skipping its grade export', course)
+            del targets[course]
+    if not targets:
+        raise ValueError('No roster of any course known, sync the exports first '
+            'or export all students')
+
+    # the store yields its students ordered by matriculation number
+    if not isinstance(students, SQLiteStudentStore):
+        students = sorted(students, key=lambda s: s.matrnr)
+
+    counts = dict.fromkeys(targets.values(), 0)
+    with contextlib.ExitStack() as stack:
+        writers = []
+        for course, filepath in targets.items():
+            fp = stack.enter_context(open(filepath, 'w', encoding=encoding, newline=''))
+            writer = csv.writer(fp, dialect=dialect)
+            writer.writerow(list(MAPPING_CSV_XML) + [GRADE_CSV_FIELD])
+            writers.append((filepath, writer, rosters.get(course)))
+
+        for student in students:
+            row = student_csv_row(student) + [str(student.grade) if student.grade else '']
+            for filepath, writer, roster in writers:
+                if roster is None or student.matrnr in roster:
+                    writer.writerow(row)
+                    counts[filepath] += 1
+
+    for filepath, count in counts.items():
+        info('Wrote {} students to {}', count, filepath)
+    metrics.incr('files.written', len(counts))
+    return counts
+
+
+# ------------------------- columnar operations ---------------------------
+
+COLUMNAR_MAGIC = b'GDICOL1\n'
+
+# name, array typecode, dtype; strings are stored as codes into a dictionary
+COLUMNAR_FIXED = [('matrnr', 'i', '<i4'), ('group', 'Q', '<u8'),
+    ('regdate', 'q', '<i8'), ('grade', 'b', '<i1')]
+COLUMNAR_STRINGS = ['lastname', 'firstname', 'wikiname', 'degree', 'email']
+
+
+def group_bitmask(groups, words=1):
+    """Groups as bitmask of `words` 64-bit words, bit g % 64 of word g // 64 is set for group g"""
+    mask = [0] * words
+    for g in groups:
+        if not 0 <= g < 64 * words:
+            raise ValueError('Group {} does not fit into the group bitmask'.format(g))
+        mask[g // 64] |= 1 << (g % 64)
+    return mask
+
+
+def epoch_seconds(date):
+    """Seconds since 1970-01-01 UTC. Naive datetimes are taken as UTC."""
+    if date.tzinfo is not None:
+        return int(date.timestamp())
+    return int((date - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+class StringDictionary:
+    """Dictionary encoding of strings: every distinct value gets a code"""
 
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def buffers(self):
+        """Arrow-like buffers: int32 offsets (one more than values) and UTF-8 data"""
+        offsets, data = array.array('i', [0]), bytearray()
+        for value in self.values:
+            data.extend(value.encode('utf-8'))
+            offsets.append(len(data))
+        return offsets, bytes(data)
+
+
+def column_chunk(students, dictionaries, words=1):
+    """Columns (name: array.array) of a chunk of students.
+    The group column holds `words` bitmask words per student.
+    """
+    columns = collections.OrderedDict((name, array.array(code)) for name, code, _ in COLUMNAR_FIXED)
+    for name in COLUMNAR_STRINGS:
+        columns[name] = array.array('i')
+    for s in students:
+        columns['matrnr'].append(s.matrnr)
+        columns['group'].extend(group_bitmask(s.group, words))
+        columns['regdate'].append(epoch_seconds(s.regdate))
+        columns['grade'].append(s.grade or 0)
+        for name in COLUMNAR_STRINGS:
+            columns[name].append(dictionaries[name].encode(getattr(s, name) or ''))
+    return columns
+
+
+def little_endian(data):
+    """Bytes of the array `data` in little endian byte order"""
+    if sys.byteorder == 'big':
+        data = array.array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+@profiled('write_columns')
+def write_columns(filepath, students, *, chunk_size=65536):
+    """Write `students` as typed columns to a memory-mappable file.
+
+    Layout (all buffers 8-byte aligned, little endian)::
+
+        magic | fixed-width columns | dictionaries | JSON footer | footer length (u64) | magic
+
+    Fixed-width columns are matrnr (int32), group (bitmask of as many
+    uint64 words per student as the highest group requires),
+    regdate (epoch seconds int64), grade (int8) and int32 codes of the
+    string columns. Their size is known in advance, so the file is
+    memory-mapped and filled chunk by chunk. Dictionaries of the
+    strings follow. The footer lists dtype, offset and length of
+    every buffer, eg. for ``numpy.frombuffer(mm, dtype, count, offset)``.
+
+    :param filepath:    the file to write
+    :type filepath:     str
+    :param students:    students to export
+    :type students:     StudentDatabase
+    :param chunk_size:  number of students converted at once
+    :type chunk_size:   int
+    :return:            number of students written
+    :type return:       int
+    """
+    align = lambda offset: (offset + 7) // 8 * 8
+    count = len(students)
+    words = max(students.all_groups(), default=0) // 64 + 1
+    itemsizes = {code: array.array(code).itemsize for _, code, _ in COLUMNAR_FIXED}
+    itemsizes['i'] = array.array('i').itemsize
+    layout = [(name, code, dtype) for name, code, dtype in COLUMNAR_FIXED] + \
+             [(name, 'i', '<i4') for name in COLUMNAR_STRINGS]
+
+    footer = {'rows': count, 'columns': collections.OrderedDict(), 'dictionaries': {}}
+    offset = len(COLUMNAR_MAGIC)
+    for name, code, dtype in layout:
+        width = words if name == 'group' else 1
+        length = count * width * itemsizes[code]
+        footer['columns'][name] = {'dtype': dtype, 'offset': offset, 'length': length,
+                                   'shape': [count, width]}
+        offset = align(offset + length)
+    fixed_end = offset
+
+    dictionaries = {name: StringDictionary() for name in COLUMNAR_STRINGS}
+    tmppath = filepath + '.tmp'
+    with open(tmppath, 'w+b') as fp:
+        fp.write(COLUMNAR_MAGIC)
+        fp.truncate(fixed_end)
+        rows = 0
+        with mmap.mmap(fp.fileno(), fixed_end) as mm:
+            iterator = iter(students)
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                if rows + len(chunk) > count:
+                    raise ValueError('Students changed while exporting')
+                for name, data in column_chunk(chunk, dictionaries, words).items():
+                    width = footer['columns'][name]['shape'][1]
+                    start = footer['columns'][name]['offset'] + rows * width * data.itemsize
+                    buf = little_endian(data)
+                    mm[start:start + len(buf)] = buf
+                rows += len(chunk)
+            mm.flush()
+        if rows != count:
+            raise ValueError('Students changed while exporting')
+
+        fp.seek(fixed_end)
+        for name in COLUMNAR_STRINGS:
+            offsets, data = dictionaries[name].buffers()
+            entry = {}
+            for key, buf, dtype in (('offsets', little_endian(offsets), '<i4'), ('data', data, '|u1')):
+                position = fp.tell()
+                fp.write(buf)
+                fp.write(b'\0' * (align(fp.tell()) - fp.tell()))
+                entry[key] = {'dtype': dtype, 'offset': position, 'length': len(buf)}
+            entry['size'] = len(dictionaries[name].values)
+            footer['dictionaries'][name] = entry
+
+        encoded = json.dumps(footer).encode('utf-8')
+        fp.write(encoded)
+        fp.write(struct.pack('<Q', len(encoded)))
+        fp.write(COLUMNAR_MAGIC)
+    os.replace(tmppath, filepath)
+    metrics.incr('files.written')
+    info('Wrote {} students as columns to {}', count, filepath)
+    return count
+
+
+class ColumnarFile:
+    """Memory-mapped reader of files written by `write_columns`.
+    Columns are returned as memoryviews of the mapping (zero-copy).
+    """
+    TYPECODES = {'<i4': 'i', '<u8': 'Q', '<i8': 'q', '<i1': 'b', '|u1': 'B'}
+
+    def __init__(self, filepath):
+        self._fp = open(filepath, 'rb')
+        self.buffer = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(COLUMNAR_MAGIC) + 8
+        if self.buffer[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC \
+                or self.buffer[-len(COLUMNAR_MAGIC):] != COLUMNAR_MAGIC:
+            raise ValueError('{} is not a columnar students file'.format(filepath))
+        (length,) = struct.unpack_from('<Q', self.buffer, len(self.buffer) - tail)
+        start = len(self.buffer) - tail - length
+        self.footer = json.loads(self.buffer[start:start + length].decode('utf-8'))
+        self.rows = self.footer['rows']
+
+    def _view(self, entry):
+        view = memoryview(self.buffer)[entry['offset']:entry['offset'] + entry['length']]
+        return view.cast(self.TYPECODES[entry['dtype']])
+
+    def column(self, name):
+        """Values (or dictionary codes for strings) of column `name`.
+        Rows of the group column span footer['columns']['group']['shape'][1] words.
+        """
+        return self._view(self.footer['columns'][name])
 
-# ---------------------------- implementation -----------------------------
+    def strings(self, name):
+        """Decoded values of the dictionary-encoded column `name`"""
+        entry = self.footer['dictionaries'][name]
+        offsets, data = self._view(entry['offsets']), self._view(entry['data'])
+        values = [bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8')
+                  for i in range(entry['size'])]
+        return [values[code] for code in self.column(name)]
 
-def parse_grading_points(grading, encoding='utf-8-sig'):
-    """Retrieve a Foswiki table from the given file and parse it.
+    def close(self):
+        self.buffer.close()
+        self._fp.close()
 
-    :param grading:     the filepath to the Foswiki article with the table
-    :type grading:      str
-    :param encoding:    the encoding of the grading file
-    :type encoding:     str
+
+def write_npz(filepath, students):
+    """Write the columns of `write_columns` as numpy arrays to a .npz file.
+    String columns are stored as codes plus a '$name_dictionary' array.
     """
-    bold = lambda v: (lambda t: t[0] == '*' and t[-1] == '*' if t else False)(v.strip())
+    if numpy is None:
+        raise ValueError('The npz format requires numpy')
+    dictionaries = {name: StringDictionary() for name in COLUMNAR_STRINGS}
+    words = max(students.all_groups(), default=0) // 64 + 1
+    columns = column_chunk(students, dictionaries, words)
+    dtypes = {name: dtype for name, _, dtype in COLUMNAR_FIXED}
+    arrays = {name: numpy.frombuffer(little_endian(data), dtype=dtypes.get(name, '<i4'))
+              for name, data in columns.items()}
+    arrays['group'] = arrays['group'].reshape(-1, words)
+    for name, dictionary in dictionaries.items():
+        arrays[name + '_dictionary'] = numpy.array(dictionary.values, dtype=str)
+    numpy.savez(filepath, **arrays)
+    metrics.incr('files.written')
+    info('Wrote {} students as numpy arrays to {}', len(columns['matrnr']), filepath)
+    return len(columns['matrnr'])
+
+
+# ---------------------------- XLSX operations ----------------------------
+
+class Formula:
+    """A spreadsheet formula (without leading '=') for XLSXSheet.row.
+
+    For shared formulas, the first cell defines the formula `text`,
+    the range `ref` of cells sharing it and the shared index `si`.
+    All other cells of the range only provide `si`. References in
+    the shared formula are shifted relative to the first cell.
+    """
+    __slots__ = ('text', 'si', 'ref')
 
-    table = read_foswiki_table(grading, encoding=encoding)
-    if not table:
-        raise ValueError("Grading scheme table must not be empty")
+    def __init__(self, text=None, *, si=None, ref=None):
+        self.text = text
+        self.si = si
+        self.ref = ref
 
-    grading = collections.OrderedDict()
-    check = {}
-    assignment, exercise = None, None
-    for row in table:
-        assert len(row) == 3, "grading points table must always have 3 columns"
-        if bold(row[0]) and row[1] == '':
-            assignment = row[0].strip()[1:-1]
-            exercise = None
-            grading[assignment] = collections.OrderedDict()
-            check[assignment] = { 'expect': int(row[2]) }
-        elif row[0].strip() == '':
-            assert assignment, "Assignment line required before exercise"
-            assert exercise, "Exercise line required before points line"
-            points, pts = row[1].strip(), int(row[2].strip())
-            grading[assignment][exercise][points] = int(pts)
-        else:
-            assert assignment, "Assignment line required before exercise"
-            exercise = row[0].strip()
-            grading[assignment][exercise] = collections.OrderedDict()
-            check[assignment][exercise] = { 'expect': int(row[2]) }
 
-    # consistency check
-    for assignment, v1 in grading.items():
-        check[assignment]['points'] = 0
-        for exercise, v2 in v1.items():
-            check[assignment][exercise]['points'] = 0
-            for points, pts in v2.items():
-                check[assignment][exercise]['points'] += abs(pts)
+def xlsx_escape(text):
+    """Escape `text` for XML, dropping characters XML 1.0 cannot represent"""
+    text = re.sub('[\x00-\x08\x0b\x0c\x0e-\x1f]', '', str(text))
+    return text.replace('&', '&amp;').replace('<', '&lt;') \
+               .replace('>', '&gt;').replace('"', '&quot;')
 
-            if check[assignment][exercise]['points'] != check[assignment][exercise]['expect']:
-                msg = 'Sum of points inconsistent in {}, {} ({} != {})'
-                raise ValueError(msg.format(assignment, exercise,
-                    check[assignment][exercise]['points'],
-                    check[assignment][exercise]['expect']))
-            check[assignment]['points'] += check[assignment][exercise]['points']
 
-        if check[assignment]['points'] != check[assignment]['expect']:
-            msg = 'Sum of points inconsistent in {} ({} != {})'
-            raise ValueError(msg.format(assignment, check[assignment]['points'],
-                check[assignment]['expect']))
+class XLSXSheet:
+    """A worksheet of an XLSXWorkbook. Rows are written to the
+    zip archive in chunks of BUFFER_SIZE characters, thus memory
+    usage is independent of the size of the sheet.
+    """
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, workbook, name, fp, widths=None):
+        self.workbook = workbook
+        self.name = name
+        self.fp = fp
+        self.rowid = 0
+        self._buffer = []
+        self._buffered = 0
+        self._write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">')
+        if widths:
+            self._write('<cols>')
+            for col, width in enumerate(widths, 1):
+                self._write('<col min="{0}" max="{0}" width="{1}" customWidth="1"/>' \
+                    .format(col, width))
+            self._write('</cols>')
+        self._write('<sheetData>')
+
+    def _write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered > self.BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.fp.write(''.join(self._buffer).encode('utf-8'))
+        self._buffer = []
+        self._buffered = 0
+
+    def new_shared_index(self):
+        """Return a new index to be used as Formula(si=...)"""
+        return self.workbook._next_shared_index()
+
+    def row(self, cells, *, style=None):
+        """Write one row. `cells` may contain str, int, float, None
+        and Formula values.
+
+        :param cells:       values of the cells of this row
+        :type cells:        list
+        :param style:       name of the style to use (see XLSXWorkbook.STYLES)
+        :type style:        str
+        """
+        rowid = self.rowid
+        self.rowid += 1
+        s = ' s="{}"'.format(self.workbook.STYLES.index(style)) if style else ''
+        out = ['<row r="{}">'.format(rowid + 1)]
+        for col, value in enumerate(cells):
+            if value is None or value == '':
+                continue
+            ref = spreadsheet_cell_id(col, rowid)
+            if isinstance(value, Formula):
+                if value.si is None:
+                    f = '<f>{}</f>'.format(xlsx_escape(value.text))
+                elif value.text is not None:
+                    f = '<f t="shared" ref="{}" si="{}">{}</f>'.format(
+                        value.ref, value.si, xlsx_escape(value.text))
+                else:
+                    f = '<f t="shared" si="{}"/>'.format(value.si)
+                out.append('<c r="{}"{}>{}</c>'.format(ref, s, f))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                out.append('<c r="{}"{}><v>{}</v></c>'.format(ref, s, value))
+            else:
+                out.append('<c r="{}"{} t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>' \
+                    .format(ref, s, xlsx_escape(value)))
+        out.append('</row>')
+        self._write(''.join(out))
 
-    return grading
+    def close(self):
+        self._write('</sheetData></worksheet>')
+        self._flush()
+        self.fp.close()
 
+    def __enter__(self):
+        return self
 
-def spreadsheet_cell_id(x, y, *, fixed=False):
-    """Get (x, y) coordinates and return cell identifier (like A4).
-    Set fixed to True to get a static identifier like $A$4.
-    """
-    tmpl = "${}${}" if fixed else "{}{}"
-    if x < 26:
-        return tmpl.format(chr(65 + x), y + 1)
-    elif x < 676:
-        first = chr(65 + (x // 26))
-        second = chr(65 + (x % 26))
-        return tmpl.format(first, second)
-    else:
-        raise ValueError("spreadsheet_cell_id does not support cells beyond ZZ")
+    def __exit__(self, *exc):
+        self.close()
 
 
-def create_title_group_spreadsheet(config, db, grading, group, csvpath, csvenc='utf-8-sig'):
-    """Create a group.
+class XLSXWorkbook:
+    """Minimal streaming writer for Office Open XML workbooks (*.xlsx).
 
-    :param config:      A Config to read metadata from
-    :type config:       Config
-    :param db:          StudentDatabase to use
-    :type db:           StudentDatabase
+    Sheets are written one after another; only the names of the sheets
+    are kept in memory. Formulas are recomputed by the spreadsheet
+    application when the file is opened.
+
+        with XLSXWorkbook('group1.xlsx') as wb:
+            with wb.sheet('Overview') as sheet:
+                sheet.row(['name', 'points'], style='bold')
+                sheet.row(['Alan', Formula('SUM(B3:B9)')])
+    """
+    STYLES = [None, 'bold']
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.sheets = []
+        self._shared = 0
+        self._zip = zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED)
+
+    def _next_shared_index(self):
+        self._shared += 1
+        return self._shared - 1
+
+    def sheet(self, name, *, widths=None):
+        """Start a new sheet. The previous sheet must be closed.
+
+        :param name:        name of the sheet
+        :type name:         str
+        :param widths:      widths of the columns
+        :type widths:       list
+        :return:            the sheet
+        :type return:       XLSXSheet
+        """
+        if len(name) > 31 or re.search(r'[\[\]:*?/\\]', name):
+            raise ValueError("Invalid sheet name: {}".format(name))
+        if name in self.sheets:
+            raise ValueError("Sheet {} defined twice".format(name))
+        self.sheets.append(name)
+        entry = 'xl/worksheets/sheet{}.xml'.format(len(self.sheets))
+        return XLSXSheet(self, name, self._zip.open(entry, 'w'), widths)
+
+    def close(self):
+        ns = 'http://schemas.openxmlformats.org'
+        rel = ns + '/officeDocument/2006/relationships'
+        sheets = range(1, len(self.sheets) + 1)
+
+        self._zip.writestr('[Content_Types].xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="{ns}/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '{sheets}</Types>'.format(ns=ns, sheets=''.join(
+                '<Override PartName="/xl/worksheets/sheet{}.xml" ContentType='
+                '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' \
+                .format(i) for i in sheets)))
+        self._zip.writestr('_rels/.rels',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="{ns}/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="{rel}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'.format(ns=ns, rel=rel))
+        self._zip.writestr('xl/_rels/workbook.xml.rels',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="{ns}/package/2006/relationships">{sheets}'
+            '<Relationship Id="rIdStyles" Type="{rel}/styles" Target="styles.xml"/>'
+            '</Relationships>'.format(ns=ns, rel=rel, sheets=''.join(
+                '<Relationship Id="rId{0}" Type="{1}/worksheet" '
+                'Target="worksheets/sheet{0}.xml"/>'.format(i, rel) for i in sheets)))
+        self._zip.writestr('xl/workbook.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="{ns}/spreadsheetml/2006/main" xmlns:r="{rel}">'
+            '<sheets>{sheets}</sheets><calcPr fullCalcOnLoad="1"/></workbook>' \
+            .format(ns=ns, rel=rel, sheets=''.join(
+                '<sheet name="{}" sheetId="{}" r:id="rId{}"/>' \
+                .format(xlsx_escape(name), i, i) for i, name in zip(sheets, self.sheets))))
+        self._zip.writestr('xl/styles.xml',
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<styleSheet xmlns="{ns}/spreadsheetml/2006/main">'
+            '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+            '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>'.format(ns=ns))
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------- SQLite storage -----------------------------
+
+def is_sqlite_filepath(filepath):
+    """Does `filepath` denote a SQLite students database?"""
+    return os.path.splitext(filepath)[1].lower() in ('.sqlite', '.sqlite3', '.db')
+
+
+class SQLiteStudentStore:
+    """Students database stored in SQLite.
+
+    Provides the query interface of StudentDatabase (filter, group_by_*,
+    sorted_by_*, union, difference, from_xml/to_xml), but queries are
+    evaluated by SQLite using indexes and `update` and `delete` modify
+    the store incrementally instead of rewriting a whole XML file.
+    Query results are returned as (in-memory) StudentDatabase instances.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS students (
+            matrnr INTEGER PRIMARY KEY,
+            lastname TEXT NOT NULL,
+            firstname TEXT NOT NULL,
+            wikiname TEXT NOT NULL,
+            degree TEXT NOT NULL DEFAULT '',
+            regdate TEXT NOT NULL,
+            email TEXT NOT NULL,
+            grade INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS students_wikiname ON students (wikiname);
+        CREATE INDEX IF NOT EXISTS students_email ON students (email);
+        CREATE INDEX IF NOT EXISTS students_regdate ON students (regdate);
+        CREATE TABLE IF NOT EXISTS student_groups (
+            matrnr INTEGER NOT NULL REFERENCES students (matrnr) ON DELETE CASCADE,
+            grp INTEGER NOT NULL,
+            PRIMARY KEY (matrnr, grp)
+        );
+        CREATE INDEX IF NOT EXISTS student_groups_grp ON student_groups (grp);
+    '''
+
+    COLUMNS = 's.matrnr, s.lastname, s.firstname, s.wikiname, s.degree, ' \
+              's.regdate, s.email, s.grade'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.renames = []  # (matrnr, derived wikiname, assigned wikiname) of added students
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.create_function('pylower', 1,
+            lambda v: v.lower() if v is not None else None)
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- conversion --
+
+    @staticmethod
+    def _student(row):
+        s = Student()
+        s.matrnr, s.lastname, s.firstname, s._wikiname, s.degree, \
+            regdate, s.email, s.grade, groups = row
+        s.regdate = datetime.datetime.fromisoformat(regdate)
+        s.group = {int(g) for g in groups.split(',')} if groups else set()
+        return s
+
+    def _select(self, where='', params=(), order='s.matrnr', groups='student_groups'):
+        """Yield students matching the SQL condition `where`"""
+        query = ('SELECT {cols}, (SELECT group_concat(grp) FROM {groups} g '
+                 'WHERE g.matrnr = s.matrnr) FROM students s {where} '
+                 'ORDER BY {order}')
+        query = query.format(cols=self.COLUMNS, groups=groups,
+            where=('WHERE ' + where) if where else '', order=order)
+        for row in self.conn.execute(query, params):
+            yield self._student(row)
+
+    def _insert(self, students, *, table='students', groups='student_groups', conflict=''):
+        self.conn.executemany(
+            'INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?, ?, ?) {}'.format(table, conflict),
+            ((s.matrnr, s.lastname, s.firstname, s.wikiname, s.degree or '',
+              s.regdate.isoformat(), s.email, s.grade or 0) for s in students))
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO {} VALUES (?, ?)'.format(groups),
+            ((s.matrnr, g) for s in students for g in s.group))
+
+    def _check(self):
+        """Apply the checks of StudentDatabase.consistency_check not
+        already enforced by the schema."""
+        row = self.conn.execute('SELECT matrnr FROM student_groups WHERE grp != 0 '
+            'GROUP BY matrnr HAVING count(*) > 1 LIMIT 1').fetchone()
+        if row:
+            msg = "Student {} registered in more than 1 non-zero groups"
+            raise ValueError(msg.format(row[0]))
+
+    def _resolve_wikinames(self, students):
+        """Copies of `students` where wikinames of new students which are
+        taken already are disambiguated like in StudentDatabase.resolve_wikiname.
+        New students without their derived wikiname are recorded in `renames`.
+        """
+        def taken(name):
+            return name in assigned or self.conn.execute(
+                'SELECT 1 FROM students WHERE wikiname = ?', (name,)).fetchone()
+
+        result, assigned = [], set()
+        for s in students:
+            c = s.copy()
+            known = self.conn.execute('SELECT 1 FROM students WHERE matrnr = ?',
+                (c.matrnr,)).fetchone()
+            if not known and taken(c.wikiname):
+                name, base, counter = c.wikiname, c.derived_wikiname, 2
+                while taken('{}{}'.format(base, counter)):
+                    counter += 1
+                c.wikiname = '{}{}'.format(base, counter)
+                metrics.incr('students.renamed')
+                debug("Wikiname {} is taken already. Student {} becomes {}",
+                    name, c.matrnr, c.wikiname)
+            if not known and c.wikiname != c.derived_wikiname:
+                self.renames.append((c.matrnr, c.derived_wikiname, c.wikiname))
+            assigned.add(c.wikiname)
+            result.append(c)
+        return result
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        try:
+            with self.conn:
+                yield
+                self._check()
+        except sqlite3.IntegrityError as e:
+            raise ValueError("Inconsistent students data: {}".format(e))
+
+    @contextlib.contextmanager
+    def _other(self, other):
+        """Provide `other` as temporary tables other_students/other_groups"""
+        self.conn.execute('CREATE TEMP TABLE other_students AS '
+            'SELECT * FROM students WHERE 0')
+        self.conn.execute('CREATE TEMP TABLE other_groups AS '
+            'SELECT * FROM student_groups WHERE 0')
+        try:
+            self._insert(list(other), table='temp.other_students',
+                groups='temp.other_groups')
+            yield
+        finally:
+            self.conn.execute('DROP TABLE temp.other_students')
+            self.conn.execute('DROP TABLE temp.other_groups')
+
+    # -- StudentDatabase interface --
+
+    @profiled('filter')
+    def filter(self, *, matrnr=None, group=None, firstname=None, lastname=None,
+        wikiname=None, degree=None, regdate=None, email=None, grade=None,
+        regdate_smaller=None, regdate_greater=None, not_matrnr=None):
+        """Like StudentDatabase.filter, but compiled to one SQL query"""
+        conditions, params = [], []
+        def cond(sql, *values):
+            conditions.append(sql)
+            params.extend(values)
+
+        if matrnr:
+            cond('s.matrnr = ?', matrnr)
+        if not_matrnr:
+            cond('s.matrnr != ?', not_matrnr)
+        if group is not None:
+            cond('s.matrnr IN (SELECT matrnr FROM student_groups WHERE grp = ?)', group)
+        if firstname:
+            cond('pylower(s.firstname) = ?', firstname.lower())
+        if lastname:
+            cond('pylower(s.lastname) = ?', lastname.lower())
+        if wikiname:
+            cond('s.wikiname = ?', wikiname)
+        if degree:
+            cond('s.degree = ?', degree)
+        if regdate_smaller:
+            cond('s.regdate < ?', regdate_smaller.isoformat())
+        if regdate_greater:
+            cond('s.regdate > ?', regdate_greater.isoformat())
+        if regdate and not (regdate_smaller or regdate_greater):
+            cond('s.regdate = ?', regdate.isoformat())
+        if email:
+            cond('s.email = ?', email)
+        if grade:
+            cond('s.grade = ?', grade)
+
+        result = StudentDatabase(list(self._select(' AND '.join(conditions), params)))
+        metrics.incr('students.filtered', len(self) - len(result))
+        return result
+
+    def all_groups(self):
+        return {g for (g,) in self.conn.execute('SELECT DISTINCT grp FROM student_groups')}
+
+    def group_by_group(self):
+        classes = collections.defaultdict(list)
+        query = ('SELECT {}, (SELECT group_concat(grp) FROM student_groups h '
+            'WHERE h.matrnr = s.matrnr), g.grp FROM students s '
+            'JOIN student_groups g ON g.matrnr = s.matrnr '
+            'ORDER BY g.grp, s.matrnr').format(self.COLUMNS)
+        for row in self.conn.execute(query):
+            classes[row[-1]].append(self._student(row[:-1]))
+        return dict(classes)
+
+    def group_by_regdate(self, by='batch'):
+        return RegistrationIndex(self._select(order='s.regdate')).bucketed(by)
+
+    @profiled('sort')
+    def sorted_by_group(self):
+        order = '(SELECT min(grp) FROM student_groups g WHERE g.matrnr = s.matrnr)'
+        return StudentDatabase(list(self._select(order=order)))
+
+    @profiled('sort')
+    def sorted_by_wikiname(self):
+        return StudentDatabase(list(self._select(order='s.wikiname')))
+
+    @profiled('sort')
+    def sorted_by_matriculation_number(self):
+        return StudentDatabase(list(self._select()))
+
+    @profiled('sort')
+    def sorted_by_registration_date(self):
+        return StudentDatabase(list(self._select(order='s.regdate')))
+
+    def union(self, other):
+        """Merge with `other` like StudentDatabase.union. The store is not modified."""
+        with self._other(other):
+            merged = list(self._select(groups='(SELECT * FROM student_groups '
+                'UNION SELECT * FROM temp.other_groups)'))
+            count = len(merged)
+            query = ('SELECT {}, (SELECT group_concat(grp) FROM temp.other_groups g '
+                'WHERE g.matrnr = s.matrnr) FROM temp.other_students s '
+                'WHERE s.matrnr NOT IN (SELECT matrnr FROM students)')
+            for row in self.conn.execute(query.format(self.COLUMNS)):
+                merged.append(self._student(row))
+        metrics.incr('students.merged', len(self) + len(other) - len(merged))
+        info("Merge finished. Union set contains {} students", len(merged))
+        return StudentDatabase(merged)
+
+    def difference(self, other):
+        """Students of this store not contained in `other`"""
+        with self._other(other):
+            diff = list(self._select('s.matrnr NOT IN (SELECT matrnr FROM temp.other_students)'))
+        info("Compute difference between 2 sets. {}-{} students became {} students.",
+            len(self), len(other), len(diff))
+        return StudentDatabase(diff)
+
+    def update(self, other):
+        """Merge `other` into the store (in place) with the semantics of
+        StudentDatabase.union: known students keep their data, but
+        their groups are extended. New students are added.
+        """
+        before = len(self)
+        with self._transaction():
+            self._insert(self._resolve_wikinames(other),
+                conflict='ON CONFLICT (matrnr) DO NOTHING')
+        added = len(self) - before
+        metrics.incr('students.merged', len(other) - added)
+        info("Added {} students to {}. Store contains {} students",
+            added, self.filepath, len(self))
+
+    def delete(self, matrnr):
+        """Remove the student with matriculation number `matrnr`"""
+        with self._transaction():
+            self.conn.execute('DELETE FROM students WHERE matrnr = ?', (matrnr,))
+
+    def replace(self, db):
+        """Replace the content of the store with the students of `db`"""
+        with self._transaction():
+            self.conn.execute('DELETE FROM student_groups')
+            self.conn.execute('DELETE FROM students')
+            self._insert(list(db))
+        metrics.incr('files.written')
+        info('Stored {} students in {}', len(self), self.filepath)
+
+    def apply_delta(self, delta):
+        """Apply a RegistrationDelta to the store (in place) in one transaction"""
+        with self._transaction():
+            self.conn.executemany('DELETE FROM students WHERE matrnr = ?',
+                ((m,) for m in delta.removed))
+            self.conn.executemany('DELETE FROM student_groups WHERE matrnr = ?',
+                ((m,) for m in delta.regrouped))
+            self.conn.executemany('INSERT INTO student_groups VALUES (?, ?)',
+                ((m, g) for m, groups in delta.regrouped.items() for g in groups))
+            self._insert(self._resolve_wikinames(delta.added),
+                conflict='ON CONFLICT (matrnr) DO NOTHING')
+        info('Applied registration changes to {}. Store contains {} students',
+            self.filepath, len(self))
+        return self
+
+    @profiled('from_xml')
+    def from_xml(self, xml):
+        """Import students from XML, replacing the content of the store.
+
+        :param xml:                 The XML structure to analyze
+        :type xml:                  lxml.etree.Element
+        :return:                    this store
+        :type return:               SQLiteStudentStore
+        """
+        self.replace(StudentDatabase().from_xml(xml))
+        return self
+
+    @profiled('to_xml')
+    def to_xml(self):
+        xml = lxml.etree.Element('students')
+        for student in self._select():
+            xml.append(student.to_xml())
+        return xml
+
+    def __contains__(self, member):
+        return self.conn.execute('SELECT 1 FROM students WHERE matrnr = ?',
+            (member.matrnr,)).fetchone() is not None
+
+    def __iter__(self):
+        return self._select()
+
+    def __len__(self):
+        return self.conn.execute('SELECT count(*) FROM students').fetchone()[0]
+
+    def __repr__(self):
+        return '<SQLiteStudentStore {} containing {} students>' \
+            .format(self.filepath, len(self))
+
+
+# ---------------------------- sharded storage ----------------------------
+
+def query_shard(filepath, filters=()):
+    """Apply `filters` to one shard and group its students by group.
+    Runs in a worker process of ShardedStudentStore, hence results are
+    plain lists.
+
+    :return:    the students and {group: [matriculation numbers]}
+    :type return:   tuple
+    """
+    db = load_students(filepath)
+    for kwargs in filters:
+        db = db.filter(**kwargs)
+    groups = {grp: [s.matrnr for s in students]
+              for grp, students in db.group_by_group().items()}
+    return list(db), groups
+
+
+def merge_shard_students(results):
+    """Merge the students of several shards given in manifest order
+    (ie. by term). A student of several shards becomes one record: its
+    groups are the union of the groups in all shards, all other fields
+    are taken from the last shard (the latest term). The rule of one
+    practical group per student does not apply across shards, as a
+    student repeating a course has one group per term.
+
+    :param results:     lists of students, one per shard
+    :type results:      list
+    :return:            merged students ordered by matriculation number
+    :type return:       list
+    """
+    merged = {}
+    for students in results:
+        for s in students:
+            c = s.copy()
+            if s.matrnr in merged:
+                c.group = merged[s.matrnr].group | c.group
+            merged[s.matrnr] = c
+    return sorted(merged.values(), key=lambda s: s.matrnr)
+
+
+class ShardedStudentStore:
+    """Students of several courses and terms. Every course and term is a
+    shard, a students.xml (or SQLite file) in one directory listed in
+    the manifest shards.json.
+
+    Filters are recorded and applied in worker processes, one shard per
+    process, which also group the students of their shard by group.
+    Students are merged by `merge_shard_students` and the groupings by
+    union; sortings and the grouping by registration date are computed
+    on the merged records, so every query shows the same record of a
+    student. The shards are queried once per store (and filter), the
+    merged results are kept by the store.
+    """
+    MANIFEST = 'shards.json'
+
+    def __init__(self, directory, *, workers=None):
+        self.directory = directory
+        self.workers = workers
+        self.filters = ()
+        self.shards = []   # [{course, term, file, students}]
+        self._records = None   # merged students, see _query
+        self._groups = None    # {group: merged students}
+        manifest = os.path.join(directory, self.MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as fp:
+                self.shards = json.load(fp)['shards']
+
+    @classmethod
+    def is_store(cls, filepath):
+        """Does `filepath` denote a directory with a shard manifest?"""
+        return os.path.isfile(os.path.join(filepath, cls.MANIFEST))
+
+    def _derive(self, *, filters=None, shards=None):
+        store = copy.copy(self)
+        store._records = store._groups = None
+        if filters is not None:
+            store.filters = filters
+        if shards is not None:
+            store.shards = shards
+        return store
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.MANIFEST), 'w', encoding='utf-8') as fp:
+            json.dump({'shards': self.shards}, fp, indent=1, sort_keys=True)
+
+    def add_shard(self, course, term, db, *, encoding='utf-8'):
+        """Store `db` as shard of `course` and `term`, replacing an existing one.
+
+        :return:        filepath of the shard
+        :type return:   str
+        """
+        filename = '{}-{}.xml'.format(course, term)
+        os.makedirs(self.directory, exist_ok=True)
+        write_xml(db.to_xml(), os.path.join(self.directory, filename),
+            encoding=encoding, force=True)
+        self.shards = [sh for sh in self.shards if (sh['course'], sh['term']) != (course, term)]
+        self.shards.append({'course': course, 'term': term, 'file': filename,
+            'students': len(db)})
+        self.shards.sort(key=lambda sh: (sh['term'], sh['course']))
+        self._records = self._groups = None
+        self.save()
+        return os.path.join(self.directory, filename)
+
+    def select(self, *, course=None, term=None):
+        """Store restricted to the shards of `course` and/or `term`"""
+        return self._derive(shards=[sh for sh in self.shards
+            if course in (None, sh['course']) and term in (None, sh['term'])])
+
+    def _query(self):
+        """Query all shards in parallel (once) and merge their results"""
+        if self._records is not None:
+            return
+        query = functools.partial(query_shard, filters=self.filters)
+        filepaths = [os.path.join(self.directory, sh['file']) for sh in self.shards]
+        if len(filepaths) < 2 or self.workers == 1:
+            results = list(map(query, filepaths))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(query, filepaths))
+
+        records = merge_shard_students([students for students, _ in results])
+        members = collections.defaultdict(set)
+        for _, groups in results:
+            for grp, matrnrs in groups.items():
+                members[grp].update(matrnrs)
+        by_matrnr = {s.matrnr: s for s in records}
+        self._records = records
+        self._groups = collections.OrderedDict((grp, [by_matrnr[m] for m in sorted(members[grp])])
+            for grp in sorted(members))
+
+    def records(self):
+        """All (filtered) students of all shards, see `merge_shard_students`"""
+        self._query()
+        return list(self._records)
+
+    def merged(self):
+        """All (filtered) students of all shards as one StudentDatabase"""
+        return StudentDatabase(self.records(), check=False)
+
+    def filter(self, **kwargs):
+        """Like StudentDatabase.filter. Applied lazily in every shard."""
+        return self._derive(filters=self.filters + (kwargs,))
+
+    def all_groups(self):
+        self._query()
+        return set(self._groups)
+
+    def group_by_group(self):
+        self._query()
+        return collections.OrderedDict((grp, list(students))
+            for grp, students in self._groups.items())
+
+    def group_by_regdate(self, by='batch'):
+        return RegistrationIndex(self.records()).bucketed(by)
+
+    def _sorted(self, key):
+        return StudentDatabase(sorted(self.records(), key=key), check=False)
+
+    def sorted_by_group(self):
+        return self._sorted(lambda s: sorted(s.group))
+
+    def sorted_by_wikiname(self):
+        return self._sorted(lambda s: s.wikiname)
+
+    def sorted_by_matriculation_number(self):
+        return self._sorted(lambda s: s.matrnr)
+
+    def sorted_by_registration_date(self):
+        return self._sorted(lambda s: s.regdate)
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def __len__(self):
+        self._query()
+        return len(self._records)
+
+    def __repr__(self):
+        return '<ShardedStudentStore {} ({} shards)>'.format(self.directory, len(self.shards))
+
+
+class FileCache:
+    """Parsed files kept in memory while the files are unchanged (see
+    `serve`). Files are identified by their modification time and size.
+    """
+
+    def __init__(self):
+        self.entries = {}   # (abspath, parse, kwargs) : (stamp, value)
+
+    @staticmethod
+    def stamp(filepath):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, filepath, parse, **kwargs):
+        """`parse(filepath, **kwargs)`, parsed again only if the file changed"""
+        key = (os.path.abspath(filepath), parse, tuple(sorted(kwargs.items())))
+        stamp = self.stamp(filepath)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            metrics.incr('cache.hits')
+            return entry[1]
+        value = parse(filepath, **kwargs)
+        self.entries[key] = (stamp, value)
+        return value
+
+    def refresh(self):
+        """Parse changed files again, forget removed or broken ones"""
+        for key, (stamp, _value) in list(self.entries.items()):
+            filepath, parse, kwargs = key
+            try:
+                current = self.stamp(filepath)
+                if current != stamp:
+                    info('Reloading {}', filepath)
+                    self.entries[key] = (current, parse(filepath, **dict(kwargs)))
+            except Exception as exc:
+                warn('Dropping {} from cache: {}', filepath, exc)
+                del self.entries[key]
+
+
+file_cache = None  # FileCache while serving
+
+
+def cached(filepath, parse, **kwargs):
+    """`parse(filepath, **kwargs)`, reused while serving and the file is unchanged"""
+    if file_cache is None:
+        return parse(filepath, **kwargs)
+    return file_cache.get(filepath, parse, **kwargs)
+
+
+def read_students_xml(filepath):
+    """Read a students.xml into a StudentDatabase"""
+    return StudentDatabase().from_xml(read_xml(filepath))
+
+
+def read_config_xml(filepath):
+    """Read a metadata.xml into a Config"""
+    config = Config()
+    config.from_xml(read_xml(filepath))
+    return config
+
+
+def load_students(filepath):
+    """Open the students database at `filepath`. SQLite files (*.sqlite,
+    *.db) are opened as SQLiteStudentStore, directories with a shard
+    manifest as ShardedStudentStore, everything else is read as XML.
+
+    :param filepath:    filepath of the students database
+    :type filepath:     str
+    :return:            the students database
+    :type return:       StudentDatabase | SQLiteStudentStore
+    """
+    if is_sqlite_filepath(filepath):
+        return SQLiteStudentStore(filepath)
+    if ShardedStudentStore.is_store(filepath):
+        return ShardedStudentStore(filepath)
+    return cached(filepath, read_students_xml)
+
+
+def load_config(filepath):
+    """Read the metadata.xml at `filepath`
+
+    :param filepath:    filepath of the metadata
+    :type filepath:     str
+    :return:            the metadata
+    :type return:       Config
+    """
+    return cached(filepath, read_config_xml)
+
+
+def save_students(db, filepath, *, encoding='utf-8', force=False):
+    """Write students database `db` to `filepath` (XML or SQLite)"""
+    if ShardedStudentStore.is_store(filepath):
+        raise ValueError('{} is a sharded store, add shards with "students shard"'.format(filepath))
+    if is_sqlite_filepath(filepath):
+        with SQLiteStudentStore(filepath) as store:
+            store.replace(db)
+    else:
+        write_xml(db.to_xml(), filepath, encoding=encoding, force=force)
+
+
+# --------------------------------- mail ----------------------------------
+
+def format_address(student):
+    """`student` as address in a To-header like ``"Alan Turing" <a@t.at>``"""
+    return '"{} {}" <{}>'.format(student.firstname, student.lastname, student.email)
+
+
+def read_mail_template(filepath, *, encoding='utf-8'):
+    """Read a mail template. It starts with header lines like
+    ``Subject: GDI {group}`` followed by an empty line and the body.
+    Placeholders are filled in with `str.format`.
+
+    :param filepath:    filepath of the template
+    :type filepath:     str
+    :param encoding:    encoding of the template
+    :type encoding:     str
+    :return:            ({header: value}, body)
+    :type return:       tuple
+    """
+    with open(filepath, encoding=encoding) as fp:
+        text = fp.read()
+    head, sep, body = text.partition('\n\n')
+    if not sep:
+        raise ValueError("Mail template {} requires headers, an empty line "
+            "and a body".format(filepath))
+    headers = collections.OrderedDict()
+    for line in head.splitlines():
+        name, colon, value = line.partition(':')
+        if not colon:
+            raise ValueError("Invalid header line in mail template: {}".format(line))
+        headers[name.strip()] = value.strip()
+    if 'Subject' not in headers:
+        raise ValueError("Mail template {} has no Subject header".format(filepath))
+    return headers, body
+
+
+def render_mail(template, fields, sender, *, to=(), bcc=()):
+    """Create a message from a template read by `read_mail_template`.
+
+    :param template:    ({header: value}, body)
+    :type template:     tuple
+    :param fields:      values for the placeholders of the template
+    :type fields:       dict
+    :param sender:      the From address
+    :type sender:       str
+    :param to:          addresses of the To-header
+    :type to:           list
+    :param bcc:         addresses not shown in the message
+    :type bcc:          list
+    :return:            (message, recipients)
+    :type return:       tuple
+    """
+    headers, body = template
+    msg = email.message.EmailMessage()
+    msg['From'] = sender
+    msg['To'] = ', '.join(to) if to else sender
+    msg['Date'] = email.utils.formatdate(localtime=True)
+    msg['Message-ID'] = email.utils.make_msgid()
+    for name, value in headers.items():
+        msg[name] = value.format(**fields)
+    msg.set_content(body.format(**fields), cte='quoted-printable')
+    recipients = [email.utils.parseaddr(a)[1] for a in itertools.chain(to, bcc)]
+    return msg, recipients
+
+
+def student_mails(db, template, sender):
+    """One message per student. The placeholders are the attributes
+    of Student, `group` excludes group 0.
+    """
+    for s in db:
+        fields = {attr: getattr(s, attr) for attr in Student.attributes}
+        fields['group'] = ', '.join(map(str, sorted(s.group.difference({0,}))))
+        yield render_mail(template, fields, sender, to=[format_address(s)])
+
+
+def group_mails(db, template, sender, groups, *, max_recipients=50):
+    """One message per group and `max_recipients` students. Students are
+    addressed as Bcc. The placeholders are `group` and `count`.
+    """
+    by_groups = db.group_by_group()
+    for grp in sorted(groups):
+        addrs = [format_address(s) for s in sorted(by_groups.get(grp, []),
+            key=lambda s: s.wikiname)]
+        fields = {'group': grp, 'count': len(addrs)}
+        for i in range(0, len(addrs), max_recipients):
+            yield render_mail(template, fields, sender, bcc=addrs[i:i + max_recipients])
+
+
+class RateLimiter:
+    """Delays callers of `wait` to at most `rate` calls per second"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next > now:
+                await asyncio.sleep(self.next - now)
+            self.next = max(now, self.next) + self.interval
+
+
+class SMTPPool:
+    """At most `size` SMTP connections, each reused for several messages.
+    smtplib blocks, so every SMTP command runs in a worker thread.
+    """
+
+    def __init__(self, host='localhost', port=25, size=4, *, starttls=False,
+        user=None, password=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.size = size
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password or '')
+        return smtp
+
+    @staticmethod
+    def _quit(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """An open connection. It is dropped if the block fails."""
+        async with self.slots:
+            if self.idle:
+                smtp = self.idle.pop()
+            else:
+                smtp = await asyncio.to_thread(self._connect)
+            try:
+                yield smtp
+            except BaseException:
+                await asyncio.to_thread(self._quit, smtp)
+                raise
+            self.idle.append(smtp)
+
+    async def close(self):
+        while self.idle:
+            await asyncio.to_thread(self._quit, self.idle.pop())
+
+
+def is_permanent_smtp_error(exc):
+    """Does retrying not make sense for `exc`?"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+async def send_mails(mails, pool, *, rate=None, retries=3, backoff=1.0):
+    """Send (message, recipients) pairs of the iterable `mails`. One
+    worker per connection of `pool` takes the messages from a bounded
+    queue, thus `mails` is consumed lazily. Temporary failures are
+    retried `retries` times with exponential backoff.
+
+    :param mails:       (message, recipients) pairs
+    :type mails:        iterable
+    :param pool:        the SMTP connections to use
+    :type pool:         SMTPPool
+    :param rate:        maximum number of messages per second
+    :type rate:         float
+    :param retries:     number of retries of a message
+    :type retries:      int
+    :param backoff:     delay in seconds before the first retry
+    :type backoff:      float
+    :return:            (number of messages sent, number of failures)
+    :type return:       tuple
+    """
+    limiter = RateLimiter(rate)
+    workers = pool.size
+    queue = asyncio.Queue(maxsize=2 * workers)
+    counts = collections.Counter()
+
+    async def deliver(msg, recipients):
+        for attempt in range(retries + 1):
+            await limiter.wait()
+            try:
+                async with pool.connection() as smtp:
+                    refused = await asyncio.to_thread(smtp.send_message,
+                        msg, to_addrs=recipients)
+            except (smtplib.SMTPException, OSError) as exc:
+                if is_permanent_smtp_error(exc) or attempt == retries:
+                    warn("Sending '{}' failed: {}", msg['Subject'], exc)
+                    return False
+                debug("Sending '{}' failed, retrying: {}", msg['Subject'], exc)
+                await asyncio.sleep(backoff * 2 ** attempt)
+            else:
+                for addr, (code, reason) in refused.items():
+                    warn("Recipient {} refused: {} {}", addr, code, reason)
+                return True
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            sent = await deliver(*item)
+            counts['sent' if sent else 'failed'] += 1
+            metrics.incr('mails.sent' if sent else 'mails.failed')
+
+    async def put(item):
+        """queue.put, but raise the exception of a failed worker instead of
+        waiting forever for a queue nobody takes from
+        """
+        putting = asyncio.ensure_future(queue.put(item))
+        while not putting.done():
+            running = [task for task in tasks if not task.done()]
+            await asyncio.wait([putting] + running, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task.done() and task.exception():
+                    putting.cancel()
+                    raise task.exception()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        for item in mails:
+            await put(item)
+        for _ in tasks:
+            await put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await pool.close()
+    return counts['sent'], counts['failed']
+
+
+# ---------------------------- output renderers ---------------------------
+
+# student fields of table, CSV and NDJSON renderers
+STUDENT_FIELDS = ['matrnr', 'group', 'wikiname', 'lastname', 'firstname',
+    'degree', 'regdate', 'email', 'grade']
+STUDENT_FIELD_TITLES = {'matrnr': 'Matriculation number', 'group': 'Group',
+    'wikiname': 'Wikiname', 'lastname': 'Lastname', 'firstname': 'Firstname',
+    'degree': 'Degree', 'regdate': 'Registration date', 'email': 'Email address',
+    'grade': 'Grade'}
+
+
+class Renderer:
+    """Writes students to `stream` as soon as they are passed to `student`.
+    Grouped output is announced by `section` and `end_section`.
+    Subclasses override the hooks they need.
+    """
+
+    def __init__(self, stream, fields=None):
+        self.stream = stream
+        self.fields = fields or STUDENT_FIELDS
+
+    def begin(self):
+        pass
+
+    def section(self, title):
+        pass
+
+    def student(self, student):
+        raise NotImplementedError()
+
+    def end_section(self):
+        pass
+
+    def end(self):
+        pass
+
+
+class FoswikiTableRenderer(Renderer):
+    """Foswiki table with one row per student; sections are ignored"""
+
+    def __init__(self, stream, fields=None, titles=None):
+        super().__init__(stream, fields)
+        self.titles = titles or [STUDENT_FIELD_TITLES[f] for f in self.fields]
+
+    def begin(self):
+        self.stream.write(foswiki_row(self.titles, True) + '\n')
+
+    def values(self, student):
+        return [','.join(map(str, student.group)) if field == 'group'
+                else getattr(student, field) for field in self.fields]
+
+    def student(self, student):
+        self.stream.write(foswiki_row(self.values(student)) + '\n')
+
+
+class JoinedRenderer(Renderer):
+    """One line per section, listing the formatted students separated by `SEP`.
+    The line is written piecewise, thus no string of all students is built.
+    """
+    SEP = ', '
+    PREFIX = ''
+    SUFFIX = ''
+
+    def __init__(self, stream, fields=None):
+        super().__init__(stream, fields)
+        self.title = None
+        self.first = True
+
+    def format(self, student):
+        raise NotImplementedError()
+
+    def section(self, title):
+        self.title = title
+        self.stream.write(title + '\n')
+
+    def student(self, student):
+        if self.first:
+            self.stream.write(('  ' if self.title else '') + self.PREFIX)
+            self.first = False
+        else:
+            self.stream.write(self.SEP)
+        self.stream.write(self.format(student))
+
+    def end_section(self):
+        if self.first:
+            self.stream.write(('  ' if self.title else '') + self.PREFIX)
+        self.stream.write(self.SUFFIX + '\n')
+        self.first = True
+
+    def end(self):
+        if self.title is None:
+            self.end_section()
+
+
+class ToHeaderRenderer(JoinedRenderer):
+    """SMTP To-header of all students"""
+    PREFIX = 'To: '
+
+    def format(self, student):
+        return format_address(student)
+
+
+class MetaPreferenceRenderer(JoinedRenderer):
+    """Foswiki %META:PREFERENCE% setting GROUP to the wikinames"""
+    PREFIX = '%META:PREFERENCE{name="GROUP" title="GROUP" type="Set" value="'
+    SUFFIX = '"}%'
+
+    def format(self, student):
+        return student.wikiname
+
+
+class ElementsRenderer(Renderer):
+    """One value per line, sections as Foswiki headings"""
+
+    def section(self, title):
+        self.stream.write('---++ {}\n'.format(title))
+
+    def student(self, student):
+        self.stream.write('{}\n'.format(getattr(student, self.fields[0])))
+
+    def end_section(self):
+        self.stream.write('\n')
+
+
+class NDJSONRenderer(Renderer):
+    """One JSON object per student and line; grouped output adds a 'section' key"""
+
+    def __init__(self, stream, fields=None):
+        super().__init__(stream, fields)
+        self.title = None
+
+    def section(self, title):
+        self.title = title
+
+    def student(self, student):
+        obj = collections.OrderedDict()
+        if self.title is not None:
+            obj['section'] = self.title
+        for field in self.fields:
+            value = getattr(student, field)
+            if field == 'group':
+                value = sorted(value)
+            elif field == 'regdate':
+                value = value.isoformat() if value else None
+            obj[field] = value
+        self.stream.write(json.dumps(obj, ensure_ascii=False) + '\n')
+
+
+class CSVRenderer(Renderer):
+    """CSV with a header row; grouped output adds a 'section' column"""
+
+    def __init__(self, stream, fields=None, grouped=False, dialect=csv_export_dialect):
+        super().__init__(stream, fields)
+        self.grouped = grouped
+        self.title = None
+        self.writer = csv.writer(stream, dialect=dialect)
+
+    def begin(self):
+        self.writer.writerow((['section'] if self.grouped else []) + self.fields)
+
+    def section(self, title):
+        self.title = title
+
+    def student(self, student):
+        row = [self.title] if self.grouped else []
+        for field in self.fields:
+            value = getattr(student, field)
+            if field == 'group':
+                value = ','.join(map(str, sorted(value)))
+            row.append('' if value is None else value)
+        self.writer.writerow(row)
+
+
+@profiled('render')
+def render_students(renderer, db, *, group=None, bucket='batch', order=None):
+    """Pass the students of `db` to `renderer`.
+
+    :param renderer:    the renderer writing the output
+    :type renderer:     Renderer
+    :param db:          students to render
+    :type db:           StudentDatabase | SQLiteStudentStore | ShardedStudentStore
+    :param group:       None, 'group' or 'regdate' for sections per group
+                        or per registration date bucket
+    :type group:        str
+    :param bucket:      bucket of registration dates, see `RegistrationIndex`
+    :type bucket:       str
+    :param order:       name of the sorting method of `db` (eg. 'sorted_by_wikiname')
+                        applied to ungrouped output
+    :type order:        str
+    """
+    renderer.begin()
+    if group == 'group':
+        for grp, students in db.group_by_group().items():
+            renderer.section('Group {}'.format(grp))
+            for s in students:
+                renderer.student(s)
+            renderer.end_section()
+    elif group == 'regdate':
+        for regdate, students in db.group_by_regdate(bucket).items():
+            renderer.section('Registration date {}'.format(regdate.isoformat()))
+            for s in students:
+                renderer.student(s)
+            renderer.end_section()
+    else:
+        for s in (getattr(db, order)() if order else db):
+            renderer.student(s)
+    renderer.end()
+
+
+# -------------------------------- daemon ---------------------------------
+
+# global options of `cli` taking a value
+CLI_VALUE_OPTIONS = {'--profile-json', '--profile-pstats', '--log-level',
+    '--metrics', '--metrics-format'}
+
+
+def command_path(argv):
+    """The (sub)command names of a command line, global options skipped"""
+    names, args = [], iter(argv)
+    for arg in args:
+        if arg in CLI_VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith('-'):
+            names.append(arg)
+            if len(names) == 2:
+                break
+        elif names:
+            break
+    return tuple(names)
+
+
+def is_served(argv):
+    """May the command line `argv` be executed by `serve`?"""
+    path = command_path(argv)
+    return path[:1] == ('stats',) or path in {('students', 'read'), ('spreadsheets', 'create')}
+
+
+def run_served_command(argv, cwd=None):
+    """Execute the command line `argv` in this process like `control.py`
+    in the working directory `cwd`, capturing its output.
+
+    :return:        {'status': exit code, 'stdout': text, 'stderr': text}
+    :type return:   dict
+    """
+    if not is_served(argv):
+        return {'status': 2, 'stdout': '', 'stderr':
+            'Error: only students read, spreadsheets create and stats are served\n'}
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    level = logging.getLogger().level
+    previous = os.getcwd()
+    profiler.phases.clear()
+    try:
+        os.chdir(cwd or previous)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                status = cli.main(args=list(argv), prog_name='control.py', standalone_mode=False)
+                status = status if isinstance(status, int) else 0
+            except click.ClickException as exc:
+                stderr.write('Error: {}\n'.format(exc.format_message()))
+                status = exc.exit_code
+            except click.Abort:
+                status = 1
+            except SystemExit as exc:
+                status = exc.code if isinstance(exc.code, int) else 1
+            except Exception as exc:
+                stderr.write('{}: {}\n'.format(type(exc).__name__, exc))
+                status = 1
+    finally:
+        os.chdir(previous)
+        logging.basicConfig(stream=sys.stderr, level=level,
+            format='%(levelname)s: %(message)s', force=True)
+        metrics.counters.clear()
+    return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+
+async def serve_commands(socket_path, *, poll=1.0):
+    """Answer command lines sent to the Unix socket `socket_path`.
+    A request is one JSON line {"argv": [...], "cwd": "..."}; the answer
+    is one JSON line as returned by `run_served_command`. Requests are
+    executed one after another. Every `poll` seconds changed files
+    are parsed again.
+    """
+    async def handle(reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            response = run_served_command(request['argv'], request.get('cwd'))
+        except (ValueError, KeyError, TypeError) as exc:
+            response = {'status': 2, 'stdout': '', 'stderr': 'Invalid request: {}\n'.format(exc)}
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+        writer.close()
+
+    async def watch():
+        while True:
+            await asyncio.sleep(poll)
+            file_cache.refresh()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    watcher = asyncio.create_task(watch())
+    print('Serving on {}'.format(socket_path), flush=True)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        watcher.cancel()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# --------------------------------- watch ---------------------------------
+
+class InotifyWatcher:
+    """Wait for changes of files using Linux inotify. The directories
+    of the files are watched, since editors often replace files.
+    """
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, filepaths):
+        self.filepaths = {os.path.abspath(f) for f in filepaths}
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        self.directories = {}   # watch descriptor : directory
+        for directory in {os.path.dirname(f) for f in self.filepaths}:
+            wd = libc.inotify_add_watch(self.fd, directory.encode(), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'Cannot watch {}'.format(directory))
+            self.directories[wd] = directory
+
+    def wait(self, timeout=None):
+        """Changed files after blocking up to `timeout` seconds (forever if None).
+        Events of other files in the watched directories are skipped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while not changed:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                break
+            data, offset = os.read(self.fd, 65536), 0
+            while offset < len(data):
+                wd, _mask, _cookie, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                filepath = os.path.join(self.directories.get(wd, ''), name)
+                if filepath in self.filepaths:
+                    changed.add(filepath)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wait for changes of files by comparing their modification time
+    and size every `interval` seconds.
+    """
+
+    def __init__(self, filepaths, *, interval=1.0):
+        self.interval = interval
+        self.stamps = {os.path.abspath(f): self.stamp(f) for f in filepaths}
+
+    @staticmethod
+    def stamp(filepath):
+        try:
+            return FileCache.stamp(filepath)
+        except OSError:
+            return None
+
+    def wait(self, timeout=None):
+        """Changed files after blocking up to `timeout` seconds (forever if None)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for filepath, stamp in self.stamps.items():
+                current = self.stamp(filepath)
+                if current != stamp:
+                    self.stamps[filepath] = current
+                    changed.add(filepath)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            pause = self.interval if deadline is None \
+                else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(pause)
+
+    def close(self):
+        pass
+
+
+def file_watcher(filepaths, *, interval=1.0):
+    """An InotifyWatcher, or a PollingWatcher where inotify is unavailable"""
+    try:
+        return InotifyWatcher(filepaths)
+    except (OSError, AttributeError) as exc:
+        info('inotify unavailable ({}), polling every {}s', exc, interval)
+        return PollingWatcher(filepaths, interval=interval)
+
+
+def wait_for_changes(watcher, *, debounce=0.5):
+    """Block until files change. Return once no further change happened
+    for `debounce` seconds, so bursts of writes trigger one rebuild.
+
+    :return:        absolute filepaths of the changed files
+    :type return:   set
+    """
+    changed = watcher.wait()
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed
+        changed |= more
+
+
+WatchRule = collections.namedtuple('WatchRule', ['name', 'inputs', 'build'])
+
+
+def affected_rules(rules, changed):
+    """Rules with an input among the absolute filepaths `changed`"""
+    return [r for r in rules
+            if changed.intersection(os.path.abspath(i) for i in r.inputs)]
+
+
+def run_rules(rules):
+    """Build all `rules`. A failing rule (eg. a half-written input) is
+    reported and does not stop the others.
+    """
+    for rule in rules:
+        start = time.perf_counter()
+        try:
+            rule.build()
+        except Exception as exc:
+            warn('Building {} failed: {}: {}', rule.name, type(exc).__name__, exc)
+            continue
+        print('Rebuilt {} in {:.3f}s'.format(rule.name, time.perf_counter() - start), flush=True)
+
+
+def write_registrations(db, filepath):
+    """Write the Foswiki table of Main/UnprocessedRegistrations for `db`"""
+    data = [[MAPPING_XML_REGISTRATION[k] for k in ('email', 'wikiname', 'lastname', 'firstname')]]
+    for s in db.sorted_by_wikiname():
+        data.append([s.email, s.wikiname, s.lastname, s.firstname])
+    with open(filepath, 'w', encoding='utf-8') as fp:
+        print_foswiki_table(data, stream=fp)
+    metrics.incr('files.written')
+
+
+# -------------------------- partner submissions --------------------------
+
+# a WikiName (optionally as Main.WikiName) or a matriculation number
+PARTNER_TOKEN = re.compile(r'\b(?:Main\.)?([A-Z][a-z]+(?:[A-Z][a-z0-9]*)+)\b|\b(\d{7,8})\b')
+
+
+def partner_topic_filepath(wikipath, wikiname, partnersubmission):
+    """Filepath of the Foswiki topic Main/<WikiName><partnersubmission>"""
+    return os.path.join(wikipath, 'data', 'Main', wikiname + partnersubmission + '.txt')
+
+
+def parse_partner_topic(filepath):
+    """WikiNames and matriculation numbers named in a partner topic.
+    %META% lines are skipped, they name the author (ie. the student).
+
+    :param filepath:    the topic file
+    :type filepath:     str
+    :return:            named tokens in order of appearance
+    :type return:       list
+    """
+    tokens = []
+    with open(filepath, encoding='utf-8', errors='replace') as fp:
+        for line in fp:
+            if line.startswith('%META:'):
+                continue
+            for wikiname, matrnr in PARTNER_TOKEN.findall(line):
+                token = wikiname or matrnr
+                if token not in tokens:
+                    tokens.append(token)
+    return tokens
+
+
+class PartnerTopicCache:
+    """Tokens of parsed partner topics. An entry is valid as long as
+    mtime and size of the topic file are unchanged.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.topics = {}    # path: {mtime, size, tokens}
+        if filepath and os.path.exists(filepath):
+            with open(filepath, encoding='utf-8') as fp:
+                self.topics = json.load(fp)['topics']
+
+    def get(self, path, stat):
+        entry = self.topics.get(path)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['tokens']
+        return None
+
+    def put(self, path, stat, tokens):
+        self.topics[path] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'tokens': tokens}
+
+    def save(self):
+        if not self.filepath:
+            return
+        with open(self.filepath, 'w', encoding='utf-8') as fp:
+            json.dump({'topics': self.topics}, fp, indent=1, sort_keys=True)
+
+
+def read_partner_topics(filepaths, cache, *, workers=8):
+    """Read the partner topics `filepaths` in parallel.
+    Topics unchanged since they were cached are not parsed again.
+
+    :param filepaths:   topic files
+    :type filepaths:    list
+    :param cache:       cache of parsed topics, updated in place
+    :type cache:        PartnerTopicCache
+    :param workers:     number of threads reading topics
+    :type workers:      int
+    :return:            ({path: tokens or None if the topic does not exist}, number of parsed topics)
+    :type return:       tuple
+    """
+    def read(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return path, None, None, False
+        tokens = cache.get(path, stat)
+        if tokens is not None:
+            return path, stat, tokens, False
+        return path, stat, parse_partner_topic(path), True
+
+    topics, parsed = {}, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, stat, tokens, fresh in pool.map(read, filepaths):
+            topics[path] = tokens
+            if fresh:
+                cache.put(path, stat, tokens)
+                parsed += 1
+    return topics, parsed
+
+
+class PartnerGraph:
+    """Partner declarations of one assignment indexed by wikiname.
+    A declaration is a directed edge, `partners` returns the
+    undirected neighbourhood of a student.
+    """
+
+    def __init__(self):
+        self.declared = {}   # wikiname: set of wikinames, missing if there is no topic
+        self.edges = collections.defaultdict(set)
+
+    def declare(self, wikiname, partners):
+        self.declared[wikiname] = set(partners)
+        for partner in partners:
+            self.edges[wikiname].add(partner)
+            self.edges[partner].add(wikiname)
+
+    def partners(self, wikiname):
+        return self.edges.get(wikiname, set())
+
+    def check(self, students):
+        """Inconsistent declarations of `students`.
+
+        :param students:    students expected to declare a partner
+        :type students:     list
+        :return:            (kind, wikiname, partners, detail) with kind one of
+                            'missing', 'asymmetric', 'cross-group', 'multi-partner'
+        :type return:       list
+        """
+        groups = {s.wikiname: s.group - {0} for s in students}
+        issues = []
+        for wikiname in sorted(groups):
+            declared = self.declared.get(wikiname)
+            if declared is None:
+                issues.append(('missing', wikiname, '', 'no topic'))
+                continue
+            if not declared:
+                issues.append(('missing', wikiname, '', 'no partner named'))
+            if len(self.partners(wikiname)) > 1:
+                named_by = sum(1 for other in self.partners(wikiname)
+                               if wikiname in self.declared.get(other, ()))
+                issues.append(('multi-partner', wikiname, ', '.join(sorted(self.partners(wikiname))),
+                    'names {}, named by {}'.format(len(declared), named_by)))
+            for partner in sorted(declared):
+                if wikiname not in self.declared.get(partner, ()):
+                    issues.append(('asymmetric', wikiname, partner,
+                        '{} does not name {}'.format(partner, wikiname)))
+
+        # every undirected edge once, whoever declared it
+        seen = set()
+        for wikiname in sorted(groups):
+            for partner in sorted(self.partners(wikiname)):
+                pair = frozenset((wikiname, partner))
+                if partner not in groups or pair in seen:
+                    continue
+                seen.add(pair)
+                if groups[partner].isdisjoint(groups[wikiname]):
+                    issues.append(('cross-group', wikiname, partner, 'groups {} and {}'.format(
+                        ','.join(map(str, sorted(groups[wikiname]))),
+                        ','.join(map(str, sorted(groups[partner]))))))
+        return issues
+
+
+def partner_graph(db, topics, partnersubmission, wikipath):
+    """Build the partner graph of an assignment from its topics.
+    Named tokens are resolved to students by wikiname or matriculation
+    number, other WikiWords are ignored.
+
+    :param db:                  the students
+    :type db:                   StudentDatabase | list
+    :param topics:              {path: tokens} as returned by `read_partner_topics`
+    :type topics:               dict
+    :param partnersubmission:   topic suffix of the assignment, eg. 'PartnerTwo'
+    :type partnersubmission:    str
+    :param wikipath:            the wiki directory
+    :type wikipath:             str
+    :return:                    the graph
+    :type return:               PartnerGraph
+    """
+    by_wikiname = {s.wikiname: s for s in db}
+    by_matrnr = {str(s.matrnr): s for s in db}
+    graph = PartnerGraph()
+    for wikiname in by_wikiname:
+        tokens = topics.get(partner_topic_filepath(wikipath, wikiname, partnersubmission))
+        if tokens is None:
+            continue
+        partners = []
+        for token in tokens:
+            student = by_wikiname.get(token) or by_matrnr.get(token)
+            if student and student.wikiname != wikiname and student.wikiname not in partners:
+                partners.append(student.wikiname)
+        graph.declare(wikiname, partners)
+    return graph
+
+
+# ----------------------------- term archives -----------------------------
+
+class TermArchive:
+    """Compressed archive (ZIP) of the files of one term.
+
+    Besides the archived files it contains a binary index of all students
+    sorted by matriculation number with their grade and tutorial group.
+    Members of a ZIP file are compressed individually, so a lookup
+    only reads the (uncompressed) index member.
+    """
+    INDEX = 'index.bin'
+    RECORD = struct.Struct('>IBH')  # matrnr, grade, group
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._index = None
+
+    @classmethod
+    def create(cls, filepath, term, db, filepaths):
+        """Write the archive of `term` with the given files and the index of `db`.
+
+        :param filepath:    archive to write
+        :type filepath:     str
+        :param term:        term identifier like '14'
+        :type term:         str
+        :param db:          students of the term
+        :type db:           StudentDatabase
+        :param filepaths:   files to archive (stored by basename)
+        :type filepaths:    list
+        :return:            the archive
+        :type return:       TermArchive
+        """
+        records = sorted((s.matrnr, s.grade or 0, max(s.group, default=0)) for s in db)
+        index = b''.join(cls.RECORD.pack(*r) for r in records)
+        tmppath = filepath + '.tmp'
+        with zipfile.ZipFile(tmppath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.comment = 'term {}'.format(term).encode('ascii')
+            for path in filepaths:
+                zf.write(path, arcname=os.path.basename(path))
+            zf.writestr(cls.INDEX, index, compress_type=zipfile.ZIP_STORED)
+        os.replace(tmppath, filepath)
+        info('Archived {} files and {} students to {}', len(filepaths), len(records), filepath)
+        metrics.incr('files.written')
+        return cls(filepath)
+
+    @property
+    def term(self):
+        with zipfile.ZipFile(self.filepath) as zf:
+            return zf.comment.decode('ascii').split()[-1]
+
+    def names(self):
+        """Names of the archived files"""
+        with zipfile.ZipFile(self.filepath) as zf:
+            return [n for n in zf.namelist() if n != self.INDEX]
+
+    def read(self, name):
+        """Content of the archived file `name` as bytes"""
+        with zipfile.ZipFile(self.filepath) as zf:
+            return zf.read(name)
+
+    def lookup(self, matrnr):
+        """Grade and group of the student with `matrnr` in this term.
+
+        :return:        (grade, group) or None if the student is unknown
+        :type return:   tuple
+        """
+        if self._index is None:
+            with zipfile.ZipFile(self.filepath) as zf:
+                self._index = zf.read(self.INDEX)
+        size = self.RECORD.size
+        lo, hi = 0, len(self._index) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            m, grade, group = self.RECORD.unpack_from(self._index, mid * size)
+            if m == matrnr:
+                return grade, group
+            if m < matrnr:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+
+def next_term(term):
+    """Identifier of the term following `term` ('14' -> '15')"""
+    return '{:02d}'.format((int(term) + 1) % 100)
+
+
+def next_term_config(config, *, weeks=52):
+    """Metadata of the next term seeded from `config`. Deadlines are
+    moved by `weeks` weeks, hence they stay on the same weekday.
+    """
+    seeded = copy.deepcopy(config)
+    for assignment in seeded.assignments:
+        assignment['deadline'] += datetime.timedelta(weeks=weeks)
+    return seeded
+
+
+def archive_term(term, students, metadata, patterns, archivepath):
+    """Archive the students database, metadata and the files matching
+    `patterns` (spreadsheets, grading points) of `term`.
+
+    :return:        the archive and the metadata of the term
+    :type return:   tuple
+    """
+    db = load_students(students)
+    config = load_config(metadata)
+    filepaths = [students, metadata]
+    for pattern in patterns:
+        filepaths.extend(p for p in sorted(glob.glob(pattern)) if p not in filepaths)
+    return TermArchive.create(archivepath, term, db, filepaths), config
+
+
+def file_term(filepath):
+    """Term of a students-YY.xml or term-YY.zip file"""
+    if zipfile.is_zipfile(filepath):
+        return TermArchive(filepath).term
+    match = re.search(r'(\d{2})\D*$', os.path.basename(filepath))
+    if not match:
+        raise ValueError('Cannot determine the term of {}'.format(filepath))
+    return match.group(1)
+
+
+@profiled('carry_over')
+def carry_over(db, filepaths):
+    """Annotate the students of `db` with their records of previous terms.
+
+    This is a hash join on the matriculation number: the index is built
+    over the students of `db` and the previous terms are streamed one
+    after another, so at most one old student is in memory at a time.
+    Term archives are probed through their sorted index instead.
+
+    :param db:          students of the current term, annotated in place
+    :type db:           StudentDatabase
+    :param filepaths:   students-YY.xml files or term-YY.zip archives
+    :type filepaths:    list
+    :return:            matriculation numbers of the annotated students
+    :type return:       set
+    """
+    by_matrnr = {s.matrnr: s for s in db}
+    annotated = set()
+    for filepath in filepaths:
+        term = file_term(filepath)
+        if zipfile.is_zipfile(filepath):
+            archive = TermArchive(filepath)
+            for matrnr, student in by_matrnr.items():
+                found = archive.lookup(matrnr)
+                if found is not None:
+                    student.add_history(TermRecord(term, *found))
+                    annotated.add(matrnr)
+            continue
+
+        for old in iter_students_xml(filepath):
+            student = by_matrnr.get(old.matrnr)
+            if student is not None:
+                student.add_history(TermRecord(term, old.grade or 0,
+                    max(old.group, default=0)))
+                annotated.add(old.matrnr)
+    return annotated
+
+
+# ---------------------------- implementation -----------------------------
+
+def parse_grading_points(grading, encoding='utf-8-sig'):
+    """Retrieve a Foswiki table from the given file and parse it.
+
+    :param grading:     the filepath to the Foswiki article with the table
+    :type grading:      str
+    :param encoding:    the encoding of the grading file
+    :type encoding:     str
+    """
+    bold = lambda v: (lambda t: t[0] == '*' and t[-1] == '*' if t else False)(v.strip())
+
+    table = read_foswiki_table(grading, encoding=encoding)
+    if not table:
+        raise ValueError("Grading scheme table must not be empty")
+
+    grading = collections.OrderedDict()
+    check = {}
+    assignment, exercise = None, None
+    for row in table:
+        assert len(row) == 3, "grading points table must always have 3 columns"
+        if bold(row[0]) and row[1] == '':
+            assignment = row[0].strip()[1:-1]
+            exercise = None
+            grading[assignment] = collections.OrderedDict()
+            check[assignment] = { 'expect': int(row[2]) }
+        elif row[0].strip() == '':
+            assert assignment, "Assignment line required before exercise"
+            assert exercise, "Exercise line required before points line"
+            points, pts = row[1].strip(), int(row[2].strip())
+            grading[assignment][exercise][points] = int(pts)
+        else:
+            assert assignment, "Assignment line required before exercise"
+            exercise = row[0].strip()
+            grading[assignment][exercise] = collections.OrderedDict()
+            check[assignment][exercise] = { 'expect': int(row[2]) }
+
+    # consistency check
+    for assignment, v1 in grading.items():
+        check[assignment]['points'] = 0
+        for exercise, v2 in v1.items():
+            check[assignment][exercise]['points'] = 0
+            for points, pts in v2.items():
+                check[assignment][exercise]['points'] += abs(pts)
+
+            if check[assignment][exercise]['points'] != check[assignment][exercise]['expect']:
+                msg = 'Sum of points inconsistent in {}, {} ({} != {})'
+                raise ValueError(msg.format(assignment, exercise,
+                    check[assignment][exercise]['points'],
+                    check[assignment][exercise]['expect']))
+            check[assignment]['points'] += check[assignment][exercise]['points']
+
+        if check[assignment]['points'] != check[assignment]['expect']:
+            msg = 'Sum of points inconsistent in {} ({} != {})'
+            raise ValueError(msg.format(assignment, check[assignment]['points'],
+                check[assignment]['expect']))
+
+    return grading
+
+
+GradingExercise = collections.namedtuple('GradingExercise',
+    ['name', 'points', 'row', 'criteria', 'criterion_rows'])
+
+GradingAssignment = collections.namedtuple('GradingAssignment',
+    ['name', 'points', 'exercises', 'criterion_rows', 'total_row',
+     'sum_chunks'])
+
+
+def split_sum_rows(rows, max_values_per_sum):
+    """Distribute the row indices `rows` into chunks such that no
+    SUM formula of an assignment spreadsheet references more than
+    `max_values_per_sum` values. The first chunk is summed up in the
+    'Gesamt' row, all other chunks in '[ split ]' rows.
+
+    :param rows:                row indices of criterion rows
+    :type rows:                 list
+    :param max_values_per_sum:  maximum number of values per SUM formula
+    :type max_values_per_sum:   int
+    :return:                    chunks of row indices
+    :type return:               tuple
+    """
+    consider = [list(rows)]
+    i = 0
+    while i < len(consider):
+        special = 2 if i == 0 else 0
+        if len(consider[i]) + len(consider) - special > max_values_per_sum:
+            value = consider[i].pop()
+            while i + 1 >= len(consider):
+                consider.append([])
+            consider[i + 1].append(value)
+            i = 0
+        else:
+            i += 1
+    return tuple(tuple(chunk) for chunk in consider)
+
+
+class GradingScheme:
+    """Compiled, read-only representation of the grading points table.
+
+    The spreadsheet layout of every assignment (row of every exercise
+    and criterion, the 'Gesamt' row and the chunking of criterion rows
+    into SUM formulas) is computed once and can be shared by all groups.
+    """
+    __slots__ = ('_assignments', 'max_values_per_sum')
+
+    def __init__(self, grading, *, max_values_per_sum=12):
+        """Compile the nested grading structure returned by
+        `parse_grading_points`.
+
+        :param grading:             {assignment: {exercise: {criterion: points}}}
+        :type grading:              dict
+        :param max_values_per_sum:  maximum number of values per SUM formula
+        :type max_values_per_sum:   int
+        """
+        assignments = collections.OrderedDict()
+        for ass, exercises in grading.items():
+            rowid = 2  # title row and matriculation number row
+            compiled = []
+            criterion_rows = []
+            for exercise, criteria in exercises.items():
+                exercise_row = rowid
+                rowid += 1
+                rows = tuple(range(rowid, rowid + len(criteria)))
+                rowid += len(criteria) + 1  # one empty line per exercise
+                criterion_rows.extend(rows)
+                compiled.append(GradingExercise(exercise,
+                    sum(abs(p) for p in criteria.values()), exercise_row,
+                    tuple(criteria.items()), rows))
+
+            assignments[ass] = GradingAssignment(ass,
+                sum(e.points for e in compiled), tuple(compiled),
+                tuple(criterion_rows), rowid,
+                split_sum_rows(criterion_rows, max_values_per_sum))
+
+        object.__setattr__(self, '_assignments', assignments)
+        object.__setattr__(self, 'max_values_per_sum', max_values_per_sum)
+
+    @classmethod
+    def from_file(cls, filepath, *, encoding='utf-8-sig', **kwargs):
+        """Parse the grading points table at `filepath` and compile it.
+
+        :param filepath:    the filepath to the Foswiki article with the table
+        :type filepath:     str
+        :param encoding:    the encoding of the grading file
+        :type encoding:     str
+        :return:            the compiled grading scheme
+        :type return:       GradingScheme
+        """
+        return cls(parse_grading_points(filepath, encoding=encoding), **kwargs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GradingScheme is immutable")
+
+    def __getitem__(self, assignment):
+        return self._assignments[assignment]
+
+    def __contains__(self, assignment):
+        return assignment in self._assignments
+
+    def __iter__(self):
+        return iter(self._assignments)
+
+    def __len__(self):
+        return len(self._assignments)
+
+    def items(self):
+        return self._assignments.items()
+
+    def total_row(self, assignment):
+        """Row index of the 'Gesamt' row of `assignment`"""
+        return self._assignments[assignment].total_row
+
+    def __repr__(self):
+        return '<GradingScheme of {} assignments>'.format(len(self))
+
+
+def spreadsheet_cell_id(x, y, *, fixed=False):
+    """Get (x, y) coordinates and return cell identifier (like A4).
+    Set fixed to True to get a static identifier like $A$4.
+    """
+    tmpl = "${}${}" if fixed else "{}{}"
+    if x < 0 or y < 0:
+        raise ValueError("spreadsheet_cell_id requires non-negative coordinates")
+    column = ''
+    x += 1
+    while x > 0:
+        x, rem = divmod(x - 1, 26)
+        column = chr(65 + rem) + column
+    return tmpl.format(column, y + 1)
+
+
+def file_hash(filepath):
+    """SHA-1 hex digest of the content of `filepath`"""
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class BuildManifest:
+    """Records for every generated file a hash of its inputs and a hash
+    of the file written. Files whose inputs did not change are not
+    regenerated. Files which were not modified since they have been
+    generated can be overwritten without asking the user.
+    """
+
+    def __init__(self, filepath, *, force=False):
+        self.filepath = filepath
+        self.force = force
+        self.entries = {}
+        if os.path.exists(filepath):
+            with open(filepath, encoding='utf-8') as fp:
+                self.entries = json.load(fp)
+
+    @staticmethod
+    def inputs_hash(*inputs):
+        """Hash of arbitrary JSON-serializable (or str-convertible) inputs"""
+        data = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def up_to_date(self, output, inputs):
+        """Was `output` generated from `inputs`? Modifications of the
+        file since (eg. marks entered by tutors) do not matter.
+        """
+        entry = self.entries.get(output)
+        return not self.force and entry is not None \
+            and entry['inputs'] == inputs and os.path.exists(output)
+
+    def unmodified(self, output):
+        """Was `output` generated by us and not modified since?"""
+        entry = self.entries.get(output)
+        return entry is not None and os.path.exists(output) \
+            and file_hash(output) == entry['output']
+
+    def record(self, output, inputs):
+        self.entries[output] = {'inputs': inputs, 'output': file_hash(output)}
+
+    def save(self):
+        with open(self.filepath, 'w', encoding='utf-8') as fp:
+            json.dump(self.entries, fp, indent=1, sort_keys=True)
+
+
+def may_write(filepath, manifest=None, inputs=None):
+    """Decide whether `filepath` shall be (re)generated.
+
+    :param filepath:    the file to generate
+    :type filepath:     str
+    :param manifest:    the build manifest or None
+    :type manifest:     BuildManifest
+    :param inputs:      hash of the inputs of `filepath`
+    :type inputs:       str
+    :return:            None to skip the file, True to write it, False to abort
+    :type return:       bool | None
+    """
+    if manifest is not None:
+        if manifest.up_to_date(filepath, inputs):
+            debug('{} is up to date', filepath)
+            metrics.incr('files.skipped')
+            return None
+        if manifest.unmodified(filepath):
+            return True
+    if os.path.exists(filepath):
+        return confirm('File {} already exists. Overwrite it?'.format(filepath), default=False)
+    return True
+
+
+def spreadsheet_inputs(config, db, group, grading, assignments):
+    """Inputs of the spreadsheets of `group` for the given assignments
+    in the form accepted by `BuildManifest.inputs_hash`.
+    """
+    return {
+        'group': group,
+        'year': datetime.datetime.now().strftime('%Y'),
+        'wikiurl': config.wikiurl,
+        'grades': sorted(config.grades.items()),
+        'students': [(s.matrnr, s.firstname, s.lastname, s.wikiname,
+            sorted(s.group)) for s in db],
+        'assignments': [(a, grading[a['name']]) for a in assignments],
+    }
+
+
+def overview_rows(config, db, grading, group):
+    """Rows of the overview spreadsheet of `group`.
+
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          students of `group` sorted by wikiname
+    :type db:           StudentDatabase
+    :param grading:     Data specifying grading points
+    :type grading:      GradingScheme
+    :param group:       The group to generate rows for
+    :type group:        int
+    :return:            generator of rows (lists of cells)
+    :type return:       generator
+    """
+    header_row = ['Gruppe', 'Matrikelnummer', 'Vorname', 'Nachname',
+        'TWiki Name', 'Abgabegespr. (1..3)', '', '', '', 'Möchte weitermachen',
+        '', '', '', 'Übungen (1..3) Punkte', '', '', '', 'Gesamtpunkte',
+        'Gesamtnote']
+    yield header_row
+    yield [''] * len(header_row)
+
+    for s_id, student in enumerate(db):
+        s_group = student.group
+        if group != 0:
+            s_group = s_group.difference({0,})
+        s_group = ', '.join(map(str, s_group))
+
+        linked_wikiname = '=HYPERLINK("{url}"; "{name}")'.format(**{
+            'url': (config.wikiurl + 'Main/' + student.wikiname),
+            'name': student.wikiname
+        })
+
+        row = [s_group, student.matrnr, student.firstname,
+            student.lastname, linked_wikiname] + [''] * 8
+        for ass, compiled in grading.items():
+            row.append("='{}'.{}".format(ass,
+                spreadsheet_cell_id(s_id + 2, compiled.total_row)))
+        row.append('')
+        row.append('=SUM({}:{})'.format(
+            spreadsheet_cell_id(13, 2 + s_id),
+            spreadsheet_cell_id(15, 2 + s_id),
+        ))
+
+        row.append('=' + grade_formula(config, spreadsheet_cell_id(17, 2 + s_id)))
+        yield row
+
+
+def assignment_rows(config, db, compiled, assdata, group):
+    """Rows of the spreadsheet of one assignment of `group`.
+    Every student has one column, starting with the third column.
+
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          students of `group` sorted by wikiname
+    :type db:           StudentDatabase
+    :param compiled:    grading scheme of the assignment
+    :type compiled:     GradingAssignment
+    :param assdata:     the assignment as stored in `config.assignments`
+    :type assdata:      dict
+    :param group:       The group to generate rows for
+    :type group:        int
+    :return:            generator of rows (lists of cells)
+    :type return:       generator
+    """
+    # {title, "", matrnr+}
+    title = '{assignment}, Gruppe {group}, {year}'
+    row = [title.format(assignment=assdata['name'], group=group,
+        year=datetime.datetime.now().strftime('%Y')), '']
+    for student in db:
+        if 'partnersubmission' in assdata:
+            # TODO: I'd be better to a have a separate %USERSWEB% variable
+            row.append('=HYPERLINK("{url}"; "{matrnr}")'.format(**{
+                'url': (config.wikiurl + 'Main/' + student.wikiname + assdata['partnersubmission']),
+                'matrnr': student.matrnr
+            }))
+        else:
+            row.append(student.matrnr)
+    yield row
+
+    # {"Matrikelnummer", "", wikiname+}
+    hyperlink = '=HYPERLINK("{url}"; "{name}")'
+    row = ['Matrikelnummer', '']
+    for student in db:
+        baseurl = config.wikiurl + 'Main/' + student.wikiname + assdata['submission']
+        row.append(hyperlink.format(url=baseurl, name=student.wikiname))
+    yield row
+
+    empty = [''] * len(db)
+    for exercise in compiled.exercises:
+        # {exercise name}
+        yield [exercise.name, ''] + empty
+
+        # {criterion, points}
+        for criterion, points in exercise.criteria:
+            yield [criterion, points] + empty
+
+        yield [''] * (len(db) + 2)
+
+    # {"Gesamt", "", "=SUM(...)"+}
+    summ = '=SUM({})'
+    if_stmt = 'IF({}="x";{};0)'
+    rowid = compiled.total_row
+    consider = compiled.sum_chunks
+
+    row = ['Gesamt', '']
+    for s_id in range(len(db)):
+        accu = []
+        for row_id in consider[0]:
+            accu.append(if_stmt.format(
+                spreadsheet_cell_id(s_id + 2, row_id),
+                spreadsheet_cell_id(1, row_id, fixed=True)
+            ))
+        accu.append(spreadsheet_cell_id(s_id + 2, rowid + 1))
+        accu.append(spreadsheet_cell_id(s_id + 2, rowid + 2))
+        for i in range(len(consider)):
+            accu.append(spreadsheet_cell_id(s_id + 2, rowid + 3 + i))
+
+        row.append(summ.format(','.join(accu)))
+    yield row
+
+    # {"Deadline missed"}
+    yield ['Deadline verpasst', ''] + empty
+
+    # {"Bonuspunkte"}
+    yield ["Bonuspunkte", ''] + empty
+
+    # remaining consider values
+    for chunk in consider[1:]:
+        row = ['[ split ]', '']
+        for s_id in range(len(db)):
+            accu = []
+            for c in chunk:
+                accu.append(if_stmt.format(
+                    spreadsheet_cell_id(s_id + 2, c),
+                    spreadsheet_cell_id(1, c, fixed=True)
+                ))
+            row.append(summ.format(', '.join(accu)))
+        yield row
+
+
+@profiled('spreadsheets')
+def create_title_group_spreadsheet(config, db, grading, group, csvpath, csvenc='utf-8-sig', *, manifest=None):
+    """Create a group.
+
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          StudentDatabase to use
+    :type db:           StudentDatabase
     :param grading:     Data specifying grading points
-    :type grading:      dict
+    :type grading:      GradingScheme
     :param group:       The group to generate spreadsheet for
     :type group:        int
     :param csvpath:     The filepath to generate file for
     :type csvpath:      str
     :param csvenc:      Encoding of the filepath
     :type csvenc:       str
+    :param manifest:    skip the file if its inputs did not change
+    :type manifest:     BuildManifest
     """
     db = db.filter(group=group)
     db = db.sorted_by_wikiname()
-    assignments = [v['name'] for v in config.assignments]
-
-    # build grades computation
-    grade_recursive = 'IF({}<{},"{}",{{}})'
-    grades = [(name, g['max']) for name, g in config.grades.items()]
-    grades.sort(key=lambda x: x[1])
-
-    header_row = ['Gruppe', 'Matrikelnummer', 'Vorname', 'Nachname',
-        'TWiki Name', 'Abgabegespr. (1..3)', '', '', '', 'Möchte weitermachen',
-        '', '', '', 'Übungen (1..3) Punkte', '', '', '', 'Gesamtpunkte',
-        'Gesamtnote']
-    columns = len(header_row)
-    row_total_points = collections.OrderedDict()
-    for ass, v in grading.items():
-        row_total_points[ass] = 2 + 2 * len(v.keys())
-        for ex, v2 in v.items():
-            row_total_points[ass] += len(v2.keys())
+    if not isinstance(grading, GradingScheme):
+        grading = GradingScheme(grading)
 
     filepath = csvpath.format(group=group, assignment='overview')
-    if os.path.exists(filepath):
-        if not confirm('File {} already exists. Overwrite it?'.format(filepath), default=False):
-            print("Abort.")
-            return
-
+    inputs = BuildManifest.inputs_hash('overview', csvenc,
+        spreadsheet_inputs(config, db, group, grading, config.assignments))
+    write = may_write(filepath, manifest, inputs)
+    if write is None:
+        return
+    if not write:
+        print("Abort.")
+        return
+
+    metrics.incr('files.written')
     with open(filepath, "w", encoding=csvenc) as fp:
         writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
-        writer.writerow(header_row)
-        writer.writerow([''] * columns)
-
-        for s_id, student in enumerate(db):
-            s_group = student.group
-            if group != 0:
-                s_group = s_group.difference({0,})
-            s_group = ', '.join(map(str, s_group))
-
-            linked_wikiname = '=HYPERLINK("{url}"; "{name}")'.format(**{
-                'url': (config.wikiurl + 'Main/' + student.wikiname),
-                'name': student.wikiname
-            })
-
-            row = [s_group, student.matrnr, student.firstname,
-                student.lastname, linked_wikiname] + [''] * 8
-            for ass, total in row_total_points.items():
-                row.append("='{}'.{}".format(ass, spreadsheet_cell_id(s_id + 2, total)))
-            row.append('')
-            row.append('=SUM({}:{})'.format(
-                spreadsheet_cell_id(13, 2 + s_id),
-                spreadsheet_cell_id(15, 2 + s_id),
-            ))
+        writer.writerows(overview_rows(config, db, grading, group))
 
-            grade = '={}'
-            for name, maximum in grades:
-                if name != grades[-1][0]:
-                    grade = grade.format(grade_recursive)
-                    grade = grade.format(spreadsheet_cell_id(17, 2 + s_id),
-                        maximum + 1, name)
-                else:
-                    grade = grade.format('"' + str(name) + '"')
-            row.append(grade)
-            grade = grade_recursive
-            writer.writerow(row)
+    if manifest is not None:
+        manifest.record(filepath, inputs)
 
 
-def create_group_spreadsheets(config, db, grading, group, csvpath, csvenc='utf-8-sig'):
+@profiled('spreadsheets')
+def create_group_spreadsheets(config, db, grading, group, csvpath, csvenc='utf-8-sig', *, manifest=None):
     """Create a spreadsheet for one group.
 
     :param config:      A Config to read metadata from
@@ -1356,136 +4615,872 @@ def create_group_spreadsheets(config, db, grading, group, csvpath, csvenc='utf-8
     :param db:          StudentDatabase to use
     :type db:           StudentDatabase
     :param grading:     Data specifying grading points
-    :type grading:      dict
+    :type grading:      GradingScheme
     :param group:       The group to generate spreadsheet for
     :type group:        int
     :param csvpath:     The filepath to generate file for
     :type csvpath:      str
     :param csvenc:      Encoding of the filepath
     :type csvenc:       str
+    :param manifest:    skip files whose inputs did not change
+    :type manifest:     BuildManifest
     """
     db = db.filter(group=group)
     db = db.sorted_by_wikiname()
-    max_values_per_sum = 12
+    if not isinstance(grading, GradingScheme):
+        grading = GradingScheme(grading)
 
     for assdata in config.assignments:
         filepath = csvpath.format(group=group, assignment=assdata['name'])
+        compiled = grading[assdata['name']]
+        assert len(compiled.criterion_rows) < 120, ("Sorry, I guess this high "
+            "number of point lines will cause troubles with certain "
+            "spreadsheet software. Consider --to-xlsx.")
+
+        inputs = BuildManifest.inputs_hash('assignment', csvenc,
+            spreadsheet_inputs(config, db, group, grading, [assdata]))
+        write = may_write(filepath, manifest, inputs)
+        if write is None:
+            continue
+        if not write:
+            print("Abort.")
+            return
 
-        if os.path.exists(filepath):
-            if not confirm('File {} already exists. Overwrite it?'.format(filepath), default=False):
-                print("Abort.")
-                return
+        metrics.incr('files.written')
+        with open(filepath, "w", encoding=csvenc) as fp:
+            writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
+            writer.writerows(assignment_rows(config, db, compiled, assdata, group))
+
+        if manifest is not None:
+            manifest.record(filepath, inputs)
 
+
+def spreadsheet_column_matrnr(cell):
+    """Matriculation number in a header cell of an assignment
+    spreadsheet (either the plain number or a HYPERLINK to it).
+    """
+    match = re.search(r'(\d+)"?\)?\s*$', cell)
+    if match is None:
+        raise ValueError("Cannot find matriculation number in column header '{}'".format(cell))
+    return match.group(1)
+
+
+def merge_cells(fresh, old, columns):
+    """Merge a freshly generated row with a row of an existing spreadsheet.
+    Every empty cell of `fresh` takes the value of the cell at index
+    `columns[i]` in `old`. Generated values (eg. formulas) always win.
+
+    :param fresh:       the generated row
+    :type fresh:        list
+    :param old:         the row of the existing spreadsheet
+    :type old:          list
+    :param columns:     index in `old` for the indices of `fresh`
+    :type columns:      dict
+    :return:            the merged row
+    :type return:       list
+    """
+    row = list(fresh)
+    for i, cell in enumerate(row):
+        j = columns.get(i)
+        if cell == '' and j is not None and j < len(old):
+            row[i] = old[j]
+    return row
+
+
+@contextlib.contextmanager
+def patch_csv(filepath, csvenc):
+    """Yield (old rows, writer) to rewrite `filepath`. The new content
+    is written to a temporary file replacing `filepath` on success.
+    """
+    tmppath = filepath + '.tmp'
+    try:
+        with open(filepath, encoding=csvenc, newline='') as src, \
+             open(tmppath, "w", encoding=csvenc) as dest:
+            yield csv.reader(src), csv.writer(dest, quoting=csv.QUOTE_ALL)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+    os.replace(tmppath, filepath)
+
+
+def patch_assignment_spreadsheet(filepath, csvenc, rows, students):
+    """Rewrite an assignment spreadsheet for a changed group roster
+    in one pass. Columns of students who left are dropped, columns for
+    new students are added and all formulas are regenerated. Marks
+    entered for remaining students are kept.
+
+    :param filepath:    the existing spreadsheet
+    :type filepath:     str
+    :param csvenc:      Encoding of the filepath
+    :type csvenc:       str
+    :param rows:        freshly generated rows, see `assignment_rows`
+    :type rows:         iterable
+    :param students:    matriculation numbers of the columns of `rows`
+    :type students:     list
+    :return:            (added, removed) matriculation numbers
+    :type return:       tuple
+    """
+    with patch_csv(filepath, csvenc) as (reader, writer):
+        old_header = next(reader, None)
+        if old_header is None:
+            raise ValueError("Spreadsheet {} is empty".format(filepath))
+        old_students = {spreadsheet_column_matrnr(cell): j
+            for j, cell in enumerate(old_header[2:], 2)}
+
+        columns = {0: 0, 1: 1}
+        for i, matrnr in enumerate(students, 2):
+            if str(matrnr) in old_students:
+                columns[i] = old_students[str(matrnr)]
+
+        rows = iter(rows)
+        # keep the title as it was, only student columns change
+        writer.writerow(old_header[:2] + next(rows)[2:])
+        for lineno, (fresh, old) in enumerate(itertools.zip_longest(rows, reader), 2):
+            if fresh is None or old is None \
+                    or [str(c) for c in fresh[:2]] != old[:2]:
+                raise ValueError("Line {} of {} does not match the grading "
+                    "scheme. Use 'spreadsheets create' instead.".format(lineno, filepath))
+            writer.writerow(merge_cells(fresh, old, columns))
+
+    current = set(map(str, students))
+    added = [m for m in students if str(m) not in old_students]
+    removed = [m for m in old_students if m not in current]
+    return added, removed
+
+
+def patch_overview_spreadsheet(filepath, csvenc, rows):
+    """Rewrite an overview spreadsheet for a changed group roster.
+    Rows are matched by matriculation number (second column).
+
+    :param filepath:    the existing spreadsheet
+    :type filepath:     str
+    :param csvenc:      Encoding of the filepath
+    :type csvenc:       str
+    :param rows:        freshly generated rows, see `overview_rows`
+    :type rows:         iterable
+    """
+    with patch_csv(filepath, csvenc) as (reader, writer):
+        rows = iter(rows)
+        for _ in range(2):
+            writer.writerow(next(rows))
+            next(reader, None)
+        old_rows = {row[1]: row for row in reader if len(row) > 1}
+        for fresh in rows:
+            old = old_rows.get(str(fresh[1]), [])
+            writer.writerow(merge_cells(fresh, old, {i: i for i in range(len(fresh))}))
+
+
+@profiled('spreadsheets')
+def update_group_spreadsheets(config, db, grading, group, csvpath, csvenc='utf-8-sig', *, manifest=None):
+    """Update the spreadsheets of one group to the current group roster.
+    Spreadsheets which do not exist yet are created.
+
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          StudentDatabase to use
+    :type db:           StudentDatabase
+    :param grading:     Data specifying grading points
+    :type grading:      GradingScheme
+    :param group:       The group to update spreadsheets for
+    :type group:        int
+    :param csvpath:     The filepath of the spreadsheets
+    :type csvpath:      str
+    :param csvenc:      Encoding of the filepath
+    :type csvenc:       str
+    :param manifest:    skip files whose inputs did not change
+    :type manifest:     BuildManifest
+    """
+    db = db.filter(group=group)
+    db = db.sorted_by_wikiname()
+    if not isinstance(grading, GradingScheme):
+        grading = GradingScheme(grading)
+    students = [s.matrnr for s in db]
+
+    for assdata in config.assignments:
+        filepath = csvpath.format(group=group, assignment=assdata['name'])
+        compiled = grading[assdata['name']]
+        inputs = BuildManifest.inputs_hash('assignment', csvenc,
+            spreadsheet_inputs(config, db, group, grading, [assdata]))
+        if not os.path.exists(filepath):
+            with open(filepath, "w", encoding=csvenc) as fp:
+                writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
+                writer.writerows(assignment_rows(config, db, compiled, assdata, group))
+            metrics.incr('files.written')
+        elif manifest is not None and manifest.up_to_date(filepath, inputs):
+            debug('{} is up to date', filepath)
+            metrics.incr('files.skipped')
+            continue
+        else:
+            added, removed = patch_assignment_spreadsheet(filepath, csvenc,
+                assignment_rows(config, db, compiled, assdata, group), students)
+            metrics.incr('files.written')
+            for matrnr in added:
+                info('{}: added student {}', filepath, matrnr)
+            for matrnr in removed:
+                warn('{}: removed student {} and the marks entered', filepath, matrnr)
+        if manifest is not None:
+            manifest.record(filepath, inputs)
+
+    filepath = csvpath.format(group=group, assignment='overview')
+    inputs = BuildManifest.inputs_hash('overview', csvenc,
+        spreadsheet_inputs(config, db, group, grading, config.assignments))
+    if manifest is not None and manifest.up_to_date(filepath, inputs):
+        debug('{} is up to date', filepath)
+        metrics.incr('files.skipped')
+        return
+    if not os.path.exists(filepath):
         with open(filepath, "w", encoding=csvenc) as fp:
             writer = csv.writer(fp, quoting=csv.QUOTE_ALL)
-            rowid = 0
-            consider = [[]]
-
-            # {title, "", matrnr+}
-            title = '{assignment}, Gruppe {group}, {year}'
-            row = [title.format(assignment=assdata['name'], group=group,
-                year=datetime.datetime.now().strftime('%Y')), '']
-            for student in db:
-                if 'partnersubmission' in assdata:
-                    # TODO: I'd be better to a have a separate %USERSWEB% variable
-                    row.append('=HYPERLINK("{url}"; "{matrnr}")'.format(**{
-                        'url': (config.wikiurl + 'Main/' + student.wikiname + assdata['partnersubmission']),
-                        'matrnr': student.matrnr
-                    }))
-                else:
-                    row.append(student.matrnr)
-            rowid += 1
-            writer.writerow(row)
-
-            # {"Matrikelnummer", "", wikiname+}
-            hyperlink = '=HYPERLINK("{url}"; "{name}")'
-            row = ['Matrikelnummer', '']
-            for student in db:
-                baseurl = config.wikiurl + 'Main/' + student.wikiname + assdata['submission']
-                row.append(hyperlink.format(url=baseurl, name=student.wikiname))
-            rowid += 1
-            writer.writerow(row)
-
-            for exercise, v1 in grading[assdata['name']].items():
-                # {exercise name}
-                writer.writerow([exercise, ''] + [''] * len(db))
-                rowid += 1
+            writer.writerows(overview_rows(config, db, grading, group))
+    else:
+        patch_overview_spreadsheet(filepath, csvenc,
+            overview_rows(config, db, grading, group))
+    metrics.incr('files.written')
+    if manifest is not None:
+        manifest.record(filepath, inputs)
+
+def grade_formula(config, cell):
+    """Nested IF formula (without leading '=') mapping the total points
+    in `cell` to a grade according to `config.grades`.
+    """
+    grades = [(name, g['max']) for name, g in config.grades.items()]
+    grades.sort(key=lambda x: x[1])
+    formula = '{}'
+    for name, maximum in grades[:-1]:
+        formula = formula.format('IF({}<{},"{}",{{}})'.format(cell, maximum + 1, name))
+    return formula.format('"{}"'.format(grades[-1][0]))
+
+
+def write_assignment_sheet(workbook, config, db, compiled, assdata, group, *, prefix=''):
+    """Write the sheet of one assignment of one group to `workbook`.
+    Layout equals the CSV created by `create_group_spreadsheets`, but
+    the total of every student is a single shared SUMIF formula, hence
+    no '[ split ]' rows are necessary. The sheet is called
+    `prefix` + assignment name.
+    """
+    students = list(db)
+    empty = [None] * len(students)
+    last = len(students) + 1
+    name = prefix + assdata['name']
+    with workbook.sheet(name, widths=[30, 8] + [16] * len(students)) as sheet:
+        # {title, "", matrnr+}
+        title = '{assignment}, Gruppe {group}, {year}'
+        row = [title.format(assignment=assdata['name'], group=group,
+            year=datetime.datetime.now().strftime('%Y')), None]
+        for student in students:
+            if assdata['partnersubmission']:
+                row.append(Formula('HYPERLINK("{}","{}")'.format(config.wikiurl + 'Main/'
+                    + student.wikiname + assdata['partnersubmission'], student.matrnr)))
+            else:
+                row.append(student.matrnr)
+        sheet.row(row, style='bold')
+
+        # {"Matrikelnummer", "", wikiname+}
+        row = ['Matrikelnummer', None]
+        for student in students:
+            row.append(Formula('HYPERLINK("{}","{}")'.format(config.wikiurl + 'Main/'
+                + student.wikiname + assdata['submission'], student.wikiname)))
+        sheet.row(row, style='bold')
+
+        for exercise in compiled.exercises:
+            sheet.row([exercise.name, exercise.points] + empty, style='bold')
+            for criterion, points in exercise.criteria:
+                sheet.row([criterion, points] + empty)
+            sheet.row([])
+
+        # {"Gesamt", "", "=SUMIF(...)"+}, shared by all students
+        total = compiled.total_row
+        row = ['Gesamt', compiled.points]
+        if students:
+            si = sheet.new_shared_index()
+            text = 'SUMIF({}:{},"x",{}:{})+{}+{}'.format(
+                spreadsheet_cell_id(2, 2), spreadsheet_cell_id(2, total - 1),
+                spreadsheet_cell_id(1, 2, fixed=True),
+                spreadsheet_cell_id(1, total - 1, fixed=True),
+                spreadsheet_cell_id(2, total + 1), spreadsheet_cell_id(2, total + 2))
+            ref = '{}:{}'.format(spreadsheet_cell_id(2, total),
+                spreadsheet_cell_id(last, total))
+            row.append(Formula(text, si=si, ref=ref))
+            row.extend(Formula(si=si) for _ in students[1:])
+        sheet.row(row, style='bold')
+        sheet.row(['Deadline verpasst', None] + empty)
+        sheet.row(['Bonuspunkte', None] + empty)
+
+
+def write_overview_sheet(workbook, config, db, grading, group, *, prefix=''):
+    """Write the overview sheet of one group to `workbook`. The points of
+    every assignment are referenced from the assignment sheets, which
+    are expected to be called `prefix` + assignment name.
+    """
+    students = list(db)
+    assignments = [a['name'] for a in config.assignments]
+    first, after = 13, 13 + len(assignments)
+    header_row = ['Gruppe', 'Matrikelnummer', 'Vorname', 'Nachname',
+        'TWiki Name', 'Abgabegespr. (1..3)', '', '', '', 'Möchte weitermachen',
+        '', '', '', 'Übungen (1..{}) Punkte'.format(len(assignments))] \
+        + [''] * len(assignments) + ['Gesamtpunkte', 'Gesamtnote']
+    total_col, grade_col = after + 1, after + 2
+    last = 2 + len(students) - 1
+
+    with workbook.sheet(prefix + 'Overview', widths=[8, 16, 16, 16, 24]) as sheet:
+        sheet.row(header_row, style='bold')
+        sheet.row([])
+        total_si = sheet.new_shared_index()
+        grade_si = sheet.new_shared_index()
+
+        for s_id, student in enumerate(students):
+            rowid = 2 + s_id
+            s_group = student.group
+            if group != 0:
+                s_group = s_group.difference({0,})
 
-                # {criterion, points}
-                for criterion, points in v1.items():
-                    writer.writerow([criterion, points] + [''] * len(db))
-                    consider[0].append(rowid)
-                    rowid += 1
+            row = [', '.join(map(str, sorted(s_group))), student.matrnr,
+                student.firstname, student.lastname,
+                Formula('HYPERLINK("{}","{}")'.format(
+                    config.wikiurl + 'Main/' + student.wikiname, student.wikiname))]
+            row += [None] * (first - len(row))
+            for ass in assignments:
+                row.append(Formula("'{}'!{}".format(prefix + ass,
+                    spreadsheet_cell_id(s_id + 2, grading.total_row(ass)))))
+            row.append(None)
+
+            if s_id == 0:
+                total = Formula('SUM({}:{})'.format(spreadsheet_cell_id(first, rowid),
+                    spreadsheet_cell_id(after - 1, rowid)), si=total_si,
+                    ref='{}:{}'.format(spreadsheet_cell_id(total_col, rowid),
+                                       spreadsheet_cell_id(total_col, last)))
+                grade = Formula(grade_formula(config, spreadsheet_cell_id(total_col, rowid)),
+                    si=grade_si, ref='{}:{}'.format(spreadsheet_cell_id(grade_col, rowid),
+                                                   spreadsheet_cell_id(grade_col, last)))
+            else:
+                total, grade = Formula(si=total_si), Formula(si=grade_si)
+            sheet.row(row + [total, grade])
 
-                writer.writerow([''] * (len(db) + 2))
-                rowid += 1
 
-            assert len(consider[0]) < 120, ("Sorry, I guess this high number "
-                "of point lines will cause troubles with certain "
-                "spreadsheet software")
+@profiled('spreadsheets')
+def create_group_workbook(config, db, grading, group, xlsxpath, *, manifest=None):
+    """Create one XLSX workbook for one group containing an overview sheet
+    and one sheet per assignment.
 
-            # reorganize consider according to max_values_per_sum
-            values = len(consider[0])
-            i = 0
-            while i < len(consider):
-                special = 2 if i == 0 else 0
-                if len(consider[i]) + len(consider) - special > max_values_per_sum:
-                    value = consider[i].pop()
-                    while i + 1 >= len(consider):
-                        consider.append([])
-                    consider[i + 1].append(value)
-                    i = 0
-                else:
-                    i += 1
-
-            # {"Gesamt", "", "=SUM(...)"+}
-            summ = '=SUM({})'
-            if_stmt = 'IF({}="x";{};0)'
-
-            row = ['Gesamt', '']
-            for s_id in range(len(db)):
-                accu = []
-                for row_id in consider[0]:
-                    accu.append(if_stmt.format(
-                        spreadsheet_cell_id(s_id + 2, row_id),
-                        spreadsheet_cell_id(1, row_id, fixed=True)
-                    ))
-                accu.append(spreadsheet_cell_id(s_id + 2, rowid + 1))
-                accu.append(spreadsheet_cell_id(s_id + 2, rowid + 2))
-                for i in range(len(consider)):
-                    accu.append(spreadsheet_cell_id(s_id + 2, rowid + 3 + i))
-
-                row.append(summ.format(','.join(accu)))
-            consider = consider[1:]
-            rowid += 1
-            writer.writerow(row)
-
-            # {"Deadline missed"}
-            row = ['Deadline verpasst', ''] + [''] * len(db)
-            rowid += 1
-            writer.writerow(row)
-
-            # {"Bonuspunkte"}
-            row = ["Bonuspunkte", ''] + [''] * len(db)
-            rowid += 1
-            writer.writerow(row)
-
-            # remaining consider values
-            while len(consider) != 0:
-                row = ['[ split ]', '']
-                for s_id in range(len(db)):
-                    accu = []
-                    for c in consider[0]:
-                        accu.append(if_stmt.format(
-                            spreadsheet_cell_id(s_id + 2, c),
-                            spreadsheet_cell_id(1, c, fixed=True)
-                        ))
-                    row.append(summ.format(', '.join(accu)))
-                writer.writerow(row)
-                rowid += 1
-                consider = consider[1:]
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          StudentDatabase to use
+    :type db:           StudentDatabase
+    :param grading:     Data specifying grading points
+    :type grading:      GradingScheme
+    :param group:       The group to generate the workbook for
+    :type group:        int
+    :param xlsxpath:    The filepath to generate file for
+    :type xlsxpath:     str
+    :param manifest:    skip the file if its inputs did not change
+    :type manifest:     BuildManifest
+    """
+    db = db.filter(group=group)
+    db = db.sorted_by_wikiname()
+    if not isinstance(grading, GradingScheme):
+        grading = GradingScheme(grading)
+
+    filepath = xlsxpath.format(group=group)
+    inputs = BuildManifest.inputs_hash('workbook',
+        spreadsheet_inputs(config, db, group, grading, config.assignments))
+    write = may_write(filepath, manifest, inputs)
+    if write is None:
+        return
+    if not write:
+        print("Abort.")
+        return
+
+    metrics.incr('files.written')
+    with XLSXWorkbook(filepath) as workbook:
+        write_overview_sheet(workbook, config, db, grading, group)
+        for assdata in config.assignments:
+            write_assignment_sheet(workbook, config, db,
+                grading[assdata['name']], assdata, group)
+
+    if manifest is not None:
+        manifest.record(filepath, inputs)
+
+
+@profiled('spreadsheets')
+def create_course_workbook(config, db, grading, groups, xlsxpath, *, manifest=None):
+    """Create one XLSX workbook containing the overview and assignment
+    sheets of all `groups`. Sheets of group 3 are called 'G3 Overview',
+    'G3 AssignmentOne', etc.
+
+    :param config:      A Config to read metadata from
+    :type config:       Config
+    :param db:          StudentDatabase to use
+    :type db:           StudentDatabase
+    :param grading:     Data specifying grading points
+    :type grading:      GradingScheme
+    :param groups:      The groups to generate sheets for
+    :type groups:       set
+    :param xlsxpath:    The filepath to generate file for
+    :type xlsxpath:     str
+    :param manifest:    skip the file if its inputs did not change
+    :type manifest:     BuildManifest
+    """
+    if not isinstance(grading, GradingScheme):
+        grading = GradingScheme(grading)
+
+    by_group = collections.OrderedDict((group, db.filter(group=group).sorted_by_wikiname())
+                                       for group in sorted(groups))
+    inputs = BuildManifest.inputs_hash('course', [spreadsheet_inputs(config,
+        members, group, grading, config.assignments)
+        for group, members in by_group.items()])
+    write = may_write(xlsxpath, manifest, inputs)
+    if write is None:
+        return
+    if not write:
+        print("Abort.")
+        return
+
+    metrics.incr('files.written')
+    with XLSXWorkbook(xlsxpath) as workbook:
+        for group, members in by_group.items():
+            prefix = 'G{} '.format(group)
+            write_overview_sheet(workbook, config, members, grading, group, prefix=prefix)
+            for assdata in config.assignments:
+                write_assignment_sheet(workbook, config, members,
+                    grading[assdata['name']], assdata, group, prefix=prefix)
+
+    if manifest is not None:
+        manifest.record(xlsxpath, inputs)
+
+
+def print_renames(db):
+    """Print the wikinames assigned to resolve collisions in `db`"""
+    if not db.renames:
+        return
+    data = [['Matriculation number', 'Derived wikiname', 'Assigned wikiname']]
+    data.extend(sorted(db.renames))
+    print_foswiki_table(data)
+
+
+DuplicateCandidate = collections.namedtuple('DuplicateCandidate',
+    ['first', 'second', 'distance'])
+
+
+def name_tokens(student):
+    """Lowercase ASCII tokens of the first and last name of `student`"""
+    name = transliterate((student.firstname + ' ' + student.lastname).replace('ß', 'ss'))
+    return sorted(t for t in re.split(r'[^a-z0-9]+', name.lower()) if t)
+
+
+def blocking_keys(student):
+    """Keys of the blocks `student` belongs to. Only students sharing
+    a block are compared by `find_duplicates`. Tokens are sorted, hence
+    swapped first and last names share the blocks.
+    """
+    tokens = name_tokens(student)
+    keys = {'phonetic:' + ' '.join(sorted(cologne_phonetic(t) for t in tokens)),
+            'name:' + ''.join(tokens)}
+    if student.email:
+        keys.add('email:' + student.email.lower())
+    return keys
+
+
+@profiled('duplicates')
+def find_duplicates(students, *, max_distance=2, window=8):
+    """Find students who probably registered twice (eg. with a typo
+    in their name or with first and last name swapped).
+
+    Students are put in blocks by phonetic keys of their names, their
+    transliterated names and their email address (see `blocking_keys`). Only
+    students within one block are compared, which avoids comparing
+    all pairs. Within large blocks (common names) students are sorted
+    by name and only the next `window` students are compared. Pairs
+    with the same email address or names within an edit distance of
+    `max_distance` are candidates.
+
+    :param students:        the students to check
+    :type students:         iterable
+    :param max_distance:    maximum edit distance of the normalized names
+    :type max_distance:     int
+    :param window:          number of neighbours compared within a block
+    :type window:           int
+    :return:                candidates ordered by distance
+    :type return:           list
+    """
+    blocks = collections.defaultdict(list)
+    names = {}
+    for s in students:
+        names[s.matrnr] = (s, ' '.join(name_tokens(s)))
+        for key in blocking_keys(s):
+            blocks[key].append(s.matrnr)
+
+    compared = set()
+    candidates = []
+    for block in blocks.values():
+        if len(block) > window:
+            block.sort(key=lambda m: names[m][1])
+        for i, m1 in enumerate(block):
+            for m2 in block[i + 1:i + 1 + window]:
+                pair = (min(m1, m2), max(m1, m2))
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                (s1, n1), (s2, n2) = names[pair[0]], names[pair[1]]
+                distance = edit_distance(n1, n2, max_distance)
+                if distance <= max_distance or (s1.email and s1.email.lower() == s2.email.lower()):
+                    candidates.append(DuplicateCandidate(s1, s2, distance))
+
+    debug('{} blocks, {} comparisons', len(blocks), len(compared))
+    candidates.sort(key=lambda c: (c.distance, c.first.matrnr))
+    return candidates
+
+
+def read_group_preferences(filepath, *, encoding='utf-8-sig'):
+    """Read ranked group preferences of students. Every line contains
+    a matriculation number followed by groups, most preferred first
+    (eg. '1234567;Gruppe 3;Gruppe 1'). A header line is skipped.
+
+    :param filepath:    CSV file with semicolon-separated values
+    :type filepath:     str
+    :param encoding:    encoding of the CSV file
+    :type encoding:     str
+    :return:            {matrnr: [group ids]}
+    :type return:       dict
+    """
+    preferences = {}
+    with open(filepath, encoding=encoding, newline='') as fp:
+        for row in csv.reader(fp, dialect=csv_export_dialect_semicolon):
+            cells = [cell.strip() for cell in row if cell.strip()]
+            if not cells or not cells[0].isdigit():
+                continue
+            preferences[int(cells[0])] = [parse_group_id(c) for c in cells[1:]]
+    return preferences
+
+
+def group_capacities(config, total):
+    """Capacity of every group in `config`. Groups without a capacity
+    in metadata.xml get an equal share of `total` students.
+    """
+    share = math.ceil(total / len(config.groups)) if config.groups else 0
+    return {g: config.capacities.get(g, share) for g in config.groups}
+
+
+@profiled('assign')
+def assign_groups(config, db, preferences=None, *, reassign=False, levels=10, preference_cost=5):
+    """Assign students without a tutorial group to the groups of `config`.
+
+    The assignment is a min-cost flow: source -> students -> groups ->
+    tutors -> sink. Group capacities and tutor limits are edge capacities.
+    Seats of a group cost their fill level (1 to `levels`), hence groups
+    are filled evenly. Every step down the ranked preferences of a student
+    costs `preference_cost`; groups not listed rank below all listed ones.
+    Students with equal preferences are interchangeable and share one
+    node, thus the network stays small for thousands of students.
+    Students registered earlier get their preferred groups first.
+    Students in group 0 only have no tutorial group and are assigned.
+
+    :param config:              metadata with groups, capacities and tutor limits
+    :type config:               Config
+    :param db:                  students database
+    :type db:                   StudentDatabase
+    :param preferences:         {matrnr: [group ids]} most preferred first
+    :type preferences:          dict
+    :param reassign:            also move students who already have a group
+    :type reassign:             bool
+    :param levels:              number of distinct fill levels of a group
+    :type levels:               int
+    :param preference_cost:     cost of one rank in the preferences
+    :type preference_cost:      int
+    :return:                    ({matrnr: group id}, [students without seat])
+    :type return:               tuple
+    """
+    preferences = preferences or {}
+    groups = sorted(config.groups)
+    if not groups:
+        raise ValueError('metadata does not define any groups')
+    for matrnr, ranked in preferences.items():
+        unknown = set(ranked).difference(groups)
+        if unknown:
+            raise ValueError('Unknown groups {} in preferences of {}'.format(sorted(unknown), matrnr))
+
+    load = dict.fromkeys(groups, 0)
+    pending = []
+    for s in db:
+        current = s.group.intersection(load)
+        if current and not reassign:
+            for g in current:
+                load[g] += 1
+        else:
+            pending.append(s)
+    capacity = group_capacities(config, len(db))
+
+    classes = collections.defaultdict(list)
+    for s in pending:
+        classes[tuple(preferences.get(s.matrnr, ()))].append(s)
+    classes = sorted(classes.items())
+    tutors = sorted(set(config.groups.values()))
+
+    # nodes: source, sink, hub (any group), groups, tutors, classes
+    source, sink, hub = 0, 1, 2
+    group_node = {g: 3 + i for i, g in enumerate(groups)}
+    tutor_node = {t: 3 + len(groups) + i for i, t in enumerate(tutors)}
+    net = MinCostFlow(3 + len(groups) + len(tutors) + len(classes))
+
+    hub_edges = [(g, net.add_edge(hub, group_node[g], len(pending))) for g in groups]
+    for g in groups:
+        seats = collections.Counter(-(-k * levels // capacity[g])
+            for k in range(load[g] + 1, capacity[g] + 1))
+        for level, count in sorted(seats.items()):
+            net.add_edge(group_node[g], tutor_node[config.groups[g]], count, level)
+
+    tutor_load = collections.Counter()
+    for g, count in load.items():
+        tutor_load[config.groups[g]] += count
+    for t in tutors:
+        limit = config.tutors[t].get('limit')
+        free = len(pending) if limit is None else max(0, limit - tutor_load[t])
+        net.add_edge(tutor_node[t], sink, free)
+
+    class_edges = []
+    for i, (ranked, members) in enumerate(classes):
+        node = 3 + len(groups) + len(tutors) + i
+        net.add_edge(source, node, len(members))
+        direct = [(g, net.add_edge(node, group_node[g], len(members), rank * preference_cost))
+                  for rank, g in enumerate(ranked)]
+        other = net.add_edge(node, hub, len(members), len(ranked) * preference_cost)
+        class_edges.append((direct, other))
+
+    flow, cost = net.solve(source, sink, len(pending))
+    debug('{} of {} students assigned at cost {}', flow, len(pending), cost)
+
+    any_group = iter([g for g, e in hub_edges for _ in range(net.flow(e))])
+    assignment, unassigned = {}, []
+    for (ranked, members), (direct, other) in zip(classes, class_edges):
+        members.sort(key=lambda s: (s.regdate or datetime.datetime.max, s.matrnr))
+        seats = [g for g, e in direct for _ in range(net.flow(e))]
+        seats.extend(next(any_group) for _ in range(net.flow(other)))
+        for s, g in itertools.zip_longest(members, seats):
+            if g is None:
+                unassigned.append(s)
+            else:
+                assignment[s.matrnr] = g
+    return assignment, unassigned
+
+
+RegistrationDelta = collections.namedtuple('RegistrationDelta',
+    ['added', 'removed', 'regrouped'])
 
 
+def export_course(filepath):
+    """Course of a TUGrazOnline export like TN_LV716231_$DATE.csv
+    (the filename without extension for other names)
+    """
+    name = os.path.basename(filepath)
+    match = re.match(r'TN_LV(\d+)', name)
+    if match:
+        return match.group(1)
+    return os.path.splitext(name)[0]
+
+
+def export_date(filepath, students=()):
+    """Date of a TUGrazOnline export: the date in its filename (like
+    TN_LV716231_20141001.csv, ..._2014-10-01.csv or ..._01.10.2014.csv),
+    otherwise the latest registration date of its `students`.
+
+    :param filepath:    filepath of the export
+    :type filepath:     str
+    :param students:    the students of the export
+    :type students:     StudentDatabase
+    :return:            date of the export, None if unknown
+    :type return:       datetime.datetime
+    """
+    name = os.path.basename(filepath)
+    match = re.search(r'(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)', name)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = re.search(r'(?<!\d)(\d{2})\.(\d{2})\.(\d{4})(?!\d)', name)
+        if match:
+            day, month, year = match.groups()
+    if match:
+        try:
+            return datetime.datetime(int(year), int(month), int(day))
+        except ValueError:
+            pass
+    return max((s.regdate for s in students if s.regdate), default=None)
+
+
+class SyncState:
+    """Record of ingested CSV exports. Files are identified by their
+    checksum. For every course the roster of the latest export is kept,
+    to detect group changes and de-registrations in the next export.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.files = {}      # sha1: {name, course, ingested}
+        self.courses = {}    # course: {file, date, students: {matrnr: [groups]}}
+        if os.path.exists(filepath):
+            with open(filepath, encoding='utf-8') as fp:
+                data = json.load(fp)
+            self.files = data['files']
+            self.courses = data['courses']
+
+    def ingested(self, checksum):
+        return checksum in self.files
+
+    def roster(self, course):
+        """{matrnr: groups} of the latest export of `course`"""
+        students = self.courses.get(course, {}).get('students', {})
+        return {int(m): set(groups) for m, groups in students.items()}
+
+    def course_rosters(self, courses):
+        """{course: set of matrnr} of the `courses` (like 716.231) with a
+        known roster. Exports name courses without dot, eg. 716231.
+        """
+        rosters = {}
+        for course in courses:
+            key = re.sub(r'\D', '', course)
+            if key in self.courses:
+                rosters[course] = set(self.roster(key))
+        return rosters
+
+    def record(self, checksum, filepath):
+        self.files[checksum] = {'name': os.path.basename(filepath),
+            'course': export_course(filepath),
+            'ingested': datetime.datetime.now().isoformat()}
+
+    def roster_date(self, course):
+        """Date of the latest export of `course`, None if unknown"""
+        data = self.courses.get(course, {})
+        if data.get('date'):
+            return datetime.datetime.fromisoformat(data['date'])
+        if data.get('file'):
+            return export_date(data['file'])
+        return None
+
+    def record_roster(self, course, filepath, db, date=None):
+        self.courses[course] = {'file': os.path.basename(filepath),
+            'date': date.isoformat() if date else None,
+            'students': {str(s.matrnr): sorted(s.group) for s in db}}
+
+    def save(self):
+        with open(self.filepath, 'w', encoding='utf-8') as fp:
+            json.dump({'files': self.files, 'courses': self.courses}, fp,
+                indent=1, sort_keys=True)
+
+
+def registration_delta(db, rosters, state):
+    """Changes of `db` implied by new exports.
+
+    A known student keeps their data (like in StudentDatabase.union)
+    but takes the groups of the new export of a course instead of the
+    groups of the previous export of this course. A student listed in
+    the previous export of a course, but in no current export, has
+    de-registered and is removed. Students never seen in an export
+    are not modified.
+
+    :param db:          the students database
+    :type db:           StudentDatabase | SQLiteStudentStore
+    :param rosters:     {course: StudentDatabase} of the new exports
+    :type rosters:      dict
+    :param state:       the record of previous exports
+    :type state:        SyncState
+    :return:            the changes
+    :type return:       RegistrationDelta
+    """
+    def groups_of(courses, get):
+        result = collections.defaultdict(set)
+        for course in courses:
+            for matrnr, groups in get(course).items():
+                result[matrnr].update(groups)
+        return result
+
+    previous = groups_of(rosters, state.roster)
+    current = groups_of(rosters, lambda c: {s.matrnr: s.group for s in rosters[c]})
+    others = groups_of(set(state.courses).difference(rosters), state.roster)
+    affected = set(previous).union(current)
+
+    known = {s.matrnr: s for s in db if s.matrnr in affected}
+    removed = set()
+    regrouped = {}
+    for matrnr, student in known.items():
+        if matrnr not in current and matrnr not in others:
+            removed.add(matrnr)
+            continue
+        groups = student.group.difference(previous[matrnr])
+        groups = groups.union(current[matrnr], others[matrnr])
+        moved_to = current[matrnr].difference({0,})
+        if moved_to:
+            groups = {g for g in groups if g == 0 or g in moved_to}
+        if groups != student.group:
+            regrouped[matrnr] = groups
+
+    incoming = functools.reduce(lambda a, b: a.union(b), rosters.values(),
+        StudentDatabase())
+    added = []
+    for s in incoming:
+        if s.matrnr not in known:
+            s.group = current[s.matrnr].union(others[s.matrnr])
+            added.append(s)
+
+    return RegistrationDelta(added, removed, regrouped)
+
+
+@profiled('sync')
+def sync_students(db, filepaths, state, *, encoding='utf-8-sig', workers=None):
+    """Apply all exports not yet ingested to `db`. New exports are
+    parsed concurrently, one process per file.
+
+    :param db:          the students database
+    :type db:           StudentDatabase | SQLiteStudentStore
+    :param filepaths:   CSV exports of TUGrazOnline
+    :type filepaths:    list
+    :param state:       the record of previous exports
+    :type state:        SyncState
+    :param encoding:    encoding of the CSV files
+    :type encoding:     str
+    :param workers:     maximum number of processes
+    :type workers:      int
+    :return:            (updated database, delta)
+    :type return:       tuple
+    """
+    new = []
+    for filepath in sorted(filepaths):
+        checksum = file_hash(filepath)
+        if state.ingested(checksum):
+            debug('{} was already ingested', filepath)
+            metrics.incr('files.skipped')
+        else:
+            new.append((filepath, checksum))
+    if not new:
+        return db, RegistrationDelta([], set(), {})
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        parsed = list(pool.map(functools.partial(parse_student_csv,
+            encoding=encoding), [f for f, _ in new]))
+
+    # only the latest export of a course matters, see export_date
+    rosters, latest = {}, {}
+    for (filepath, checksum), students in zip(new, parsed):
+        metrics.incr('students.parsed', len(students))
+        course = export_course(filepath)
+        date = export_date(filepath, students)
+        if course in latest:
+            previous, previous_date = latest[course]
+        else:
+            previous = state.courses.get(course, {}).get('file')
+            previous_date = state.roster_date(course)
+        if date and previous_date and date < previous_date:
+            info('{} is older than {}, skipping', filepath, previous)
+            continue
+        rosters[course] = students
+        latest[course] = (filepath, date)
+
+    delta = registration_delta(db, rosters, state)
+    db = db.apply_delta(delta)
+    for filepath, checksum in new:
+        state.record(checksum, filepath)
+    for course, students in rosters.items():
+        filepath, date = latest[course]
+        state.record_roster(course, filepath, students, date)
+    return db, delta
 
 
 def command_init_cli(xmlfile, *, encoding='utf-8'):
@@ -1720,8 +5715,35 @@ def student_from_cli():
 # ------------------- CLI parsing, main and dispatching -------------------
 
 @click.group()
-def cli():
-    pass
+@click.option('--profile', 'profile', default=False, flag_value=True, help='print time, calls and peak RSS per phase to stderr')
+@click.option('--profile-json', 'profile_json', help='write time, calls and peak RSS per phase as JSON to this file')
+@click.option('--profile-pstats', 'profile_pstats', help='dump cProfile statistics to this file')
+@click.option('--log-level', 'loglevel', default='warning', type=click.Choice(['debug', 'info', 'warning', 'error']), help='verbosity of messages on stderr')
+@click.option('--metrics', 'metrics_file', help='append counters of this run to this file')
+@click.option('--metrics-format', 'metrics_format', default='jsonl', type=click.Choice(Metrics.formats), help='format of the metrics file')
+@click.pass_context
+def cli(ctx, profile, profile_json, profile_pstats, loglevel, metrics_file, metrics_format):
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, loglevel.upper()),
+        format='%(levelname)s: %(message)s', force=True)
+    metrics.filepath = metrics_file
+    metrics.format = metrics_format
+    profiler.enabled = bool(profile or profile_json)
+    if profile_pstats:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    def finish():
+        metrics.flush()
+        if profile_pstats:
+            cprofile.disable()
+            cprofile.dump_stats(profile_pstats)
+        if profile:
+            profiler.report(stream=sys.stderr)
+        if profile_json:
+            with open(profile_json, 'w', encoding='utf-8') as fp:
+                fp.write(profiler.to_json())
+
+    ctx.call_on_close(finish)
 
 @cli.command()
 @click.option('--from-xml', 'src', default=default_metadata_filepath(), help='initialize application from provided metadata.xml')
@@ -1745,7 +5767,7 @@ def students():
 @click.option('--from-cli', 'clisrc', default=False, flag_value=True, help="create students DB by retrieving data from CLI")
 @click.option('--from-csv', 'src', multiple=True, help="create students DB by retrieving data from CSV")
 @click.option('--from-encoding', 'srcenc', default='utf-8-sig', help="encoding of CSV files")
-@click.option('--to-xml', 'dest', default=default_students_filepath(), help="new students DB filepath")
+@click.option('--to-xml', 'dest', default=default_students_filepath(), help="new students DB filepath (*.sqlite for SQLite)")
 @click.option('--to-encoding', 'destenc', default='utf-8', help="new students DB encoding")
 def create(clisrc, src, srcenc, dest, destenc):
     """Create a new students.xml database"""
@@ -1764,26 +5786,31 @@ def create(clisrc, src, srcenc, dest, destenc):
         for source in src:
             data.append(parse_student_csv(source))
         database = functools.reduce(lambda a, b: a.union(b), data)
-        write_xml(database.to_xml(), dest, encoding=destenc)
+        print_renames(database)
+        save_students(database, dest, encoding=destenc)
 
 
 @students.command()
-@click.option('--students', 'students', default=default_students_filepath(), help="students.xml file to use")
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to use")
 @click.option('--to-To-header', 'to_header', flag_value='to_header', help="Print as SMTP To-Header")
 @click.option('--to-unprocessed-registrations', 'to_reg', flag_value=True, help="Print as Foswiki UnprocessedRegistrations article")
 @click.option('--to-group-meta-preferences', 'to_meta', flag_value=True, help="Print as %METAPREFERENCES")
 @click.option('--group-by-group', 'group', flag_value='group', default=None, help="Group elements by tutorial group")
 @click.option('--group-by-regdate', 'group', flag_value='regdate', help="Group elements by registration date")
+@click.option('--regdate-bucket', 'bucket', default='batch', type=click.Choice(RegistrationIndex.buckets), help="Group registration dates by update batch, day or week")
 @click.option('--all-email', 'elements', flag_value='email', help="Print all email addresses")
 @click.option('--all-wikiname', 'elements', flag_value='wikiname', help="Print all wikinames")
 @click.option('--all-matriculation-number', 'elements', flag_value='matrnr', help="Print all matriculation numbers")
 @click.option('--filter', 'filters', multiple=True, help="Apply filter '--filter X=Y' where X is eg. matrnr")
 @click.option('--filter-newer-than', 'newer', help="Only print entries newer than the parameter")
 @click.option('--filter-older-than', 'older', help="Only print entries older than the parameter")
-def read(students, group, elements, to_header, to_reg, to_meta, filters, newer, older):
-    db = StudentDatabase()
-    xml = read_xml(students)
-    db = db.from_xml(xml)
+@click.option('--to-ndjson', 'to_ndjson', flag_value=True, help="Print one JSON object per student")
+@click.option('--to-csv', 'to_csv', flag_value=True, help="Print as CSV with a header row")
+@click.option('--output', 'output', help="file to write to instead of stdout")
+@click.option('--encoding', 'encoding', default='utf-8', help="encoding of the --output file")
+def read(students, group, bucket, elements, to_header, to_reg, to_meta, filters, newer, older,
+         to_ndjson, to_csv, output, encoding):
+    db = load_students(students)
 
     # apply filter
     for filt in filters:
@@ -1793,109 +5820,48 @@ def read(students, group, elements, to_header, to_reg, to_meta, filters, newer,
         if key == "matrnr" or key == "group":
             value = int(value)
         db = db.filter(**{ key: value })
-    if newer:
-        db = db.filter(regdate_greater=parse_date(newer))
-    if older:
-        db = db.filter(regdate_smaller=parse_date(older))
-
-    # To-Header
-    if to_header:
-        if elements == 'matrnr':
-            raise ValueError('To-Header with matriculation number is nonsense')
-        db = db.sorted_by_wikiname()
-        if group == 'group':
-            by_groups = db.group_by_group()
-            for grp, students in by_groups.items():
-                addrs = []
-                for s in students:
-                    addrs.append('"{} {}" <{}>'.format(s.firstname, s.lastname, s.email))
-                print('Group {}'.format(grp))
-                print('  To: ' + ', '.join(addrs))
-        elif group == 'regdate':
-            by_regdate = db.group_by_regdate()
-            for regdate, students in by_regdate.items():
-                addrs = []
-                for s in students:
-                    addrs.append('"{} {}" <{}>'.format(s.firstname, s.lastname, s.email))
-                print('Registration date {}'.format(regdate.isoformat()))
-                print('  To: ' + ', '.join(addrs))
-        else:
-            addrs = []
-            for s in db:
-                addrs.append('"{} {}" <{}>'.format(s.firstname, s.lastname, s.email))
-            print('To: ' + ', '.join(addrs))
-
-    # UnprocessedRegistrations
-    elif to_reg:
-        if group == 'group':
-            db = db.sorted_by_group()
-        elif group == 'regdate':
-            db = db.sorted_by_registration_date()
-        else:
-            db = db.sorted_by_wikiname()
-
-        data = [['Email', 'WikiName', 'LastName', 'FirstName']]
-        for student in db:
-            data.append([s.email, s.wikiname, s.lastname, s.firstname])
-
-        print_foswiki_table(data)
-
-    # %METAPREFERENCES%
-    elif to_meta:
-        meta = '%META:PREFERENCE{{name="GROUP" title="GROUP" type="Set" value="{}"}}%'
-
-        if group == 'group':
-            by_groups = db.group_by_group()
-            for grp, students in by_groups.items():
-                print('Group {}'.format(grp))
-                print('  ' + meta.format(', '.format(s.wikiname for s in students)))
-        elif group == 'regdate':
-            by_regdate = db.group_by_regdate()
-            for regdate, students in by_regdate.items():
-                print('Registration date {}'.format(regdate.isoformat()))
-                print('  ' + meta.format(', '.format(s.wikiname for s in students)))
+    if newer or older:
+        # one query, so the registration index is searched once for both bounds
+        db = db.filter(regdate_greater=parse_date(newer) if newer else None,
+                       regdate_smaller=parse_date(older) if older else None)
+
+    fields = [elements] if elements else None
+    if to_header and elements == 'matrnr':
+        raise ValueError('To-Header with matriculation number is nonsense')
+
+    with contextlib.ExitStack() as stack:
+        if output:
+            stream = stack.enter_context(open(output, 'w', encoding=encoding, newline=''))
         else:
-            value = ', '.join([s.wikiname for s in db])
-            print(meta.format(value))
+            stream = sys.stdout
 
-    else:
-        def grouped(attr):
-            if group == 'group':
-                by_groups = db.group_by_group()
-                for grp, students in by_groups.items():
-                    print('---++ Group {}'.format(grp))
-                    for s in students:
-                        print(getattr(s, attr))
-                    print()
-            elif group == 'regdate':
-                by_regdate = db.group_by_regdate()
-                for regdate, students in by_regdate.items():
-                    print('---++ Registration date {}'.format(regdate.isoformat()))
-                    for s in students:
-                        print(getattr(s, attr))
-                    print()
-            else:
-                db = db.sorted_by_matriculation_number()
-                for s in db:
-                    print(getattr(s, attr))
-
-
-        if elements == 'matrnr':
-            grouped('matrnr')
-        elif elements == 'email':
-            grouped('email')
-        elif elements == 'wikiname':
-            grouped('wikiname')
+        # sorting applies to ungrouped output, tables are never grouped
+        order = None
+        if to_header:
+            db = db.sorted_by_wikiname()
+            renderer = ToHeaderRenderer(stream)
+        elif to_reg:
+            order = {'group': 'sorted_by_group', 'regdate': 'sorted_by_registration_date'} \
+                .get(group, 'sorted_by_wikiname')
+            group = None
+            renderer = FoswikiTableRenderer(stream, ['email', 'wikiname', 'lastname', 'firstname'],
+                ['Email', 'WikiName', 'LastName', 'FirstName'])
+        elif to_meta:
+            renderer = MetaPreferenceRenderer(stream)
+        elif to_ndjson:
+            renderer = NDJSONRenderer(stream, fields)
+        elif to_csv:
+            renderer = CSVRenderer(stream, fields, grouped=bool(group))
+        elif elements:
+            order = 'sorted_by_matriculation_number'
+            renderer = ElementsRenderer(stream, fields)
         else:
-            data = [['Matriculation number', 'Group', 'Wikiname', 'Lastname',
-                'Firstname', 'Degree', 'Registration date', 'Email address',
-                'Grade']]
-            for s in db:
-                data.append([s.matrnr, ','.join(map(str, s.group)), s.wikiname,
-                    s.lastname, s.firstname, s.degree, s.regdate, s.email,
-                    s.grade])
+            group = None
+            renderer = FoswikiTableRenderer(stream)
 
-            print_foswiki_table(data)
+        render_students(renderer, db, group=group, bucket=bucket, order=order)
+        if output:
+            info('Wrote students to {}', output)
 
 
 @students.command()
@@ -1904,13 +5870,23 @@ def read(students, group, elements, to_header, to_reg, to_meta, filters, newer,
 @click.option('--from-xml', 'xmlsrc', help='some other students.xml to merge with students.xml')
 @click.option('--from-csv', 'csvsrc', help='retrieve students from a TU Graz CSV export')
 @click.option('--from-encoding', 'srcenc', default='utf-8-sig', help='Encoding of source text file')
-@click.option('--to-xml', 'dest', default=default_students_filepath(), help='some other students.xml to merge with students.xml')
+@click.option('--to-xml', 'dest', help='students.xml (or *.sqlite) to write to [default: --students]')
 @click.option('--to-encoding', 'destenc', default='utf-8', help='some other students.xml to merge with students.xml')
 @click.option('--import-grade', 'gradescsv', help='Import grades from the CSV file')
 def update(students, matrnr, xmlsrc, csvsrc, srcenc, dest, destenc, gradescsv):
-    xml = read_xml(students)
-    db = StudentDatabase()
-    db = db.from_xml(xml)
+    dest = dest or students
+    db = load_students(students)
+
+    # SQLite stores are updated in place
+    if isinstance(db, SQLiteStudentStore) and dest == students and not matrnr:
+        if csvsrc:
+            db.update(parse_student_csv(csvsrc, encoding=srcenc))
+        elif xmlsrc:
+            db.update(StudentDatabase().from_xml(read_xml(xmlsrc)))
+        print_renames(db)
+        return
+    if isinstance(db, SQLiteStudentStore):
+        db = db.sorted_by_matriculation_number()
 
     if matrnr:
         try:
@@ -1950,27 +5926,64 @@ def update(students, matrnr, xmlsrc, csvsrc, srcenc, dest, destenc, gradescsv):
             if attr == 'regdate' and val.strip() == 'now':
                 student.regdate = datetime.datetime.now()
             elif attr == 'regdate':
-                student.regdate = parse_date(student)
+                student.regdate = parse_date(val)
             elif val:
                 setattr(student, attr, val)
 
-        write_xml(db.to_xml(), dest, descenc)
+        save_students(db, dest, encoding=destenc)
 
     elif csvsrc:
-        db2 = parse_student_csv(csvsrc, encoding=srcenc)
-        write_xml(db.union(db2).to_xml(), dest, encoding=destenc)
+        db = db.union(parse_student_csv(csvsrc, encoding=srcenc))
+        print_renames(db)
+        save_students(db, dest, encoding=destenc)
 
     elif xmlsrc:
         xml = read_xml(xmlsrc)
         db2 = StudentDatabase()
         db2 = db2.from_xml(xml)
         db = db.union(db2)
-        write_xml(db.to_xml(), dest, encoding=destenc)
+        save_students(db, dest, encoding=destenc)
+
+@students.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to update")
+@click.option('--from-dir', 'directory', required=True, help="directory containing TUGrazOnline CSV exports")
+@click.option('--pattern', 'pattern', default='TN_*.csv', help="filename pattern of the CSV exports")
+@click.option('--from-encoding', 'srcenc', default='utf-8-sig', help="encoding of CSV files")
+@click.option('--to-encoding', 'destenc', default='utf-8', help="students.xml encoding")
+@click.option('--state', 'statefile', default=default_sync_state_filepath(), help="record of ingested exports")
+@click.option('--workers', 'workers', type=int, help="maximum number of parallel parsers")
+def sync(students, directory, pattern, srcenc, destenc, statefile, workers):
+    """Apply new TUGrazOnline exports of a directory to the database"""
+    db = load_students(students)
+    state = SyncState(statefile)
+    filepaths = glob.glob(os.path.join(directory, pattern))
+    db, delta = sync_students(db, filepaths, state, encoding=srcenc, workers=workers)
+
+    if delta.added or delta.removed or delta.regrouped:
+        if not isinstance(db, SQLiteStudentStore):
+            save_students(db, students, encoding=destenc, force=True)
+    state.save()
+
+    print_renames(db)
+    for s in sorted(delta.added, key=lambda s: s.matrnr):
+        info('New registration: {} {} {}', s.matrnr, s.firstname, s.lastname)
+    for matrnr, groups in sorted(delta.regrouped.items()):
+        info('Groups of {} changed to {}', matrnr, sorted(groups))
+    for matrnr in sorted(delta.removed):
+        info('De-registered: {}', matrnr)
+    print('{} new registrations, {} group changes, {} de-registrations'.format(
+        len(delta.added), len(delta.regrouped), len(delta.removed)))
+
 
 @students.command()
 @click.option('--students', 'students', default=default_students_filepath(), help='a students.xml to work with')
 @click.option('--matriculation-number', 'matrnr', help='matriculation number of the student to delete')
 def delete(students, matrnr):
+    if is_sqlite_filepath(students):
+        with SQLiteStudentStore(students) as store:
+            store.delete(int(matrnr))
+        return
+
     # TODO: this sucks
     encoding = ''
     with open(students, 'rb') as fp:
@@ -1981,14 +5994,242 @@ def delete(students, matrnr):
     xml = read_xml(students)
     db = StudentDatabase()
     db = db.from_xml(xml)
-    print("Database contained {} students.".format(len(db)))
+    info("Database contained {} students.", len(db))
     db = db.filter(not_matrnr=int(matrnr))
-    print("Database now contains {} students.".format(len(db)))
+    info("Database now contains {} students.", len(db))
     write_xml(db.to_xml(), students, encoding=encoding)
 
 @students.command()
-def export():
-    pass
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to use")
+@click.option('--template', 'template', required=True, help="mail template: header lines, an empty line and the body")
+@click.option('--template-encoding', 'tenc', default='utf-8', help="encoding of the mail template")
+@click.option('--per-student', 'per', flag_value='student', default='student', help="Send one message per student")
+@click.option('--per-group', 'per', flag_value='group', help="Send one message per tutorial group (students in Bcc)")
+@click.option('--group', 'group', help="only mail these groups (comma-separated); group 0 only if given")
+@click.option('--filter', 'filters', multiple=True, help="Apply filter '--filter X=Y' where X is eg. matrnr")
+@click.option('--from', 'sender', required=True, help="From address of the messages")
+@click.option('--smtp-host', 'host', default='localhost', help="SMTP server")
+@click.option('--smtp-port', 'port', default=25, help="SMTP port")
+@click.option('--smtp-starttls', 'starttls', default=False, flag_value=True, help="Use STARTTLS")
+@click.option('--smtp-user', 'user', help="SMTP user name")
+@click.option('--smtp-password', 'password', envvar='GDI_SMTP_PASSWORD', help="SMTP password [env: GDI_SMTP_PASSWORD]")
+@click.option('--connections', 'connections', default=4, help="number of parallel SMTP connections")
+@click.option('--rate', 'rate', default=5.0, help="maximum number of messages per second (0 for unlimited)")
+@click.option('--retries', 'retries', default=3, help="number of retries per message")
+@click.option('--max-recipients', 'max_recipients', default=50, help="maximum number of recipients per group message")
+@click.option('--dry-run', 'dry_run', default=False, flag_value=True, help="Print the messages instead of sending them")
+def mail(students, template, tenc, per, group, filters, sender, host, port, starttls,
+    user, password, connections, rate, retries, max_recipients, dry_run):
+    """Send templated mails to students"""
+    db = load_students(students)
+    for filt in filters:
+        if '=' not in filt:
+            raise ValueError('--filter must specify key=value pairs')
+        key, value = filt.split('=')
+        if key == "matrnr" or key == "group":
+            value = int(value)
+        db = db.filter(**{ key: value })
+
+    tmpl = read_mail_template(template, encoding=tenc)
+    if group is None:
+        groups = db.all_groups().difference({0,})
+    else:
+        groups = {int(g) for g in group.split(',')}
+
+    if per == 'group':
+        mails = group_mails(db, tmpl, sender, groups, max_recipients=max_recipients)
+    else:
+        db = StudentDatabase.filtered(db, [lambda s: bool(s.group & groups)])
+        mails = student_mails(db.sorted_by_wikiname(), tmpl, sender)
+
+    if dry_run:
+        for msg, recipients in mails:
+            print('Envelope-To: ' + ', '.join(recipients))
+            print(msg.as_string())
+        return
+
+    async def run():
+        pool = SMTPPool(host, port, connections, starttls=starttls,
+            user=user, password=password)
+        return await send_mails(mails, pool, rate=rate, retries=retries)
+
+    sent, failed = asyncio.run(run())
+    print('{} messages sent, {} failed'.format(sent, failed))
+    if failed:
+        raise SystemExit(1)
+
+
+@students.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to update")
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help="metadata.xml with groups, capacities and tutor limits")
+@click.option('--preferences', 'preferences', help="CSV file: matriculation number and groups, most preferred first")
+@click.option('--preferences-encoding', 'penc', default='utf-8-sig', help="encoding of the preferences file")
+@click.option('--reassign', 'reassign', default=False, flag_value=True, help="Also move students who already have a group")
+@click.option('--to-encoding', 'destenc', default='utf-8', help="students.xml encoding")
+@click.option('--dry-run', 'dry_run', default=False, flag_value=True, help="Print the group loads without saving")
+def assign(students, metadata, preferences, penc, reassign, destenc, dry_run):
+    """Assign students without tutorial group to groups.
+    This includes students registered in group 0 only: TUGrazOnline lists
+    practicals participants without group in the default group 0, too.
+    """
+    db = load_students(students)
+    config = load_config(metadata)
+    prefs = read_group_preferences(preferences, encoding=penc) if preferences else {}
+
+    assignment, unassigned = assign_groups(config, db, prefs, reassign=reassign)
+    regrouped = {}
+    for s in db:
+        if s.matrnr in assignment:
+            regrouped[s.matrnr] = s.group.difference(config.groups) | {assignment[s.matrnr]}
+    # counted before applying, SQLite stores are changed in place
+    capacity = group_capacities(config, len(db))
+    before = collections.Counter(g for s in db for g in s.group)
+    after = collections.Counter(g for s in db for g in regrouped.get(s.matrnr, s.group))
+    db_after = db if dry_run else db.apply_delta(RegistrationDelta([], set(), regrouped))
+    data = [['Group', 'Tutor', 'Capacity', 'Before', 'After']]
+    for g in sorted(config.groups):
+        data.append([g, config.groups[g], capacity[g], before[g], after[g]])
+    print_foswiki_table(data)
+
+    for s in unassigned:
+        warn('No free seat for {} {} {}', s.matrnr, s.firstname, s.lastname)
+    print('{} students assigned, {} without seat'.format(len(assignment), len(unassigned)))
+    if not dry_run and regrouped and not isinstance(db_after, SQLiteStudentStore):
+        save_students(db_after, students, encoding=destenc, force=True)
+
+
+@students.command()
+@click.option('--store', 'store', required=True, help="directory of the sharded store")
+@click.option('--course', 'course', required=True, help="course identifier like 716.231")
+@click.option('--term', 'term', help="term of the students (default: from the filename)")
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file of the course and term")
+@click.option('--state', 'statefile', default=default_sync_state_filepath(), help="record of ingested exports; only the course roster is stored if known")
+@click.option('--to-encoding', 'destenc', default='utf-8', help="encoding of the shard")
+def shard(store, course, term, students, statefile, destenc):
+    """Add the students of a course and term to a sharded store"""
+    db = load_students(students)
+    term = term or file_term(students)
+    roster = SyncState(statefile).roster(re.sub(r'\D', '', course))
+    if roster:
+        db = StudentDatabase.filtered(db, [lambda s: s.matrnr in roster])
+
+    sharded = ShardedStudentStore(store)
+    sharded.add_shard(course, term, db, encoding=destenc)
+    data = [['Course', 'Term', 'File', 'Students']]
+    for sh in sharded.shards:
+        data.append([sh['course'], sh['term'], sh['file'], sh['students']])
+    print_foswiki_table(data)
+
+
+@students.command('carry-over')
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml of the current term")
+@click.option('--from', 'sources', multiple=True, required=True, help="students-YY.xml or term-YY.zip of a previous term")
+@click.option('--to-xml', 'dest', help="students.xml to write [default: --students]")
+@click.option('--to-encoding', 'destenc', default='utf-8', help="students.xml encoding")
+def carry_over_command(students, sources, dest, destenc):
+    """Annotate repeating students with grades of previous terms"""
+    if is_sqlite_filepath(students) or (dest and is_sqlite_filepath(dest)):
+        raise ValueError('Records of previous terms are only kept in students.xml')
+    db = load_students(students)
+    annotated = carry_over(db, sources)
+
+    data = [['Matriculation number', 'Name', 'Term', 'Group', 'Grade']]
+    for s in db.sorted_by_matriculation_number():
+        if s.matrnr in annotated:
+            for record in s.history:
+                data.append([s.matrnr, s.firstname + ' ' + s.lastname,
+                    record.term, record.group, record.grade or ''])
+    print_foswiki_table(data)
+    print('{} of {} students took the course before'.format(len(annotated), len(db)))
+    save_students(db, dest or students, encoding=destenc, force=dest is None)
+
+
+@students.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to use")
+@click.option('--max-distance', 'max_distance', default=2, help="maximum edit distance of names considered equal")
+def duplicates(students, max_distance):
+    """Find students who probably registered twice"""
+    db = load_students(students)
+    data = [['Matriculation number', 'Name', 'Email address',
+        'Matriculation number', 'Name', 'Email address', 'Distance']]
+    for c in find_duplicates(db, max_distance=max_distance):
+        data.append([c.first.matrnr, c.first.firstname + ' ' + c.first.lastname,
+            c.first.email, c.second.matrnr,
+            c.second.firstname + ' ' + c.second.lastname, c.second.email,
+            c.distance])
+    print_foswiki_table(data)
+
+
+@students.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to export")
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help="metadata.xml listing the courses")
+@click.option('--to-csv', 'dest', default=default_grades_filepath(), help="CSV file per course, '{course}' is replaced by its identifier")
+@click.option('--to-encoding', 'destenc', default='utf-8-sig', help="CSV encoding")
+@click.option('--dialect', 'dialect', type=click.Choice(['semicolon', 'comma']), default='semicolon', help="CSV field separator")
+@click.option('--state', 'statefile', default=default_sync_state_filepath(), help="record of ingested exports with the course rosters")
+@click.option('--all-students', 'all_students', default=False, flag_value=True, help="export all students to courses without known roster")
+@click.option('--format', 'fmt', type=click.Choice(['grades', 'columns', 'npz']), default='grades', help="grade upload CSV or typed columns for analytics")
+@click.option('--to-file', 'colfile', help="columnar file to write (default: students.gdicol or students.npz)")
+def export(students, metadata, dest, destenc, dialect, statefile, all_students, fmt, colfile):
+    """Write the TUGrazOnline grade upload CSV of every course
+    or the student database as typed columns
+    """
+    db = load_students(students)
+    if fmt != 'grades':
+        colfile = colfile or default_columns_filepath(fmt)
+        writer = write_npz if fmt == 'npz' else write_columns
+        count = writer(colfile, db)
+        print('{}: {} students'.format(colfile, count))
+        return
+
+    config = load_config(metadata)
+    courses = sorted(c['id'] for c in config.courses)
+
+    rosters = SyncState(statefile).course_rosters(courses)
+    dialects = {'semicolon': csv_export_dialect_semicolon, 'comma': csv_export_dialect}
+    counts = export_student_csv(dest, db, encoding=destenc, courses=courses,
+        rosters=rosters, all_students=all_students, dialect=dialects[dialect])
+    for filepath, count in sorted(counts.items()):
+        print('{}: {} students'.format(filepath, count))
+
+
+@students.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml (or *.sqlite) file to use")
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help="metadata.xml listing the assignments")
+@click.option('--assignment', 'assignments', multiple=True, help="assignment to check [default: all with partner submissions]")
+@click.option('--wiki-path', 'wikipath', help="wiki directory [default: wikipath of metadata.xml]")
+@click.option('--cache', 'cachefile', default=default_partner_cache_filepath(), help="cache of parsed topics, '' disables it")
+@click.option('--workers', 'workers', default=8, help="number of threads reading topics")
+def partners(students, metadata, assignments, wikipath, cachefile, workers):
+    """Check partner declarations of partner submission topics"""
+    config = load_config(metadata)
+    db = load_students(students)
+    wikipath = wikipath or config.wikipath
+
+    selected = [a for a in config.assignments if a['partnersubmission']
+                and (not assignments or a['name'] in assignments)]
+    unknown = set(assignments).difference(a['name'] for a in selected)
+    if unknown:
+        raise ValueError('No partner submissions for assignment(s) {}'.format(', '.join(sorted(unknown))))
+
+    # students of the lecture only (group 0) do not submit
+    practicals = [s for s in db if s.group - {0}]
+    cache = PartnerTopicCache(cachefile)
+    for assignment in selected:
+        paths = [partner_topic_filepath(wikipath, s.wikiname, assignment['partnersubmission'])
+                 for s in practicals]
+        topics, parsed = read_partner_topics(paths, cache, workers=workers)
+        graph = partner_graph(practicals, topics, assignment['partnersubmission'], wikipath)
+        issues = graph.check(practicals)
+
+        print('{}: {} topics of {} students ({} parsed), {} issues'.format(assignment['name'],
+            sum(1 for t in topics.values() if t is not None), len(practicals), parsed, len(issues)))
+        if issues:
+            print_cli_table([['kind', 'student', 'partners', 'detail']] + [list(i) for i in issues],
+                2, stream=sys.stdout)
+        print()
+    cache.save()
+
 
 @students.command()
 def diff():
@@ -2007,34 +6248,77 @@ def spreadsheets():
 @click.option('--group', 'group', help='group to create spreadsheet for')
 @click.option('--to-csv', 'csv', default=default_spreadsheet_filepath(), help='spreadsheet to write')
 @click.option('--to-encoding', 'csvenc', help='encoding of spreadsheet CSV')
-def create(students, metadata, grading, genc, group, csv, csvenc):
-    config = Config()
-    config.from_xml(read_xml(metadata))
-    xml = read_xml(students)
-    db = StudentDatabase()
-    db = db.from_xml(xml)
-    table = parse_grading_points(grading)
+@click.option('--format', 'fmt', default='csv', type=click.Choice(['csv', 'workbook']), help='one CSV per group and assignment or XLSX workbooks')
+@click.option('--workbook-per', 'per', default='group', type=click.Choice(['group', 'course']), help='one workbook per group or one for all groups')
+@click.option('--to-xlsx', 'xlsx', help="workbook to write (implies --format workbook) [default: group{group}.xlsx or groups-YY.xlsx]")
+@click.option('--manifest', 'manifest', default=default_manifest_filepath(), help='build manifest recording the inputs of generated files')
+@click.option('--force', 'force', default=False, flag_value=True, help='regenerate files even if their inputs did not change')
+def create(students, metadata, grading, genc, group, csv, csvenc, fmt, per, xlsx, manifest, force):
+    config = load_config(metadata)
+    db = load_students(students)
+    table = cached(grading, GradingScheme.from_file, encoding=genc)
+    manifest = BuildManifest(manifest, force=force)
 
     if group is None:
         groups = db.all_groups()
     else:
         groups = {int(g) for g in group.split(',')}
 
-    for grp in groups:
-        if "{group}" not in csv:
-            raise ValueError("Please provide '{group}' in --to-csv to insert group name to filename")
-        if "{assignment}" not in csv:
-            raise ValueError("Please provide '{assignment}' in --to-csv to insert assignment name to filename")
-        create_group_spreadsheets(config, db, table, grp, csv, csvenc)
-        create_title_group_spreadsheet(config, db, table, grp, csv, csvenc)
+    try:
+        if xlsx or fmt == 'workbook':
+            xlsx = xlsx or default_workbook_filepath(per)
+            if per == 'course':
+                create_course_workbook(config, db, table, groups, xlsx, manifest=manifest)
+                return
+            if "{group}" not in xlsx:
+                raise ValueError("Please provide '{group}' in --to-xlsx to insert group name to filename")
+            for grp in groups:
+                create_group_workbook(config, db, table, grp, xlsx, manifest=manifest)
+            return
+
+        for grp in groups:
+            if "{group}" not in csv:
+                raise ValueError("Please provide '{group}' in --to-csv to insert group name to filename")
+            if "{assignment}" not in csv:
+                raise ValueError("Please provide '{assignment}' in --to-csv to insert assignment name to filename")
+            create_group_spreadsheets(config, db, table, grp, csv, csvenc, manifest=manifest)
+            create_title_group_spreadsheet(config, db, table, grp, csv, csvenc, manifest=manifest)
+    finally:
+        manifest.save()
 
 @spreadsheets.command()
 def read():
     pass
 
 @spreadsheets.command()
-def update():
-    pass
+@click.option('--students', 'students', default=default_students_filepath(), help='students.xml to retrieve students data from')
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help='metadata.xml to retrieve metadata data from')
+@click.option('--grading', 'grading', default=default_gradingpoints_filepath(), help='Foswiki article specifying grading points')
+@click.option('--grading-encoding', 'genc', default='utf-8-sig', help='grading points file encoding')
+@click.option('--group', 'group', help='group to update spreadsheets for')
+@click.option('--csv', 'csv', default=default_spreadsheet_filepath(), help='spreadsheets to update')
+@click.option('--encoding', 'csvenc', default='utf-8-sig', help='encoding of spreadsheet CSV')
+@click.option('--manifest', 'manifest', default=default_manifest_filepath(), help='build manifest recording the inputs of generated files')
+def update(students, metadata, grading, genc, group, csv, csvenc, manifest):
+    config = load_config(metadata)
+    db = load_students(students)
+    table = cached(grading, GradingScheme.from_file, encoding=genc)
+    manifest = BuildManifest(manifest)
+
+    if group is None:
+        groups = db.all_groups()
+    else:
+        groups = {int(g) for g in group.split(',')}
+
+    if "{group}" not in csv:
+        raise ValueError("Please provide '{group}' in --csv to insert group name to filename")
+    if "{assignment}" not in csv:
+        raise ValueError("Please provide '{assignment}' in --csv to insert assignment name to filename")
+    try:
+        for grp in groups:
+            update_group_spreadsheets(config, db, table, grp, csv, csvenc, manifest=manifest)
+    finally:
+        manifest.save()
 
 @cli.group()
 def foswiki():
@@ -2065,6 +6349,130 @@ def recreate():
     """Getting ready for the next semester"""
     pass
 
+@recreate.command()
+@click.option('--term', 'term', default=default_term(), help="term to archive (two-digit year)")
+@click.option('--students', 'students', help="students.xml of the term [default: students-$term.xml]")
+@click.option('--metadata', 'metadata', help="metadata.xml of the term [default: metadata-$term.xml]")
+@click.option('--include', 'patterns', multiple=True, help="additional files to archive (glob pattern)")
+@click.option('--to-zip', 'dest', help="archive to write [default: term-$term.zip]")
+@click.option('--to-encoding', 'destenc', default='utf-8', help="encoding of the new metadata.xml")
+def archive(term, students, metadata, patterns, dest, destenc):
+    """Archive a term and seed the metadata of the next term"""
+    students = students or default_students_filepath(term)
+    metadata = metadata or default_metadata_filepath(term)
+    spreadsheets = default_spreadsheet_filepath().format(group='*', assignment='*')
+    patterns = [spreadsheets, 'group*.xlsx', 'groups-{}.xlsx'.format(term),
+        default_gradingpoints_filepath(), default_manifest_filepath()] + list(patterns)
+
+    term_archive, config = archive_term(term, students, metadata, patterns,
+        dest or default_archive_filepath(term))
+    print('Archived {} files to {}'.format(len(term_archive.names()), term_archive.filepath))
+
+    seeded = default_metadata_filepath(next_term(term))
+    write_xml(next_term_config(config).to_xml(), seeded, encoding=destenc)
+
+@recreate.command()
+@click.option('--matriculation-number', 'matrnr', required=True, type=int, help="student to look up")
+@click.option('--archives', 'archives', default=default_archive_filepath('*'), help="archives to search (glob pattern)")
+def lookup(matrnr, archives):
+    """Show in which archived terms a student took the course"""
+    data = [['Term', 'Group', 'Grade']]
+    for filepath in sorted(glob.glob(archives)):
+        term_archive = TermArchive(filepath)
+        found = term_archive.lookup(matrnr)
+        if found is not None:
+            grade, group = found
+            data.append([term_archive.term, group, grade or ''])
+    if len(data) == 1:
+        print('Student {} not found in any archive'.format(matrnr))
+    else:
+        print_foswiki_table(data)
+
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', default=default_socket_filepath(), help="Unix socket to listen on [env: GDI_SOCKET]")
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml to load in advance")
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help="metadata.xml to load in advance")
+@click.option('--grading', 'grading', default=default_gradingpoints_filepath(), help="grading points to load in advance")
+@click.option('--grading-encoding', 'genc', default='utf-8-sig', help="grading points file encoding")
+@click.option('--poll', 'poll', default=1.0, help="seconds between checks of the loaded files for changes")
+def serve(socket_path, students, metadata, grading, genc, poll):
+    """Serve 'students read', 'spreadsheets create' and 'stats' commands
+    of client.py over a Unix socket, keeping parsed files in memory
+    """
+    global file_cache
+    file_cache = FileCache()
+    if os.path.exists(students) and not is_sqlite_filepath(students):
+        load_students(students)
+    if os.path.exists(metadata):
+        load_config(metadata)
+    if os.path.exists(grading):
+        cached(grading, GradingScheme.from_file, encoding=genc)
+    asyncio.run(serve_commands(socket_path, poll=poll))
+
+
+@cli.command()
+@click.option('--students', 'students', default=default_students_filepath(), help="students.xml to watch")
+@click.option('--metadata', 'metadata', default=default_metadata_filepath(), help="metadata.xml to watch")
+@click.option('--grading', 'grading', default=default_gradingpoints_filepath(), help="grading points to watch")
+@click.option('--grading-encoding', 'genc', default='utf-8-sig', help="grading points file encoding")
+@click.option('--csv', 'csvpath', default=default_spreadsheet_filepath(), help="spreadsheets to keep up to date")
+@click.option('--encoding', 'csvenc', default='utf-8-sig', help="encoding of spreadsheet CSV")
+@click.option('--manifest', 'manifest', default=default_manifest_filepath(), help="build manifest recording the inputs of generated files")
+@click.option('--registrations', 'registrations', help="also keep this Foswiki UnprocessedRegistrations table up to date")
+@click.option('--grades', 'grades', help="also keep grade exports up to date, '{course}' is replaced")
+@click.option('--state', 'statefile', default=default_sync_state_filepath(), help="record of ingested exports with the course rosters")
+@click.option('--debounce', 'debounce', default=0.5, help="seconds without changes before rebuilding")
+@click.option('--poll', 'poll', default=1.0, help="seconds between checks if inotify is unavailable")
+@click.option('--once', 'once', default=False, flag_value=True, help="Build everything once and exit")
+def watch(students, metadata, grading, genc, csvpath, csvenc, manifest, registrations,
+    grades, statefile, debounce, poll, once):
+    """Regenerate spreadsheets and exports when their inputs change"""
+    global file_cache
+    file_cache = FileCache()
+    if "{group}" not in csvpath or "{assignment}" not in csvpath:
+        raise ValueError("Please provide '{group}' and '{assignment}' in --csv")
+
+    def build_spreadsheets():
+        db = load_students(students)
+        config = load_config(metadata)
+        table = cached(grading, GradingScheme.from_file, encoding=genc)
+        builds = BuildManifest(manifest)
+        try:
+            for grp in sorted(db.all_groups()):
+                update_group_spreadsheets(config, db, table, grp, csvpath, csvenc, manifest=builds)
+        finally:
+            builds.save()
+
+    def build_grades():
+        config = load_config(metadata)
+        courses = sorted(c['id'] for c in config.courses)
+        rosters = SyncState(statefile).course_rosters(courses)
+        export_student_csv(grades, load_students(students), courses=courses, rosters=rosters)
+
+    rules = [WatchRule('spreadsheets', [students, metadata, grading], build_spreadsheets)]
+    if registrations:
+        rules.append(WatchRule(registrations, [students],
+            lambda: write_registrations(load_students(students), registrations)))
+    if grades:
+        rules.append(WatchRule('grade exports', [students, metadata, statefile], build_grades))
+
+    run_rules(rules)
+    if once:
+        return
+
+    watcher = file_watcher({i for r in rules for i in r.inputs}, interval=poll)
+    print('Watching {} files'.format(len({i for r in rules for i in r.inputs})), flush=True)
+    try:
+        while True:
+            changed = wait_for_changes(watcher, debounce=debounce)
+            info('Changed: {}', ', '.join(sorted(changed)))
+            run_rules(affected_rules(rules, changed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 if __name__ == '__main__':
     sys.exit(cli(sys.argv[1:]))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    test_assign.py
+    ~~~~~~~~~~~~~~
+
+    Tests of the group assignment (`control.assign_groups`), its
+    min-cost flow solver and the 'students assign' command.
+
+    python -m pytest test_assign.py
+
+    (C) 2014, Lukas Prokop
+"""
+
+import re
+import datetime
+import collections
+
+from click.testing import CliRunner
+
+import control
+
+
+def student(matrnr, group=(0,), minute=0):
+    s = control.Student()
+    s.matrnr = matrnr
+    s.group = set(group)
+    s.firstname = 'Student'
+    s.lastname = 'Number{}'.format(matrnr)
+    s.wikiname = 'Student{}'.format(matrnr)
+    s.degree = '033.521'
+    s.regdate = datetime.datetime(2014, 10, 1, 8, 0) + datetime.timedelta(minutes=minute)
+    s.email = 'student{}@student.tugraz.at'.format(matrnr)
+    return s
+
+
+def course(capacities, *, limit=None):
+    """Config with one tutor per group and the given {group: capacity}"""
+    config = control.Config()
+    for grp, capacity in sorted(capacities.items()):
+        tutor = config.add_tutor('Tutor', str(grp), 't{}@example.org'.format(grp),
+            limit=limit)
+        config.add_group(tutor, grp, capacity)
+    for repr_, (mini, maxi) in enumerate([(88, 100), (76, 87), (63, 75),
+                                          (51, 62), (0, 50)], 1):
+        config.add_grade(repr_, mini, maxi)
+    return config
+
+
+def loads(assignment):
+    return collections.Counter(assignment.values())
+
+
+def test_min_cost_flow_prefers_cheap_paths():
+    net = control.MinCostFlow(4)
+    cheap = net.add_edge(0, 1, 2, 1)
+    expensive = net.add_edge(0, 2, 5, 3)
+    net.add_edge(1, 3, 5, 1)
+    net.add_edge(2, 3, 5, 1)
+    assert net.solve(0, 3, 4) == (4, 2 * 2 + 2 * 4)
+    assert (net.flow(cheap), net.flow(expensive)) == (2, 2)
+
+
+def test_min_cost_flow_limited_by_capacity():
+    net = control.MinCostFlow(3)
+    net.add_edge(0, 1, 3, 0)
+    net.add_edge(1, 2, 2, 7)
+    assert net.solve(0, 2, 10) == (2, 14)
+
+
+def test_groups_filled_evenly_within_capacities():
+    config = course({1: 4, 2: 4, 3: 4})
+    db = control.StudentDatabase([student(1000000 + i) for i in range(9)])
+    assignment, unassigned = control.assign_groups(config, db)
+    assert len(assignment) == 9 and not unassigned
+    assert loads(assignment) == {1: 3, 2: 3, 3: 3}
+
+
+def test_no_seat_beyond_capacity():
+    config = course({1: 2, 2: 1})
+    db = control.StudentDatabase([student(1000000 + i, minute=i) for i in range(5)])
+    assignment, unassigned = control.assign_groups(config, db)
+    assert loads(assignment) == {1: 2, 2: 1}
+    assert len(unassigned) == 2
+
+
+def test_tutor_limit():
+    config = course({1: 10, 2: 10}, limit=3)
+    db = control.StudentDatabase([student(1000000 + i) for i in range(8)])
+    assignment, unassigned = control.assign_groups(config, db)
+    assert loads(assignment) == {1: 3, 2: 3}
+    assert len(unassigned) == 2
+
+
+def test_preferences_earlier_registrations_first():
+    config = course({1: 1, 2: 1})
+    db = control.StudentDatabase([student(1000001, minute=5), student(1000002, minute=1)])
+    prefs = {1000001: [1], 1000002: [1]}
+    assignment, _ = control.assign_groups(config, db, prefs)
+    assert assignment == {1000002: 1, 1000001: 2}
+
+
+def test_only_students_without_tutorial_group():
+    config = course({1: 3, 2: 3})
+    db = control.StudentDatabase([student(1000001, (0, 1)), student(1000002, (0, 1)),
+        student(1000003, (0,)), student(1000004, (0,))])
+    assignment, unassigned = control.assign_groups(config, db)
+    # group 0 only means: lecture registration without tutorial group yet
+    assert sorted(assignment) == [1000003, 1000004]
+    assert loads(assignment) == {2: 2}
+    assert not unassigned
+
+    assignment, _ = control.assign_groups(config, db, reassign=True)
+    assert sorted(assignment) == [1000001, 1000002, 1000003, 1000004]
+    assert loads(assignment) == {1: 2, 2: 2}
+
+
+def assign_table(tmp_path, students_file, *args):
+    result = CliRunner().invoke(control.cli, ['students', 'assign',
+        '--students', students_file, '--metadata', str(tmp_path / 'metadata.xml')] + list(args))
+    assert result.exit_code == 0, result.output
+    rows = re.findall(r'^\| (\d+) \| (\S+) \| (\d+) \| (\d+) \| (\d+) \|$', result.output, re.M)
+    return {int(g): (int(before), int(after)) for g, _, _, before, after in rows}
+
+
+def test_assign_command_counts_before_and_after(tmp_path):
+    config = course({1: 4, 2: 4})
+    control.write_xml(config.to_xml(), str(tmp_path / 'metadata.xml'), force=True)
+    db = control.StudentDatabase([student(1000001, (0, 1)), student(1000002, (0,)),
+        student(1000003, (0,))])
+    expected = {1: (1, 2), 2: (0, 1)}
+
+    xml = str(tmp_path / 'students.xml')
+    control.save_students(db, xml, force=True)
+    assert assign_table(tmp_path, xml, '--dry-run') == expected
+    assert assign_table(tmp_path, xml) == expected
+
+    # SQLite stores are changed in place
+    sqlite = str(tmp_path / 'students.sqlite')
+    control.save_students(db, sqlite)
+    assert assign_table(tmp_path, sqlite) == expected
+    groups = {s.matrnr: s.group for s in control.load_students(sqlite)}
+    assert sorted(g - {0} for g in groups.values()) == [{1}, {1}, {2}]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    test_mail.py
+    ~~~~~~~~~~~~
+
+    Tests of `control.send_mails` against a local SMTP stand-in.
+    The stand-in speaks just enough SMTP for smtplib and can reject
+    transactions temporarily or recipients permanently.
+
+    python -m pytest test_mail.py
+
+    (C) 2014, Lukas Prokop
+"""
+
+import asyncio
+import email.message
+
+import pytest
+
+import control
+
+
+class SMTPStandIn:
+    """Minimal SMTP server. The first `temporary_failures` MAIL commands
+    are answered with 451, recipients in `refused` with 550.
+    """
+
+    def __init__(self, *, temporary_failures=0, refused=()):
+        self.temporary_failures = temporary_failures
+        self.refused = set(refused)
+        self.attempts = []   # recipients of every MAIL transaction
+        self.received = []   # (recipients, data) of delivered messages
+        self.server = None
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        def reply(line):
+            writer.write((line + '\r\n').encode('ascii'))
+
+        reply('220 localhost stand-in')
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('ascii').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self.attempts.append(recipients)
+                if self.temporary_failures:
+                    self.temporary_failures -= 1
+                    reply('451 try again later')
+                else:
+                    reply('250 ok')
+            elif verb == 'RCPT':
+                addr = command.split(':', 1)[1].strip().strip('<>')
+                if addr in self.refused:
+                    reply('550 no such user')
+                else:
+                    recipients.append(addr)
+                    reply('250 ok')
+            elif verb == 'DATA':
+                reply('354 end with .')
+                data = []
+                while True:
+                    line = await reader.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    data.append(line)
+                self.received.append((list(recipients), b''.join(data)))
+                reply('250 queued')
+            elif verb == 'QUIT':
+                reply('221 bye')
+                await writer.drain()
+                break
+            else:
+                reply('250 ok')
+            await writer.drain()
+        writer.close()
+
+
+def message(i):
+    msg = email.message.EmailMessage()
+    msg['From'] = 'tutor@example.org'
+    msg['Subject'] = 'GDI {}'.format(i)
+    msg.set_content('Hello {}'.format(i))
+    return msg
+
+
+def send(server, mails, **kwargs):
+    async def run():
+        await server.start()
+        try:
+            pool = control.SMTPPool('127.0.0.1', server.port, size=2, timeout=5)
+            return await asyncio.wait_for(control.send_mails(mails, pool,
+                backoff=0.01, **kwargs), timeout=10)
+        finally:
+            await server.stop()
+    return asyncio.run(run())
+
+
+def test_all_messages_delivered():
+    server = SMTPStandIn()
+    mails = [(message(i), ['student{}@example.org'.format(i)]) for i in range(10)]
+    assert send(server, mails) == (10, 0)
+    assert sorted(r for r, _ in server.received) == \
+        sorted([['student{}@example.org'.format(i)] for i in range(10)])
+
+
+def test_temporary_failures_are_retried():
+    server = SMTPStandIn(temporary_failures=2)
+    mails = [(message(i), ['student{}@example.org'.format(i)]) for i in range(3)]
+    assert send(server, mails, retries=3) == (3, 0)
+    assert len(server.received) == 3
+    assert len(server.attempts) == 5
+
+
+def test_temporary_failures_exhaust_retries():
+    server = SMTPStandIn(temporary_failures=10)
+    mails = [(message(0), ['student0@example.org'])]
+    assert send(server, mails, retries=2) == (0, 1)
+    assert len(server.attempts) == 3
+
+
+def test_permanent_failures_are_not_retried():
+    server = SMTPStandIn(refused={'gone@example.org'})
+    mails = [(message(0), ['gone@example.org']), (message(1), ['student1@example.org'])]
+    assert send(server, mails, retries=3) == (1, 1)
+    assert [r for r, _ in server.received] == [['student1@example.org']]
+    refused = [a for a in server.attempts if not a]
+    assert len(refused) == 1
+
+
+def test_failing_workers_do_not_block():
+    server = SMTPStandIn()
+    # messages without headers let every worker fail outside of SMTP errors
+    mails = ((None, ['student{}@example.org'.format(i)]) for i in range(100))
+    with pytest.raises(AttributeError):
+        send(server, mails)